@@ -0,0 +1,492 @@
+'''
+the absorption ratio (AR) of Kritzman, Li, Page and Rigobon (2010), computed for every date of a history of daily
+industry returns.
+
+for every date, the trailing window of returns is normalized (every industry to unit variance over the window) and
+the principal components are taken from the correlation matrix. The AR is the exponentially weighted variance of
+the first num_components principal components (a fifth of the number of industries) as a fraction of the total
+exponentially weighted variance. The 'unweighted AR' takes the plain variances (the eigenvalues) instead.
+
+the listing on the systemic risk page recomputes the covariance of the whole window, a general eigendecomposition
+and the variance of every principal component for every date. Here the window is summarised by RollingMoments,
+which updates the plain and the exponentially weighted sums of the returns and of their outer products with one
+rank-one step a day (adding the new day and dropping the day that leaves the window), so a date costs O(N^2)
+instead of O(window x N^2). The moments are recomputed from the window every refresh_every days so that rounding
+errors do not build up. The correlation matrices of a block of dates are then decomposed in one batched call of the
+symmetric eigensolver (np.linalg.eigh), and the weighted variance of a principal component v is v' C_w v, where C_w
+is the weighted covariance of the normalized returns (its trace is the total weighted variance, so only the leading
+components are needed). For large universes, eigen_method='top_k' finds only the leading eigenpairs of every date,
+warm started from the eigenvectors of the day before (see top_k_eigenpairs()); by default, the method is picked
+from the number of assets (see default_eigen_method()).
+
+the top-k path only pays off from about 400 assets (TOP_K_MIN_ASSETS). The AR takes a fifth of the assets as
+components, so k grows with N and the cost of a date does not scale with k instead of N: the Krylov basis of
+4 x (k + guard) vectors spans most of the space (432 of 500 columns for 500 assets), and its QR step and the
+products with the N x N correlation matrix (O(N^2 k), ie O(N^3)) cost about as much as a full decomposition. In
+benchmarks/validate_absorption_ratio.py, over 900 dates, it is slower than the batched full decomposition for 49
+assets (0.89s against 0.21s) and for 250 assets (4.2s against 3.7s), and faster for 500 assets (14.0s against
+16.9s).
+
+absorption_ratio() computes the AR of a single window from scratch and is the reference for the rolling version
+(see benchmarks/validate_absorption_ratio.py).
+'''
+
+import numpy as np
+import pandas as pd
+import scipy.linalg
+
+# two years of daily returns, weighted with a half-life of one year
+WINDOW = 504
+HALF_LIFE = 252
+
+# dates between two recomputations of the rolling moments from the window, and dates per batched eigensolver call
+REFRESH_EVERY = 252
+BLOCK_SIZE = 256
+
+# extra vectors carried along by the top-k eigensolver, and its tolerance (relative to the largest eigenvalue)
+TOP_K_GUARD = 8
+TOP_K_TOLERANCE = 1e-6
+
+# ways of finding the leading principal components: 'full' decomposes the correlation matrices of a block of dates
+# in one batched call, 'top_k' only finds the leading eigenpairs of every date, warm started from the day before
+EIGEN_METHODS = ['full', 'top_k']
+
+# number of assets from which the top-k path is the default: below it, the batched full decomposition is faster
+# (see the module docstring)
+TOP_K_MIN_ASSETS = 400
+
+
+def default_num_components(num_assets):
+    '''
+    :return: the number of principal components in the AR (a fifth of the number of assets, eg 10 for 49 industries)
+    '''
+    return max(1, int(round(num_assets / 5)))
+
+
+def default_eigen_method(num_assets):
+    '''
+    :return: the faster way of finding the principal components for a universe of num_assets assets ('full' for
+    the 49 industries)
+    '''
+    return 'top_k' if num_assets >= TOP_K_MIN_ASSETS else 'full'
+
+
+def exponential_weights(num_obs, half_life):
+    '''
+    :return: weights for num_obs observations (oldest first) that halve every half_life observations into the past
+    and add up to 1
+    '''
+
+    weights = 0.5 ** (np.arange(num_obs)[::-1] / half_life)
+
+    return weights / weights.sum()
+
+
+def calc_weighted_covariance(x, weights):
+    '''
+    :x: a [num_obs x num_assets] array of returns
+    :return: the weighted covariance matrix (deviations from the weighted mean, weighted by weights that add up to 1)
+    '''
+
+    deviations = x - weights @ x
+
+    return (deviations * weights[:, np.newaxis]).T @ deviations
+
+
+def calc_correlations(covariances):
+    '''
+    normalize every asset to unit variance over the window (the covariance matrices become correlation matrices)
+
+    :covariances: a [num_assets x num_assets] covariance matrix, or an array of them
+    :return: the correlation matrices, and the scale (1 / standard deviation) of every asset
+    '''
+
+    scale = 1 / np.sqrt(np.diagonal(covariances, axis1=-2, axis2=-1))
+
+    return covariances * scale[..., :, np.newaxis] * scale[..., np.newaxis, :], scale
+
+
+def leading_eigenpairs(matrices, num_components):
+    '''
+    :matrices: a [num_dates x num_assets x num_assets] array of symmetric matrices
+    :return: the num_components largest eigenvalues of every matrix ([num_dates x num_components], largest first)
+    and their eigenvectors ([num_dates x num_assets x num_components]), from one batched call of np.linalg.eigh()
+    '''
+
+    # eigh returns the eigenvalues in ascending order, so the leading ones are the last
+    eigenvalues, eigenvectors = np.linalg.eigh(matrices)
+
+    return eigenvalues[:, ::-1][:, :num_components], eigenvectors[:, :, ::-1][:, :, :num_components]
+
+
+def top_k_eigenpairs(matrix, num_components, initial_vectors=None, guard=TOP_K_GUARD, krylov_steps=3,
+                     tol=TOP_K_TOLERANCE, max_iter=20):
+    '''
+    find the num_components largest eigenpairs of a symmetric matrix, warm started from the eigenvectors of a
+    similar matrix (eg the correlation matrix of the day before).
+
+    every iteration builds the block Krylov basis [Q, A Q, ..., A^krylov_steps Q] from the current vectors Q and
+    takes the Rayleigh-Ritz approximations in that basis. num_components + guard vectors are carried along, which
+    speeds up the convergence when the eigenvalues around the num_components-th one are close together. The basis
+    must have fewer columns than the matrix, so small matrices take fewer Krylov steps (eg 1 step for 49 industries,
+    with 10 + 8 vectors); the guard shrinks when not even one step fits. The iterations stop once the residual
+    ||A v - lambda v|| of every wanted pair is within tol of the largest eigenvalue. Without initial vectors (or if
+    the iterations do not converge), the pairs are computed directly with scipy.linalg.eigh(subset_by_index=...).
+    An iteration costs O(num_assets^2 x num_components), plus the QR step of the basis (see the module docstring
+    for when this beats a full decomposition).
+
+    :initial_vectors: a [num_assets x (num_components + guard)] array, eg the vectors returned by the previous call
+    :return: the num_components + guard largest eigenvalues (largest first) and their eigenvectors
+    [num_assets x (num_components + guard)]
+    '''
+
+    num_assets = matrix.shape[0]
+    num_vectors = min(num_components + guard, num_assets)
+
+    # as many Krylov steps as fit in the matrix (the guard vectors are dropped first when none fits)
+    if initial_vectors is not None and 2 * num_vectors >= num_assets:
+        num_vectors = max((num_assets - 1) // 2, num_components)
+        initial_vectors = initial_vectors[:, :num_vectors]
+    krylov_steps = min(krylov_steps, (num_assets - 1) // num_vectors - 1)
+
+    if initial_vectors is not None and krylov_steps >= 1:
+
+        vectors = initial_vectors
+        for _ in range(max_iter):
+
+            # 1. block Krylov basis
+            blocks = [vectors]
+            for _ in range(krylov_steps):
+                blocks.append(matrix @ blocks[-1])
+            basis, _ = np.linalg.qr(np.hstack(blocks))
+
+            # 2. Rayleigh-Ritz: the eigenpairs of the matrix projected on the basis (largest first)
+            matrix_basis = matrix @ basis
+            ritz_values, ritz_vectors = np.linalg.eigh(basis.T @ matrix_basis)
+            ritz_values = ritz_values[::-1][:num_vectors]
+            ritz_vectors = ritz_vectors[:, ::-1][:, :num_vectors]
+
+            vectors = basis @ ritz_vectors
+
+            # 3. check the residuals of the wanted pairs
+            residuals = (matrix_basis @ ritz_vectors[:, :num_components] -
+                         vectors[:, :num_components] * ritz_values[:num_components])
+
+            if np.linalg.norm(residuals, axis=0).max() <= tol * ritz_values[0]:
+                return ritz_values, vectors
+
+    eigenvalues, eigenvectors = scipy.linalg.eigh(matrix, subset_by_index=[num_assets - num_vectors, num_assets - 1])
+
+    return eigenvalues[::-1], eigenvectors[:, ::-1]
+
+
+def absorption_ratios_from_moments(covariances, weighted_covariances, num_components, eigenpairs=None):
+    '''
+    :covariances: a [num_dates x num_assets x num_assets] array of (plain) covariance matrices of the window
+    :weighted_covariances: an array of the same size with the exponentially weighted covariance matrices
+    :eigenpairs: the leading eigenvalues and eigenvectors of the correlation matrices (see leading_eigenpairs()),
+    if they have already been computed (eg with top_k_eigenpairs())
+    :return: a [num_dates x num_components] array with the cumulative share of the total weighted variance that
+    is explained by the first 1, 2, ... num_components principal components, and the unweighted AR of every date
+    '''
+
+    # 1. normalize every asset to unit variance
+    correlations, scale = calc_correlations(covariances)
+
+    # 2. leading principal components
+    if eigenpairs is None:
+        eigenpairs = leading_eigenpairs(correlations, num_components)
+    eigenvalues, leading_vectors = eigenpairs
+
+    # 3. weighted variance of every leading principal component of the normalized returns (v' D C_w D v, where D
+    # holds the scale of every asset), as a share of the total weighted variance (the trace of D C_w D, so that
+    # only the leading components are needed)
+    scaled_vectors = leading_vectors * scale[:, :, np.newaxis]
+    pc_variances = (scaled_vectors * (weighted_covariances @ scaled_vectors)).sum(axis=1)
+    total_variances = (np.diagonal(weighted_covariances, axis1=1, axis2=2) * scale ** 2).sum(axis=1)
+
+    cum_explained = np.cumsum(pc_variances, axis=1) / total_variances[:, np.newaxis]
+    unweighted = eigenvalues.sum(axis=1) / np.trace(correlations, axis1=1, axis2=2)
+
+    return cum_explained, unweighted
+
+
+def absorption_ratio(x, half_life=HALF_LIFE, num_components=None):
+    '''
+    calculate the AR of a single window of returns from scratch.
+
+    :x: a [num_obs x num_assets] array of returns
+    :return: the cumulative share of the total weighted variance explained by the first 1, 2, ... num_components
+    principal components (the last one is the AR), and the unweighted AR
+    '''
+
+    if num_components is None:
+        num_components = default_num_components(x.shape[1])
+
+    covariance = np.cov(x, rowvar=False)
+    weighted_covariance = calc_weighted_covariance(x, exponential_weights(x.shape[0], half_life))
+
+    cum_explained, unweighted = absorption_ratios_from_moments(covariance[np.newaxis],
+                                                               weighted_covariance[np.newaxis],
+                                                               num_components)
+
+    return cum_explained[0], unweighted[0]
+
+
+class RollingMoments:
+    '''
+    the plain and the exponentially weighted first and second moments of the last window observations of a
+    vector of returns, updated in O(num_assets^2) per observation.
+
+    the window itself is kept in a ring buffer, so that the observation that leaves the window can be taken out of
+    the sums (and so that the sums can be recomputed from scratch every refresh_every observations). The state is
+    a dictionary of arrays (see get_state()), so that it can be saved and the updates picked up later.
+    '''
+
+    def __init__(self, num_assets, window=WINDOW, half_life=HALF_LIFE, refresh_every=REFRESH_EVERY):
+
+        self.num_assets = num_assets
+        self.window = window
+        self.half_life = half_life
+        self.refresh_every = refresh_every
+
+        # weight of an observation relative to the one after it
+        self.decay = 0.5 ** (1 / half_life)
+
+        self.buffer = np.zeros(shape=[window, num_assets])
+        self.count = 0
+
+        self.sum_x = np.zeros(num_assets)
+        self.sum_xx = np.zeros(shape=[num_assets, num_assets])
+
+        # the weights are decay^age, where the newest observation has age 0
+        self.weighted_sum = 0.0
+        self.weighted_sum_x = np.zeros(num_assets)
+        self.weighted_sum_xx = np.zeros(shape=[num_assets, num_assets])
+
+    @property
+    def num_obs(self):
+        return min(self.count, self.window)
+
+    @property
+    def is_full(self):
+        return self.count >= self.window
+
+    def window_values(self):
+        '''
+        :return: the observations in the window, oldest first
+        '''
+
+        if not self.is_full:
+            return self.buffer[:self.count]
+
+        position = self.count % self.window
+
+        return np.concatenate([self.buffer[position:], self.buffer[:position]])
+
+    def refresh(self):
+        '''
+        recompute the sums from the observations in the window
+        '''
+
+        x = self.window_values()
+        weights = self.decay ** np.arange(len(x))[::-1]
+
+        self.sum_x = x.sum(axis=0)
+        self.sum_xx = x.T @ x
+
+        self.weighted_sum = weights.sum()
+        self.weighted_sum_x = weights @ x
+        self.weighted_sum_xx = (x * weights[:, np.newaxis]).T @ x
+
+    def update(self, x):
+        '''
+        add the observation x (an array of size [num_assets]) to the window, dropping the oldest observation once
+        the window is full
+        '''
+
+        x = np.asarray(x, dtype=float)
+        position = self.count % self.window
+
+        # 1. age the weights, add the new observation
+        self.weighted_sum = self.decay * self.weighted_sum + 1.0
+        self.weighted_sum_x *= self.decay
+        self.weighted_sum_x += x
+        self.weighted_sum_xx *= self.decay
+        self.weighted_sum_xx += np.outer(x, x)
+
+        self.sum_x += x
+        self.sum_xx += np.outer(x, x)
+
+        # 2. drop the observation that leaves the window (it now has age window)
+        if self.is_full:
+            x_old = self.buffer[position]
+            old_weight = self.decay ** self.window
+
+            self.weighted_sum -= old_weight
+            self.weighted_sum_x -= old_weight * x_old
+            self.weighted_sum_xx -= old_weight * np.outer(x_old, x_old)
+
+            self.sum_x -= x_old
+            self.sum_xx -= np.outer(x_old, x_old)
+
+        self.buffer[position] = x
+        self.count += 1
+
+        if self.refresh_every and self.count % self.refresh_every == 0:
+            self.refresh()
+
+    def covariance(self):
+        '''
+        :return: the covariance matrix of the window (ddof=1, like np.cov())
+        '''
+
+        n = self.num_obs
+        mean = self.sum_x / n
+
+        return (self.sum_xx - n * np.outer(mean, mean)) / (n - 1)
+
+    def weighted_covariance(self):
+        '''
+        :return: the exponentially weighted covariance matrix of the window (see calc_weighted_covariance())
+        '''
+
+        mean = self.weighted_sum_x / self.weighted_sum
+
+        return self.weighted_sum_xx / self.weighted_sum - np.outer(mean, mean)
+
+    def get_state(self):
+        '''
+        :return: the state as a dictionary of arrays (eg to save with np.savez())
+        '''
+
+        return {'window': self.window, 'half_life': self.half_life, 'refresh_every': self.refresh_every,
+                'buffer': self.buffer, 'count': self.count,
+                'sum_x': self.sum_x, 'sum_xx': self.sum_xx, 'weighted_sum': self.weighted_sum,
+                'weighted_sum_x': self.weighted_sum_x, 'weighted_sum_xx': self.weighted_sum_xx}
+
+    @classmethod
+    def from_state(cls, state):
+        '''
+        :return: the RollingMoments with the state returned by get_state() (or loaded with np.load())
+        '''
+
+        moments = cls(num_assets=state['buffer'].shape[1], window=int(state['window']),
+                      half_life=float(state['half_life']), refresh_every=int(state['refresh_every']))
+
+        moments.buffer = np.array(state['buffer'])
+        moments.count = int(state['count'])
+        moments.sum_x = np.array(state['sum_x'])
+        moments.sum_xx = np.array(state['sum_xx'])
+        moments.weighted_sum = float(state['weighted_sum'])
+        moments.weighted_sum_x = np.array(state['weighted_sum_x'])
+        moments.weighted_sum_xx = np.array(state['weighted_sum_xx'])
+
+        return moments
+
+
+def ar_columns(num_components):
+    '''
+    :return: the columns of the AR history: 'ar' (all num_components components), 'ar1' ... 'ar{num_components-1}'
+    (the first 1, 2, ... components) and 'unweighted AR'
+    '''
+    return ['ar'] + ['ar{}'.format(k) for k in range(1, num_components)] + ['unweighted AR']
+
+
+def update_absorption_ratio(moments, returns, num_components=None, block_size=BLOCK_SIZE, eigen_method=None):
+    '''
+    add the returns to the rolling moments, one date at a time, and compute the AR of every date once the window
+    is full.
+
+    with eigen_method='top_k', only the leading eigenpairs of every date are computed (see top_k_eigenpairs()).
+    With 49 industries (and num_components a fifth of them), the batched full decomposition is faster; the top-k
+    path pays off for larger universes with few components (see benchmarks/validate_absorption_ratio.py). Without
+    an eigen_method, the one of default_eigen_method() is used.
+
+    :moments: a RollingMoments (updated in place)
+    :returns: a dataframe of returns with dates in the index and one column per asset
+    :return: a dataframe with the date and the columns of ar_columns() for the dates with a full window
+    '''
+
+    if eigen_method is None:
+        eigen_method = default_eigen_method(moments.num_assets)
+
+    assert eigen_method in EIGEN_METHODS, 'error: eigen_method must be one of {}'.format(EIGEN_METHODS)
+
+    if num_components is None:
+        num_components = default_num_components(moments.num_assets)
+
+    values = returns.to_numpy(dtype=float)
+    warm_vectors = None
+
+    dates = []
+    cum_explained = []
+    unweighted = []
+
+    covariances = np.empty(shape=[block_size, moments.num_assets, moments.num_assets])
+    weighted_covariances = np.empty_like(covariances)
+
+    for start in range(0, len(values), block_size):
+        block = values[start:start + block_size]
+
+        # 1. roll the moments through the block, collecting the covariance matrices of the dates with a full window
+        n = 0
+        for i, x in enumerate(block):
+            moments.update(x)
+
+            if moments.is_full:
+                covariances[n] = moments.covariance()
+                weighted_covariances[n] = moments.weighted_covariance()
+                dates.append(returns.index[start + i])
+                n += 1
+
+        # 2. decompose the whole block at once (or date by date, warm starting every date from the one before)
+        if n:
+            eigenpairs = None
+
+            if eigen_method == 'top_k':
+                eigenvalues = np.empty(shape=[n, num_components])
+                eigenvectors = np.empty(shape=[n, moments.num_assets, num_components])
+
+                for j in range(n):
+                    values_j, warm_vectors = top_k_eigenpairs(calc_correlations(covariances[j])[0], num_components,
+                                                              initial_vectors=warm_vectors)
+                    eigenvalues[j] = values_j[:num_components]
+                    eigenvectors[j] = warm_vectors[:, :num_components]
+
+                eigenpairs = (eigenvalues, eigenvectors)
+
+            block_cum_explained, block_unweighted = absorption_ratios_from_moments(covariances[:n],
+                                                                                   weighted_covariances[:n],
+                                                                                   num_components,
+                                                                                   eigenpairs=eigenpairs)
+            cum_explained.append(block_cum_explained)
+            unweighted.append(block_unweighted)
+
+    if dates:
+        cum_explained = np.concatenate(cum_explained)
+        unweighted = np.concatenate(unweighted)
+    else:
+        cum_explained = np.empty(shape=[0, num_components])
+        unweighted = np.empty(0)
+
+    ar = pd.DataFrame(np.column_stack([cum_explained[:, -1], cum_explained[:, :-1], unweighted]),
+                      columns=ar_columns(num_components))
+    ar.insert(0, 'date', dates)
+
+    return ar
+
+
+def rolling_absorption_ratio(returns, window=WINDOW, half_life=HALF_LIFE, num_components=None,
+                             refresh_every=REFRESH_EVERY, block_size=BLOCK_SIZE, eigen_method=None):
+    '''
+    compute the full AR history of a dataframe of returns (dates in the index, one column per asset).
+
+    :return: a dataframe with the date and the columns of ar_columns() for every date with a full window
+    '''
+
+    moments = RollingMoments(num_assets=returns.shape[1], window=window, half_life=half_life,
+                             refresh_every=refresh_every)
+
+    return update_absorption_ratio(moments, returns, num_components=num_components, block_size=block_size,
+                                   eigen_method=eigen_method)
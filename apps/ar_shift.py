@@ -0,0 +1,255 @@
+'''
+AR shift: a z-score that flags rapidly rising or falling systemic risk
+
+    ar_shift = (15 day average AR - 252 day average AR) / 252 day standard deviation of the AR (ddof=1)
+
+with an action of 1 on the date the AR shift rises above SIGNAL_THRESHOLD, -1 on the date it falls below
+-SIGNAL_THRESHOLD, and 0 otherwise (the columns of data/ar_shift.csv).
+
+calc_ar_shift() computes the whole history with pandas rolling windows. ARShiftState computes the same columns one
+date at a time in O(1): it keeps the last 252 AR values in a ring buffer with the rolling sum of the short window
+and the mean and the sum of squared deviations of the long window (updated with Welford's add/remove steps, as
+pandas does), and recomputes them from the buffer every 252 dates so that rounding errors do not build up. The
+state is saved next to the data file (see state_path()), so a new date is appended without touching the history.
+ARShiftState.from_history() rebuilds the state from the AR column of the data file (see daily_update
+--init-ar-shift).
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+
+SHORT_WINDOW = 15
+LONG_WINDOW = 252
+
+# AR shift (in standard deviations) above which (or below minus which) an action is flagged
+SIGNAL_THRESHOLD = 1.0
+
+
+def calc_actions(ar_shift, threshold=SIGNAL_THRESHOLD, previous_ar_shift=np.nan):
+    '''
+    :ar_shift: an array of AR shift values
+    :previous_ar_shift: the AR shift of the date before the first one
+    :return: an array with 1 where the AR shift rises above threshold, -1 where it falls below -threshold and 0
+    otherwise
+    '''
+
+    ar_shift = np.asarray(ar_shift, dtype=float)
+    previous = np.concatenate([[previous_ar_shift], ar_shift[:-1]])
+
+    # (comparisons with nan are False, so the first valid date can flag an action)
+    rises = (ar_shift > threshold) & ~(previous > threshold)
+    falls = (ar_shift < -threshold) & ~(previous < -threshold)
+
+    return np.where(rises, 1, np.where(falls, -1, 0))
+
+
+def ar_shift_columns(short_window=SHORT_WINDOW, long_window=LONG_WINDOW):
+    '''
+    :return: the columns of the AR shift data
+    '''
+    return ['date', 'ar', 'avg_{}'.format(short_window), 'avg_{}'.format(long_window), 'std_{}'.format(long_window),
+            'ar_shift', 'action']
+
+
+def calc_ar_shift(df, short_window=SHORT_WINDOW, long_window=LONG_WINDOW, threshold=SIGNAL_THRESHOLD):
+    '''
+    calculate the AR shift of every date with pandas rolling windows.
+
+    :df: data with columns date and ar, as dataframe
+    :return: a dataframe with the columns of ar_shift_columns()
+    '''
+
+    df = df[['date', 'ar']].reset_index(drop=True)
+
+    short_avg = df['ar'].rolling(window=short_window).mean()
+    long_avg = df['ar'].rolling(window=long_window).mean()
+    long_std = df['ar'].rolling(window=long_window).std()
+
+    df['avg_{}'.format(short_window)] = short_avg
+    df['avg_{}'.format(long_window)] = long_avg
+    df['std_{}'.format(long_window)] = long_std
+    df['ar_shift'] = (short_avg - long_avg) / long_std
+    df['action'] = calc_actions(df['ar_shift'], threshold=threshold)
+
+    return df
+
+
+class ARShiftState:
+    '''
+    the rolling state of the AR shift, updated in O(1) per date (see the module docstring).
+    '''
+
+    def __init__(self, short_window=SHORT_WINDOW, long_window=LONG_WINDOW, threshold=SIGNAL_THRESHOLD):
+
+        assert short_window <= long_window, 'error: the short window is longer than the long window'
+
+        self.short_window = short_window
+        self.long_window = long_window
+        self.threshold = threshold
+
+        self.buffer = np.zeros(long_window)
+        self.count = 0
+
+        self.short_sum = 0.0
+        self.long_mean = 0.0
+        self.long_ssqdm = 0.0
+
+        self.previous_ar_shift = np.nan
+
+    def refresh(self):
+        '''
+        recompute the rolling sums from the values in the buffer
+        '''
+
+        n = min(self.count, self.long_window)
+        values = np.roll(self.buffer, -(self.count % self.long_window))[-n:] if n else np.zeros(0)
+
+        self.short_sum = values[-self.short_window:].sum()
+        self.long_mean = values.mean() if n else 0.0
+        self.long_ssqdm = ((values - self.long_mean) ** 2).sum()
+
+    def update(self, ar):
+        '''
+        add the AR of the next date
+
+        :return: a dictionary with the averages, the standard deviation, the AR shift and the action of the date
+        '''
+
+        ar = float(ar)
+        position = self.count % self.long_window
+
+        # 1. short window sum: add the new value, drop the value that leaves the short window
+        self.short_sum += ar
+        if self.count >= self.short_window:
+            self.short_sum -= self.buffer[(self.count - self.short_window) % self.long_window]
+
+        # 2. long window mean and sum of squared deviations (Welford): drop the value that leaves, add the new one
+        n = min(self.count, self.long_window)
+        if self.count >= self.long_window:
+            x_old = self.buffer[position]
+            n -= 1
+            if n == 0:
+                self.long_mean, self.long_ssqdm = 0.0, 0.0
+            else:
+                delta = x_old - self.long_mean
+                self.long_mean -= delta / n
+                self.long_ssqdm -= (n + 1) * delta ** 2 / n
+
+        n += 1
+        delta = ar - self.long_mean
+        self.long_mean += delta / n
+        self.long_ssqdm += (n - 1) * delta ** 2 / n
+
+        self.buffer[position] = ar
+        self.count += 1
+
+        if self.count % self.long_window == 0:
+            self.refresh()
+
+        # 3. the statistics of the date (nan until the windows are full)
+        short_avg = self.short_sum / self.short_window if self.count >= self.short_window else np.nan
+
+        if self.count >= self.long_window:
+            long_avg = self.long_mean
+            long_std = np.sqrt(max(self.long_ssqdm, 0.0) / (self.long_window - 1))
+        else:
+            long_avg, long_std = np.nan, np.nan
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ar_shift = np.float64(short_avg - long_avg) / long_std
+
+        action = int(calc_actions([ar_shift], threshold=self.threshold, previous_ar_shift=self.previous_ar_shift)[0])
+        self.previous_ar_shift = ar_shift
+
+        return {'ar': ar,
+                'avg_{}'.format(self.short_window): short_avg,
+                'avg_{}'.format(self.long_window): long_avg,
+                'std_{}'.format(self.long_window): long_std,
+                'ar_shift': float(ar_shift),
+                'action': action}
+
+    def get_state(self):
+        '''
+        :return: the state as a dictionary of arrays (eg to save with np.savez())
+        '''
+
+        return {'short_window': self.short_window, 'long_window': self.long_window, 'threshold': self.threshold,
+                'buffer': self.buffer, 'count': self.count, 'short_sum': self.short_sum,
+                'long_mean': self.long_mean, 'long_ssqdm': self.long_ssqdm,
+                'previous_ar_shift': self.previous_ar_shift}
+
+    @classmethod
+    def from_state(cls, state):
+        '''
+        :return: the ARShiftState with the state returned by get_state() (or loaded with np.load())
+        '''
+
+        ar_state = cls(short_window=int(state['short_window']), long_window=int(state['long_window']),
+                       threshold=float(state['threshold']))
+
+        ar_state.buffer = np.array(state['buffer'], dtype=float)
+        ar_state.count = int(state['count'])
+        ar_state.short_sum = float(state['short_sum'])
+        ar_state.long_mean = float(state['long_mean'])
+        ar_state.long_ssqdm = float(state['long_ssqdm'])
+        ar_state.previous_ar_shift = float(state['previous_ar_shift'])
+
+        return ar_state
+
+    @classmethod
+    def from_history(cls, ar, short_window=SHORT_WINDOW, long_window=LONG_WINDOW, threshold=SIGNAL_THRESHOLD):
+        '''
+        :ar: the AR history (eg the ar column of data/ar_shift.csv), oldest first
+        :return: the ARShiftState after all the dates of the history (the history is replayed date by date, so
+        the state is the one the streaming updates would have reached)
+        '''
+
+        ar_state = cls(short_window=short_window, long_window=long_window, threshold=threshold)
+
+        for value in np.asarray(ar, dtype=float):
+            ar_state.update(value)
+
+        return ar_state
+
+
+def update_ar_shift(ar_state, df):
+    '''
+    add the dates of df (with columns date and ar, in date order) to the state, one at a time.
+
+    :return: a dataframe with the columns of ar_shift_columns() for the new dates
+    '''
+
+    rows = [dict(ar_state.update(ar), date=date) for date, ar in zip(df['date'], df['ar'])]
+
+    columns = ar_shift_columns(ar_state.short_window, ar_state.long_window)
+
+    return pd.DataFrame(rows, columns=columns)
+
+
+def state_path(data_path='data/ar_shift.csv'):
+    '''
+    :return: the path of the file that holds the rolling state of a data file (next to it)
+    '''
+    return os.path.splitext(data_path)[0] + '_state.npz'
+
+
+def save_state(state, path):
+    '''
+    save a state dictionary (see get_state()) with np.savez(), writing a temporary file first and renaming it, so
+    that a crash never leaves a partly written state behind
+    '''
+
+    temp_path = '{}.{}.tmp.npz'.format(path, os.getpid())
+    np.savez(temp_path, **state)
+    os.replace(temp_path, path)
+
+
+def load_state(path):
+    '''
+    :return: the state dictionary saved by save_state()
+    '''
+
+    with np.load(path) as state:
+        return {k: state[k] for k in state.files}
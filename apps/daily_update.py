@@ -0,0 +1,490 @@
+'''
+daily update of the systemic risk datasets: append the new days to data/weighted_and_unweighted_absorption_ratio.csv,
+data/turbulence.csv, data/ar_shift.csv and data/sp500_levels.csv without recomputing their history.
+
+new days are dropped as csv files in the drop directory (data/drop, or the directory set by the daily_drop_dir
+environment variable):
+
+- industry_returns*.csv: a date column and one column of daily returns per industry
+- absorption_ratio*.csv: or, instead of the industry returns, the AR of the new days computed elsewhere (the
+  columns of data/weighted_and_unweighted_absorption_ratio.csv: date, ar, unweighted AR), which updates the AR and
+  AR shift files only
+- sp500_levels*.csv: the columns of data/sp500_levels.csv (date, ^GSPC, VBTIX)
+
+the rolling state of every derived series (absorption_ratio.RollingMoments, turbulence.RollingInverseCovariance and
+ar_shift.ARShiftState, with the last date they have seen) is saved next to its csv file (see ar_shift.state_path()).
+An update loads the states, rolls them through the days after their last date and appends only the new rows. Every
+csv file is copied to a temporary file in the same directory, the new rows are appended to the copy, and the copies
+and the new states are swapped in with os.replace() once everything has been computed, so readers of a file never
+see it partly written. Copying keeps the files whole for the web app, which may read them at any time, at the
+cost of copying the history every day (about a millisecond for the 3 MB of the four files); appending in place
+would only write the new rows, but a reader could then see half of a new line.
+
+the files of an update are swapped in as one: the list of files is written to a manifest before the first file is
+replaced and deleted after the last one (see swap_in()). If a run stops in between (eg a crash), the next run
+finds the manifest and finishes the swap before it reads anything, so the csv files and their states never stay
+out of sync. (A reader that opens two files during the swap, which takes milliseconds, can see one of them a day
+ahead of the other.) Days that are already in the files are skipped, so the same drop files can be processed
+twice; the files that were processed are moved to the processed directory of the drop directory.
+
+the states are built once from the full history of industry returns (the industry returns are not part of the
+repository), which also rewrites the derived csv files:
+
+    python -m apps.daily_update --init industry_returns.csv
+
+without that history, the AR shift state can be built from data/ar_shift.csv (which is in the repository), after
+which AR drop files can be appended (the S&P 500 levels need no state):
+
+    python -m apps.daily_update --init-ar-shift
+
+and then every day, from the repository root:
+
+    python -m apps.daily_update
+'''
+
+import argparse
+import csv
+import glob
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from apps import absorption_ratio
+from apps import ar_shift
+from apps import turbulence
+
+DATA_DIR = 'data'
+
+AR_FILE = 'weighted_and_unweighted_absorption_ratio.csv'
+TURBULENCE_FILE = 'turbulence.csv'
+AR_SHIFT_FILE = 'ar_shift.csv'
+SP500_FILE = 'sp500_levels.csv'
+
+RETURNS_PATTERN = 'industry_returns*.csv'
+AR_PATTERN = 'absorption_ratio*.csv'
+SP500_PATTERN = 'sp500_levels*.csv'
+
+# the list of files of a swap that is in progress (see swap_in())
+MANIFEST_FILE = 'daily_update_manifest.json'
+
+# the AR columns kept in the AR file
+AR_FILE_COLUMNS = ['date', 'ar', 'unweighted AR']
+
+
+def drop_directory(data_dir=DATA_DIR):
+    return os.environ.get('daily_drop_dir', os.path.join(data_dir, 'drop'))
+
+
+def format_dates(dates):
+    '''
+    :return: the dates as 'YYYY-MM-DD' strings (the format of the data files, which also sorts by date)
+    '''
+    return pd.to_datetime(pd.Series(dates)).dt.strftime('%Y-%m-%d').to_numpy()
+
+
+def read_drop_files(drop_dir, pattern):
+    '''
+    :return: the rows of all the files in drop_dir that match pattern, indexed by date (the last file wins when a
+    date is in more than one file) and sorted by date, and the list of files
+    '''
+
+    paths = sorted(glob.glob(os.path.join(drop_dir, pattern)))
+
+    if not paths:
+        return None, []
+
+    df = pd.concat([pd.read_csv(path) for path in paths], ignore_index=True)
+    df['date'] = format_dates(df['date'])
+    df = df.drop_duplicates(subset='date', keep='last').sort_values('date').set_index('date')
+
+    return df, paths
+
+
+def read_header(path):
+    with open(path, newline='') as f:
+        return next(csv.reader(f))
+
+
+def read_last_row(path, tail_size=4096):
+    '''
+    :return: the fields of the last line of a csv file, read from the end of the file
+    '''
+
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - tail_size))
+        line = f.read().rstrip(b'\r\n').split(b'\n')[-1]
+
+    return next(csv.reader([line.decode()]))
+
+
+def last_date(path):
+    '''
+    :return: the date of the last row of a data file (None if it has no rows)
+    '''
+
+    header = read_header(path)
+    last_row = read_last_row(path)
+
+    return None if last_row == header else last_row[header.index('date')]
+
+
+def temporary_path(path):
+    return '{}.{}.tmp'.format(path, os.getpid())
+
+
+def stage_append(path, rows):
+    '''
+    copy a data file to a temporary file and append rows to the copy (the columns in the order of the header, and
+    the unnamed index column carried on from the last row). The copy takes time in proportion to the size of the
+    file (see the module docstring).
+
+    :return: the path of the temporary file
+    '''
+
+    header = read_header(path)
+    temp_path = temporary_path(path)
+    shutil.copyfile(path, temp_path)
+
+    rows = rows[[c for c in header if c]]
+
+    with open(temp_path, 'a', newline='') as f:
+        if header[0] == '':
+            last_row = read_last_row(path)
+            start = 0 if last_row == header else int(last_row[0]) + 1
+            rows = rows.set_axis(range(start, start + len(rows)))
+            rows.to_csv(f, header=False, index=True)
+        else:
+            rows.to_csv(f, header=False, index=False)
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    return temp_path
+
+
+def stage_csv(path, df):
+    '''
+    write a whole data file to a temporary file (with the unnamed index column)
+
+    :return: the path of the temporary file
+    '''
+
+    temp_path = temporary_path(path)
+    df.reset_index(drop=True).to_csv(temp_path)
+    fsync_file(temp_path)
+
+    return temp_path
+
+
+def stage_state(path, state, last_date_seen, columns=None):
+    '''
+    save a rolling state with the last date it has seen (and the columns of the returns) to a temporary file
+
+    :return: the path of the temporary file
+    '''
+
+    state = dict(state, last_date=last_date_seen)
+    if columns is not None:
+        state['columns'] = np.array(columns, dtype=str)
+
+    temp_path = temporary_path(path) + '.npz'
+    np.savez(temp_path, **state)
+    fsync_file(temp_path)
+
+    return temp_path
+
+
+def fsync_file(path):
+    '''
+    flush a file (or a directory, so that the renames in it are on disk) to disk
+    '''
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # (directories cannot be opened on windows)
+        return
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def swap_in(staged, data_dir):
+    '''
+    replace every file by its temporary file (a list of [temp_path, path]) as one update: the list is written to
+    the manifest (under a temporary name that is then renamed, so the manifest is either whole or missing), the
+    files are replaced, and the manifest is deleted last. A run that stops in between leaves the manifest behind,
+    and finish_swap() completes the swap.
+    '''
+
+    if not staged:
+        return
+
+    manifest_path = os.path.join(data_dir, MANIFEST_FILE)
+    temp_path = temporary_path(manifest_path)
+
+    with open(temp_path, 'w') as f:
+        json.dump({'files': [[os.path.abspath(temp), os.path.abspath(path)] for temp, path in staged]}, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(temp_path, manifest_path)
+    fsync_file(data_dir)
+
+    finish_swap(data_dir)
+
+
+def finish_swap(data_dir):
+    '''
+    finish the swap of the manifest, if there is one (the files whose temporary file is gone were already replaced)
+
+    :return: True if there was a swap to finish
+    '''
+
+    manifest_path = os.path.join(data_dir, MANIFEST_FILE)
+
+    if not os.path.exists(manifest_path):
+        return False
+
+    with open(manifest_path) as f:
+        staged = json.load(f)['files']
+
+    for temp_path, path in staged:
+        if os.path.exists(temp_path):
+            os.replace(temp_path, path)
+
+    fsync_file(data_dir)
+    os.remove(manifest_path)
+
+    return True
+
+
+def derived_paths(data_dir):
+    '''
+    :return: the paths of the AR, turbulence and AR shift files and of their states
+    '''
+
+    paths = [os.path.join(data_dir, file_name) for file_name in [AR_FILE, TURBULENCE_FILE, AR_SHIFT_FILE]]
+
+    return paths, [ar_shift.state_path(path) for path in paths]
+
+
+def roll_states(moments, inverse_covariance, ar_state, returns):
+    '''
+    roll the three states through the returns (in place)
+
+    :return: the new rows of the AR, turbulence and AR shift files
+    '''
+
+    ar = absorption_ratio.update_absorption_ratio(moments, returns)[AR_FILE_COLUMNS]
+    turbulence_rows = turbulence.update_turbulence(inverse_covariance, returns)
+    ar_shift_rows = ar_shift.update_ar_shift(ar_state, ar)
+
+    return ar, turbulence_rows, ar_shift_rows
+
+
+def initialize(returns, data_dir=DATA_DIR):
+    '''
+    build the rolling states from the full history of industry returns and rewrite the derived data files.
+
+    :returns: a dataframe with a date column and one column of daily returns per industry
+    :return: the number of rows of every derived file
+    '''
+
+    finish_swap(data_dir)
+
+    returns = returns.copy()
+    returns['date'] = format_dates(returns['date'])
+    returns = returns.sort_values('date').set_index('date')
+
+    moments = absorption_ratio.RollingMoments(num_assets=returns.shape[1])
+    inverse_covariance = turbulence.RollingInverseCovariance(num_assets=returns.shape[1])
+    ar_state = ar_shift.ARShiftState()
+
+    ar, turbulence_rows, _ = roll_states(moments, inverse_covariance, ar_state, returns)
+
+    # the AR shift file comes from the batch (pandas) calculation, the state from the streaming one
+    rows = [ar, turbulence_rows, ar_shift.calc_ar_shift(ar)]
+    states = [moments.get_state(), inverse_covariance.get_state(), ar_state.get_state()]
+
+    paths, state_paths = derived_paths(data_dir)
+    last_date_seen = returns.index[-1]
+
+    staged = [[stage_csv(path, df), path] for path, df in zip(paths, rows)]
+    staged += [[stage_state(path, state, last_date_seen, columns=returns.columns), path]
+               for path, state in zip(state_paths, states)]
+
+    swap_in(staged, data_dir)
+
+    return {os.path.basename(path): len(df) for path, df in zip(paths, rows)}
+
+
+def initialize_ar_shift(data_dir=DATA_DIR):
+    '''
+    build the AR shift state from the AR column of the AR shift file (which is in the repository), without the
+    history of industry returns.
+
+    :return: the number of dates that were replayed
+    '''
+
+    finish_swap(data_dir)
+
+    path = os.path.join(data_dir, AR_SHIFT_FILE)
+    history = pd.read_csv(path, usecols=['date', 'ar'])
+
+    ar_state = ar_shift.ARShiftState.from_history(history['ar'])
+
+    state_path = ar_shift.state_path(path)
+    temp_path = stage_state(state_path, ar_state.get_state(), format_dates(history['date'].iloc[-1:])[0])
+    swap_in([[temp_path, state_path]], data_dir)
+
+    return {os.path.basename(state_path): len(history)}
+
+
+def update(data_dir=DATA_DIR, drop_dir=None):
+    '''
+    append the new days of the drop directory to the data files (see the module docstring).
+
+    :return: the number of rows appended to every data file
+    '''
+
+    if drop_dir is None:
+        drop_dir = drop_directory(data_dir)
+
+    # finish the swap of a run that stopped halfway, before the files are read
+    finish_swap(data_dir)
+
+    staged = []
+    appended = {}
+
+    # 1. industry returns: roll the AR, turbulence and AR shift states through the new days
+    returns, returns_files = read_drop_files(drop_dir, RETURNS_PATTERN)
+
+    if returns is not None:
+        paths, state_paths = derived_paths(data_dir)
+
+        for path in state_paths:
+            assert os.path.exists(path), 'error: no rolling state {} (run python -m apps.daily_update --init with ' \
+                                         'the history of industry returns)'.format(path)
+
+        states = [ar_shift.load_state(path) for path in state_paths]
+        last_date_seen = str(states[0]['last_date'])
+
+        for path, state in zip(paths, states):
+            assert str(state['last_date']) == last_date_seen and last_date(path) in [last_date_seen, None], \
+                'error: {} and its rolling state are out of sync (run python -m apps.daily_update --init)'.format(path)
+
+        columns = list(states[0]['columns'])
+        assert set(returns.columns) == set(columns), 'error: the industries of the drop files do not match the state'
+
+        returns = returns.loc[returns.index > last_date_seen, columns]
+
+        if len(returns):
+            moments = absorption_ratio.RollingMoments.from_state(states[0])
+            inverse_covariance = turbulence.RollingInverseCovariance.from_state(states[1])
+            ar_state = ar_shift.ARShiftState.from_state(states[2])
+
+            rows = roll_states(moments, inverse_covariance, ar_state, returns)
+            new_states = [moments.get_state(), inverse_covariance.get_state(), ar_state.get_state()]
+
+            staged += [[stage_append(path, df), path] for path, df in zip(paths, rows)]
+            staged += [[stage_state(path, state, returns.index[-1], columns=columns), path]
+                       for path, state in zip(state_paths, new_states)]
+
+            appended.update({os.path.basename(path): len(df) for path, df in zip(paths, rows)})
+
+    # 2. or AR values computed elsewhere: roll the AR shift state alone
+    ar_values, ar_files = read_drop_files(drop_dir, AR_PATTERN)
+
+    if ar_values is not None:
+        assert returns is None, 'error: drop either industry returns or AR values, not both'
+        assert set(AR_FILE_COLUMNS[1:]) <= set(ar_values.columns), \
+            'error: the AR drop files need the columns {}'.format(AR_FILE_COLUMNS)
+
+        ar_path = os.path.join(data_dir, AR_FILE)
+        ar_shift_path = os.path.join(data_dir, AR_SHIFT_FILE)
+        state_path = ar_shift.state_path(ar_shift_path)
+
+        assert os.path.exists(state_path), 'error: no rolling state {} (run python -m apps.daily_update ' \
+                                           '--init-ar-shift)'.format(state_path)
+
+        state = ar_shift.load_state(state_path)
+        last_date_seen = str(state['last_date'])
+
+        for path in [ar_path, ar_shift_path]:
+            assert last_date(path) == last_date_seen, \
+                'error: {} and the AR shift state are out of sync (run python -m apps.daily_update ' \
+                '--init-ar-shift)'.format(path)
+
+        ar_values = ar_values.loc[ar_values.index > last_date_seen].reset_index()
+
+        if len(ar_values):
+            ar_state = ar_shift.ARShiftState.from_state(state)
+            ar_shift_rows = ar_shift.update_ar_shift(ar_state, ar_values)
+
+            staged += [[stage_append(ar_path, ar_values[AR_FILE_COLUMNS]), ar_path],
+                       [stage_append(ar_shift_path, ar_shift_rows), ar_shift_path],
+                       [stage_state(state_path, ar_state.get_state(), ar_values['date'].iloc[-1]), state_path]]
+
+            appended.update({AR_FILE: len(ar_values), AR_SHIFT_FILE: len(ar_shift_rows)})
+
+    # 3. S&P 500 levels: append the days after the last one in the file
+    levels, levels_files = read_drop_files(drop_dir, SP500_PATTERN)
+
+    if levels is not None:
+        path = os.path.join(data_dir, SP500_FILE)
+        last_date_seen = last_date(path)
+
+        if last_date_seen is not None:
+            levels = levels.loc[levels.index > last_date_seen]
+
+        if len(levels):
+            staged.append([stage_append(path, levels.reset_index()), path])
+            appended[SP500_FILE] = len(levels)
+
+    # 4. swap the new files in, and move the drop files out of the way
+    swap_in(staged, data_dir)
+
+    processed_dir = os.path.join(drop_dir, 'processed')
+    for path in returns_files + ar_files + levels_files:
+        os.makedirs(processed_dir, exist_ok=True)
+        os.replace(path, os.path.join(processed_dir, os.path.basename(path)))
+
+    return appended
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='append the new days of the drop directory to the systemic risk '
+                                                 'data files')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--drop-dir', default=None)
+    parser.add_argument('--init', metavar='RETURNS_CSV', default=None,
+                        help='build the rolling states from the full history of industry returns')
+    parser.add_argument('--init-ar-shift', action='store_true',
+                        help='build the AR shift state from the AR column of the AR shift file')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+
+    if args.init:
+        rows, done = initialize(pd.read_csv(args.init), data_dir=args.data_dir), 'rows written'
+    elif args.init_ar_shift:
+        rows, done = initialize_ar_shift(data_dir=args.data_dir), 'dates replayed'
+    else:
+        rows, done = update(data_dir=args.data_dir, drop_dir=args.drop_dir), 'rows appended'
+
+    for file_name, num_rows in rows.items():
+        print('{}: {:,} {}'.format(file_name, num_rows, done))
+    print('done in {:.2f}s'.format(time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,58 +1,137 @@
 
+import functools
+
 import numpy as np
 import pandas as pd
+import scipy.stats
 
+# version of the simulation model (bump whenever a change alters the results of a plan, so that cached plans
+# from the previous version are not served)
+MODEL_VERSION = 5
 
-def calc_age_for_survival_prob(target_survival_prob, age_list, cum_survival_prob_list):
-    for i in range(len(age_list)):
-        if cum_survival_prob_list[i] <= target_survival_prob:
-            return age_list[i]
-    return 999
+# upper bound (in bytes) on the wealth arrays held in memory at once when evaluating a batch of scenarios
+SCENARIO_MEMORY_BUDGET = 256 * 1024 ** 2
 
+# the statistics calculated by wealth_distributions(), the ones that calc_wealth_milestones() reports by default
+# and the subset that is shown on the home page
+DISTRIBUTION_KEYS = ['mean', 'median', 75, 50, 25, 10, 5, 1]
+MILESTONE_KEYS = ['mean', 75, 50, 25, 5, 1]
+REPORTED_KEYS = [75, 'mean', 25, 5]
 
-def calc_wealth_trajectory(starting_wealth, equity_returns, bond_returns, allocations, contributions):
 
-    assert equity_returns.shape == allocations.shape, 'error: equity returns and allocations are not the same shape'
-    assert equity_returns.shape == bond_returns.shape, 'error: equity returns and bond returns are not the same shape'
-    assert equity_returns.shape == contributions.shape, 'error: equity returns and contributions are not the same shape'
+def as_period_major(x):
+    '''
+    view an array laid out as [num_simulations x num_periods] (or a per-period schedule of size [num_periods],
+    or a scalar) so that it broadcasts against a [num_periods x num_simulations] array. 2-D inputs are returned
+    as transposed views, so nothing is copied.
+    '''
 
-    # get the number of periods to simulate, based on the length of the
-    # returns simulation
-    num_simulations = equity_returns.shape[0]
-    num_periods = equity_returns.shape[1]
+    x = np.asarray(x)
 
-    # init an array that is the same shape as the inputted return
-    # (this will be a [num_simulations x num_periods]-sized array)
-    wealths = np.zeros_like(equity_returns)
-    wealths[:, 0] = starting_wealth
+    if x.ndim == 2:
+        return x.T
+    elif x.ndim == 1:
+        return x[:, np.newaxis]
+    else:
+        return x
 
-    # for every simulation, iterate through each period and update the wealth based on the prior period
-    # wealth, the return in the given period and the contribution/spend in
-    # that period
-    current_wealths = np.copy(starting_wealth)
 
-    for i in range(num_periods):
+def calc_growth_factors(equity_returns, bond_returns, allocations, dtype=np.float64):
+    '''
+    blend the equity and bond returns into a single gross growth factor for every simulation and period, ie
+    allocation * (1 + equity return) + (1 - allocation) * (1 + bond return).
+
+    equity_returns is a [num_simulations x num_periods] array. bond_returns and allocations can either be arrays of
+    the same shape or anything that broadcasts to it (a per-period schedule of size [num_periods] or a scalar).
+
+    :return: a [num_periods x num_simulations] array (period-major, so that each period is a contiguous row)
+    '''
+
+    num_simulations, num_periods = equity_returns.shape
+
+    equity_returns = as_period_major(equity_returns)
+    bond_returns = as_period_major(bond_returns)
+    allocations = as_period_major(allocations)
+
+    # rearrange the blend as allocation * equity return + (1 + bond return * (1 - allocation)) so that only one
+    # full-width multiply and one full-width add are needed when the bond returns and allocations are schedules
+    growth = np.empty(shape=[num_periods, num_simulations], dtype=dtype)
+    np.multiply(equity_returns, allocations, out=growth)
+    np.add(growth, 1.0 + bond_returns * (1.0 - allocations), out=growth)
+
+    return growth
+
+
+def calc_wealth_from_growth(starting_wealth, growth, contributions, dtype=np.float64, out=None):
+    '''
+    run the wealth recurrence wealth[i] = wealth[i-1] * growth[i] + contribution[i] over all simulations at once.
+
+    growth is a [num_periods x num_simulations] array as returned by calc_growth_factors(). contributions is given
+    in the usual [num_simulations x num_periods] layout, or as a [num_periods] schedule that is shared by every
+    simulation. (Arrays with more than two dimensions are taken to be period-major already and are broadcast
+    against each other, which is how simulate_scenarios() runs a stack of scenarios.)
 
-        # update the wealth in period i as the wealth in period (i-1) times the investment return plus
-        # the savings/spending
+    :out: an array to write the wealth into (eg rows of a larger array), allocated when not given
+    :return: a [num_periods x num_simulations] array of wealth
+    '''
+
+    num_periods = growth.shape[0]
+    contributions = as_period_major(contributions)
 
-        # calculate returns in period i across all the simulations
-        # the returns are calculated as asset return times allocation to that
-        # asset
-        equity_return_i = (
-            1 + equity_returns[:, i]).flatten() * allocations[:, i].flatten()
-        bond_return_i = (
-            1 + bond_returns[:, i]).flatten() * (1.0 - allocations[:, i].flatten())
-        contribution_i = contributions[:, i].flatten()
+    # the recurrence reads one period of contributions at a time, so make sure full-width contributions
+    # are laid out period by period
+    if contributions.ndim == 2 and contributions.shape[1] > 1:
+        contributions = np.ascontiguousarray(contributions, dtype=dtype)
 
-        current_wealths = ((current_wealths.flatten() * equity_return_i) +
-                           (current_wealths.flatten() * bond_return_i) +
-                           contribution_i)
+    # preallocate the output and write every period in place (no temporaries inside the loop)
+    wealths = np.empty(shape=np.broadcast(growth, contributions).shape, dtype=dtype) if out is None else out
+    current_wealths = np.asarray(starting_wealth, dtype=dtype)
 
-        wealths[:, i] = current_wealths
+    for i in range(num_periods):
+        np.multiply(current_wealths, growth[i], out=wealths[i])
+        np.add(wealths[i], contributions[i], out=wealths[i])
+        current_wealths = wealths[i]
 
     return wealths
 
+
+def periods_from(x, first_period):
+    '''
+    :return: the periods of x from first_period onwards (x is a per-period schedule, a [... x num_periods] array
+    or a scalar, which is returned as is)
+    '''
+
+    x = np.asarray(x)
+
+    return x[..., first_period:] if x.ndim else x
+
+
+def calc_wealth_trajectory(starting_wealth, equity_returns, bond_returns, allocations, contributions, dtype=np.float64):
+    '''
+    calculate the growth of wealth for every simulation, based on the market returns, the allocation to
+    stocks and the contribution/spend in every period.
+
+    equity_returns is a [num_simulations x num_periods] array. bond_returns, allocations and contributions can be
+    arrays of the same shape or per-period schedules of size [num_periods] that are shared by every simulation.
+    Pass dtype=np.float32 to run the simulation in single precision (roughly halves the memory traffic).
+
+    :return: a [num_simulations x num_periods] array of wealth (a transposed view of a period-major array)
+    '''
+
+    assert np.broadcast(equity_returns, allocations).shape == equity_returns.shape, 'error: equity returns and allocations are not the same shape'
+    assert np.broadcast(equity_returns, bond_returns).shape == equity_returns.shape, 'error: equity returns and bond returns are not the same shape'
+    assert np.broadcast(equity_returns, contributions).shape == equity_returns.shape, 'error: equity returns and contributions are not the same shape'
+
+    # blend equity and bond returns into a single growth factor per simulation and period
+    growth = calc_growth_factors(equity_returns, bond_returns, allocations, dtype=dtype)
+
+    # update the wealth in period i as the wealth in period (i-1) times the growth factor plus
+    # the savings/spending in period i
+    wealths = calc_wealth_from_growth(starting_wealth, growth, contributions, dtype=dtype)
+
+    return wealths.T
+
+
 def get_age_at_negative_wealth(trajectory, age_list):
 
     # find the index of the first instance when wealth for a given year
@@ -64,61 +143,123 @@ def get_age_at_negative_wealth(trajectory, age_list):
     else:
         return age_list[i]
 
-def calc_wealth_milestones(trajectories, rates_of_return, age_list, idx_at_retirement, idx_at_final_age, years_to_retire_minus_one):
+def calc_wealth_milestones(trajectories, rates_of_return, age_list, idx_at_retirement, idx_at_final_age, years_to_retire_minus_one,
+                           keys=MILESTONE_KEYS):
+    '''
+    calculate the wealth and the average annualized stock market return at retirement and at the final age, and the
+    age at which wealth first runs out, for the trajectory of every key (eg the 25th percentile path).
 
-    wealth_stats ={}
+    the trajectories and the cumulative market returns of all keys are stacked into [num_keys x num_periods] arrays
+    so that every milestone is computed for all keys at once.
 
-    for i in ['mean', 75, 50, 25, 5, 1]:
+    :return: a dictionary with a dictionary of milestones for every key, eg {75: {'wealth_at_retirement': ...}}
+    '''
 
-        wealth_stats[i] = {}
+    wealths = np.stack([trajectories[k] for k in keys])
+    returns = np.stack([rates_of_return[k] for k in keys])
+
+    # get the $ value of wealth at retirement and at the max user age
+    wealth_at_retirement = wealths[:, idx_at_retirement]
+    wealth_at_end = wealths[:, idx_at_final_age]
+
+    # get the average annualized rate of return of the stock market through the savings phase
+    # and until the max user age
+    rate_of_return_at_retirement = calc_geometric_rate_of_return(start_value=1,
+                                                                 end_value=returns[:, idx_at_retirement - 1],
+                                                                 num_periods=years_to_retire_minus_one)
+    rate_of_return_at_end = calc_geometric_rate_of_return(start_value=1,
+                                                          end_value=returns[:, idx_at_final_age - 1],
+                                                          num_periods=idx_at_final_age - 1)
+
+    # find the index of the first instance when wealth for a given year is negative
+    # (999 when wealth never runs out)
+    is_depleted = wealths <= 0
+    first_depleted_idx = is_depleted.argmax(axis=1)
+    ever_depleted = is_depleted.any(axis=1)
+
+    wealth_stats = {}
+
+    for j, k in enumerate(keys):
+        wealth_stats[k] = {'wealth_at_retirement': wealth_at_retirement[j],
+                           'rate_of_return_at_retirement': rate_of_return_at_retirement[j],
+                           'wealth_at_end': wealth_at_end[j],
+                           'rate_of_return_at_end': rate_of_return_at_end[j],
+                           'age_at_negative_wealth': age_list[first_depleted_idx[j]] if ever_depleted[j] else 999}
 
-        # get the $ value of weath at retirement for the given percentile
-        # (eg 1200000)
-        wealth_stats[i]['wealth_at_retirement'] = trajectories[i][idx_at_retirement]
+    return wealth_stats
 
-         # get the average annualized rate of return of the stock market through the 
-         # savings phase for the given percentile
-        wealth_stats[i]['rate_of_return_at_retirement'] = calc_geometric_rate_of_return(start_value=1,
-            end_value=rates_of_return[i][idx_at_retirement - 1],
-            num_periods=years_to_retire_minus_one)
 
-        # get the $ value of wealth at the max user age
-        wealth_stats[i]['wealth_at_end'] = trajectories[i][idx_at_final_age]
+# the ages from get_user_mortality_stats() for which calc_ruin_statistics() reports the probability of ruin
+MORTALITY_KEYS = ['expected_age_at_death', '25%', '10%', '5%', '1%']
 
-        # get the average rate of return of the stock market until the max
-        # user age
-        wealth_stats[i]['rate_of_return_at_end'] = calc_geometric_rate_of_return(start_value=1,
-                                                                          end_value=rates_of_return[i][
-                                                                              idx_at_final_age - 1],
-                                                                          num_periods=idx_at_final_age - 1)
-        # find the index of the first instance when wealth for a given year
-        # is negative
-        temp = next((x for x in iter(range(len(trajectories[i]))) if trajectories[i][x] <= 0), 999)
 
-        if temp == 999:
-            wealth_stats[i]['age_at_negative_wealth'] = 999
-        else:
-            wealth_stats[i]['age_at_negative_wealth'] = age_list[temp]
+def calc_ruin_statistics(wealths, age_list, user_mortality, keys=MORTALITY_KEYS):
+    '''
+    find the age at which every simulated path first runs out of money (wealth <= 0), in one pass over the
+    [num_simulations x num_periods] wealth matrix, and summarize the distribution of these ages.
+
+    :return: a dictionary with
+        'depletion_probs': the probability of first running out of money at each age in age_list
+        'asset_survival_probs': the probability that the money has not run out by the end of each age
+        'ruin_probs': the probability of running out of money at or before each age in user_mortality (for
+                      the keys given, eg {'expected_age_at_death': 0.02, ..., '1%': 0.15})
+        'ruin_prob': the probability of running out of money at any age
+    '''
 
-    return wealth_stats
+    num_simulations, num_periods = wealths.shape
 
-def financial_plan(params, contributions, equity_returns, bond_returns):
+    # 1. find the first depleted period of every path (argmax returns the first True, and 0 for paths that are
+    # never depleted, so those are told apart with the value at that index)
+    is_depleted = wealths <= 0
+    first_depleted_idx = is_depleted.argmax(axis=1)
+    ever_depleted = is_depleted[np.arange(num_simulations), first_depleted_idx]
+
+    # 2. histogram of the depletion ages and the survival curve of the assets
+    depletion_probs = np.bincount(first_depleted_idx[ever_depleted], minlength=num_periods) / num_simulations
+    asset_survival_probs = 1.0 - np.cumsum(depletion_probs)
+
+    # 3. probability of running out of money by each mortality threshold (ages beyond the simulated periods,
+    # eg 999 when the survival probability is never reached, are capped at the last period)
+    ruin_probs = {}
+    for k in keys:
+        idx = min(max(user_mortality[k] - age_list[0], 0), num_periods - 1)
+        ruin_probs[k] = 1.0 - asset_survival_probs[idx]
+
+    return {'depletion_probs': depletion_probs,
+            'asset_survival_probs': asset_survival_probs,
+            'ruin_probs': ruin_probs,
+            'ruin_prob': 1.0 - asset_survival_probs[-1]}
+
+
+def calc_market_return_distributions(equity_returns, keys=DISTRIBUTION_KEYS):
+    '''
+    calculate the distribution of the cumulative stock market return (growth of $1) in every period
+    '''
 
     rates_of_return = equity_returns[:, 1:]
     rates_of_return = rates_of_return + 1
     rates_of_return = np.cumprod(rates_of_return, axis=1)
-    rates_of_return = wealth_distributions(rates_of_return)
-            
+    rates_of_return = wealth_distributions(rates_of_return, keys=keys)
+
+    return rates_of_return
+
+
+def financial_plan(params, contributions, equity_returns, bond_returns, keys=MILESTONE_KEYS, wealths=None):
+    '''
+    run the financial plan on the market returns given.
+
+    the wealth paths can be passed in if they are already known (eg simulated by adaptive_financial_plan()), so
+    that they are not calculated twice
+    '''
+
+    rates_of_return = calc_market_return_distributions(equity_returns, keys=keys)
+
     allocations = calc_asset_allocations(user_age=params['user_age'],
                                             retirement_age=params['user_retirement_age'],
                                             final_age=params['user_mortality']['1%'],
                                             percent_at_retirement=0.6,
                                             glide_length=10)
 
-    # make an array of allocations for every simulation (previously 'allocations' was a single array of size
-    # [1 x num_periods]. Now let's make it [num_simulations x num_periods] so that it is consistent with other arrays)
-    allocations = np.array([allocations for i in range(params['num_simulations'])])
-
     # 5b. calculate the contributions and spending in each year
 
     # under the base case scenario, pull out the total amount saved by the
@@ -126,9 +267,6 @@ def financial_plan(params, contributions, equity_returns, bond_returns):
     total_user_save = contributions[:params['user_retirement_age'] - params['user_age']].sum()
     total_user_save = dollar_as_text(total_user_save)
 
-    # convert contributions from [num_periods] array to [num_simulations x num_periods]
-    contributions = np.array([contributions for i in range(params['num_simulations'])])
-
     # 5c. calc wealth over time
     # init an [num_simulations x 1]-sized array with the starting wealth
     # value for each element
@@ -137,15 +275,17 @@ def financial_plan(params, contributions, equity_returns, bond_returns):
 
     # calculate the growth of wealth which incorporates market returns,
     # contributions and spending in each period
-    wealths = calc_wealth_trajectory(starting_wealth=starting_wealth_array,
-                                        equity_returns=equity_returns,
-                                        bond_returns=bond_returns,
-                                        allocations=allocations,
-                                        contributions=contributions)
+    # (the allocations and contributions are [num_periods] schedules that are broadcast across the simulations)
+    if wealths is None:
+        wealths = calc_wealth_trajectory(starting_wealth=starting_wealth_array,
+                                            equity_returns=equity_returns,
+                                            bond_returns=bond_returns,
+                                            allocations=allocations,
+                                            contributions=contributions)
 
     # calculate the different wealth trajectories
     # (eg the median path, 25th percentile path, etc)
-    trajectories = wealth_distributions(wealths)
+    trajectories = wealth_distributions(wealths, keys=keys)
 
     # 6. calculate stats about wealth trajectory
 
@@ -155,11 +295,370 @@ def financial_plan(params, contributions, equity_returns, bond_returns):
                                              params['age_list'],
                                              params['idx_at_retirement'],
                                              params['idx_at_final_age'],
-                                             params['years_to_retire_minus_one'])
+                                             params['years_to_retire_minus_one'],
+                                             keys=keys)
+
+    # return the allocations and contributions as [num_simulations x num_periods] arrays (read-only views of the
+    # schedules, so nothing is copied)
+    shape = wealths.shape
+    allocations = np.broadcast_to(allocations, shape)
+    contributions = np.broadcast_to(contributions, shape)
 
     return total_user_save, starting_wealth_array, allocations, contributions, wealths, trajectories, wealth_stats
 
 
+def simulate_scenarios(starting_wealth, equity_returns, bond_returns, allocations, contributions, reducer,
+                       memory_budget=SCENARIO_MEMORY_BUDGET, dtype=np.float64, checkpoint=None):
+    '''
+    calculate wealth trajectories for a stack of scenarios that share the same market returns.
+
+    contributions is a [num_scenarios x num_periods] array with one contribution schedule per scenario. allocations
+    is either a [num_periods] schedule shared by every scenario or a [num_scenarios x num_periods] array. The
+    scenarios are evaluated as one [num_periods x scenarios x num_simulations] computation, split into chunks of
+    scenarios so that the wealth (and growth) arrays of a chunk fit in memory_budget bytes.
+
+    reducer is called once per scenario with the [num_simulations x num_periods] wealth array of that scenario
+    (a view that is only valid during the call) and the index of the scenario.
+
+    checkpoint is an optional [num_simulations x k] array with the wealth of the first k periods, which every
+    scenario shares (see calc_wealth_trajectory()). Only the periods from k onwards are then simulated.
+
+    :return: a list with the output of the reducer for each scenario
+    '''
+
+    contributions = np.atleast_2d(contributions)
+    allocations = np.asarray(allocations)
+    num_scenarios, num_periods = contributions.shape
+    num_simulations = equity_returns.shape[0]
+
+    assert equity_returns.shape[1] == num_periods, 'error: equity returns and contributions do not have the same number of periods'
+
+    shared_allocations = allocations.ndim == 1
+
+    # periods before first_period are copied from the checkpoint, and the simulation starts from its last period
+    if checkpoint is None:
+        first_period = 0
+    else:
+        first_period = checkpoint.shape[1]
+        starting_wealth = checkpoint[:, -1]
+
+    equity_returns = equity_returns[:, first_period:]
+    bond_returns = periods_from(bond_returns, first_period)
+    allocations = periods_from(allocations, first_period)
+
+    # the growth factors only need to be calculated once when every scenario uses the same allocations
+    # (they are then broadcast across the scenario axis)
+    if shared_allocations:
+        growth = calc_growth_factors(equity_returns, bond_returns, allocations, dtype=dtype)[:, np.newaxis, :]
+
+    # size the chunks so that the wealth array (plus the growth array if every scenario has its own) stays in budget
+    arrays_per_scenario = 1 if shared_allocations else 2
+    bytes_per_scenario = arrays_per_scenario * num_periods * num_simulations * np.dtype(dtype).itemsize
+    chunk_size = int(max(1, min(num_scenarios, memory_budget // bytes_per_scenario)))
+
+    results = []
+
+    for start in range(0, num_scenarios, chunk_size):
+        stop = min(start + chunk_size, num_scenarios)
+
+        if not shared_allocations:
+            growth = np.stack([calc_growth_factors(equity_returns, bond_returns, allocations[i], dtype=dtype)
+                               for i in range(start, stop)], axis=1)
+
+        # [num_periods x chunk x 1] so the contributions broadcast across simulations
+        chunk_contributions = contributions[start:stop, first_period:].T[:, :, np.newaxis]
+
+        wealths = np.empty(shape=[num_periods, stop - start, num_simulations], dtype=dtype)
+        if first_period:
+            wealths[:first_period] = checkpoint.T[:, np.newaxis, :]
+
+        calc_wealth_from_growth(starting_wealth, growth, chunk_contributions, dtype=dtype,
+                                out=wealths[first_period:])
+
+        for i in range(stop - start):
+            results.append(reducer(wealths[:, i, :].T, start + i))
+
+    return results
+
+
+def financial_plan_scenarios(params, scenarios, equity_returns, bond_returns, keys=MILESTONE_KEYS,
+                             memory_budget=SCENARIO_MEMORY_BUDGET, base_contributions=None, base_wealths=None):
+    '''
+    run the financial plan for several what-if scenarios at once, using the same market returns for all of them.
+
+    each scenario is a dictionary with a 'contributions' array of size [num_periods] and, optionally, an
+    'allocations' array of size [num_periods] (defaults to the glide path of the base plan), an 'idx_at_retirement'
+    and a 'years_to_retire_minus_one' (both default to the values in params).
+
+    when the contributions and the [num_simulations x num_periods] wealth paths of the base plan (simulated on the
+    same market returns) are given, every scenario is only simulated from the first period where its contributions
+    or allocations differ from the base plan (eg from retirement onwards for a lower spend), and the wealth of the
+    periods before is taken from the base plan.
+
+    :return: a list with the wealth_stats dictionary of each scenario (the same structure as financial_plan())
+    '''
+
+    # the market return statistics do not depend on the scenario, so calculate them once
+    rates_of_return = calc_market_return_distributions(equity_returns, keys=keys)
+
+    base_allocations = calc_asset_allocations(user_age=params['user_age'],
+                                              retirement_age=params['user_retirement_age'],
+                                              final_age=params['user_mortality']['1%'],
+                                              percent_at_retirement=0.6,
+                                              glide_length=10)
+
+    # group the scenarios by the first period in which they differ from the base plan
+    groups = {}
+    for i, scenario in enumerate(scenarios):
+        if base_wealths is None:
+            first_period = 0
+        else:
+            differs = np.asarray(scenario['contributions']) != base_contributions
+            if 'allocations' in scenario:
+                differs |= np.asarray(scenario['allocations']) != base_allocations
+            first_period = int(differs.argmax()) if differs.any() else len(differs)
+
+        groups.setdefault(first_period, []).append(i)
+
+    starting_wealth_array = np.full(
+        shape=params['num_simulations'], fill_value=params['user_wealth'])
+
+    def _wealth_stats(wealths, i, checkpoint_trajectories=None):
+        scenario = scenarios[i]
+        if checkpoint_trajectories is None:
+            trajectories = wealth_distributions(wealths, keys=keys)
+        else:
+            trajectories = wealth_distributions_from_checkpoint(wealths, checkpoint_trajectories, keys=keys)
+        return calc_wealth_milestones(trajectories,
+                                      rates_of_return,
+                                      params['age_list'],
+                                      scenario.get('idx_at_retirement', params['idx_at_retirement']),
+                                      params['idx_at_final_age'],
+                                      scenario.get('years_to_retire_minus_one', params['years_to_retire_minus_one']),
+                                      keys=keys)
+
+    all_wealth_stats = [None] * len(scenarios)
+
+    for first_period, indices in groups.items():
+        group = [scenarios[i] for i in indices]
+
+        # the wealth of the periods before first_period is the same for the whole group (and the base plan), so
+        # its distributions are only calculated once
+        checkpoint = base_wealths[:, :first_period] if first_period else None
+        checkpoint_trajectories = wealth_distributions(checkpoint, keys=keys) if first_period else None
+
+        contributions = np.array([s['contributions'] for s in group])
+
+        if any('allocations' in s for s in group):
+            allocations = np.array([s.get('allocations', base_allocations) for s in group])
+        else:
+            allocations = base_allocations
+
+        group_wealth_stats = simulate_scenarios(starting_wealth_array, equity_returns, bond_returns, allocations,
+                                                contributions,
+                                                reducer=lambda wealths, j, indices=indices, checkpoint_trajectories=checkpoint_trajectories:
+                                                _wealth_stats(wealths, indices[j], checkpoint_trajectories),
+                                                memory_budget=memory_budget,
+                                                checkpoint=checkpoint)
+
+        for i, wealth_stats in zip(indices, group_wealth_stats):
+            all_wealth_stats[i] = wealth_stats
+
+    return all_wealth_stats
+
+
+def sensitivity_grid(params, equity_returns, bond_returns, save_levels, retirement_ages,
+                     memory_budget=16 * 1024 ** 2, dtype=np.float32):
+    '''
+    evaluate the plan over a grid of yearly savings and retirement ages, with the same market returns for every
+    point of the grid (so that the differences between points come from the inputs, not from sampling noise).
+
+    every point is a scenario of simulate_scenarios() (its contribution schedule), so the whole grid runs as one
+    batched [num_periods x grid points x num_simulations] computation in chunks of memory_budget bytes (chunks that
+    fit in the cpu cache run faster than one large chunk). Like the 'work longer' what-if scenarios, every point
+    uses the glide path of the base plan.
+
+    :return: a dictionary with [len(save_levels) x len(retirement_ages)] arrays of
+        'success_probs': the probability that wealth stays positive from retirement to the final age
+        'terminal_wealth_p5': the 5th percentile of wealth at the final age
+    '''
+
+    allocations = calc_asset_allocations(user_age=params['user_age'],
+                                         retirement_age=params['user_retirement_age'],
+                                         final_age=params['user_mortality']['1%'],
+                                         percent_at_retirement=0.6,
+                                         glide_length=10)
+
+    grid = [(save, retirement_age) for save in save_levels for retirement_age in retirement_ages]
+
+    contributions = np.array([calc_contributions(user_age=params['user_age'],
+                                                 retirement_age=retirement_age,
+                                                 final_age=params['user_mortality']['1%'],
+                                                 user_save=save,
+                                                 user_spend=params['user_spend'],
+                                                 user_social_security_age=params['user_social_security_age'],
+                                                 user_social_security_benefit=params['user_social_security_benefit'])
+                              for save, retirement_age in grid], dtype=dtype)
+
+    starting_wealth_array = np.full(shape=equity_returns.shape[0], fill_value=params['user_wealth'])
+    idx_at_final_age = params['idx_at_final_age']
+
+    def _grid_stats(wealths, i):
+        idx_at_retirement = grid[i][1] - params['user_age']
+        success_prob = np.mean(np.all(wealths[:, idx_at_retirement:idx_at_final_age + 1] > 0, axis=1))
+        terminal_wealth_p5 = wealth_quantiles(wealths[:, idx_at_final_age], keys=[5])[5]
+        return success_prob, terminal_wealth_p5
+
+    results = simulate_scenarios(starting_wealth_array, equity_returns, bond_returns, allocations, contributions,
+                                 reducer=_grid_stats, memory_budget=memory_budget, dtype=dtype)
+
+    shape = (len(save_levels), len(retirement_ages))
+
+    return {'success_probs': np.array([r[0] for r in results]).reshape(shape),
+            'terminal_wealth_p5': np.array([r[1] for r in results], dtype=np.float64).reshape(shape)}
+
+
+def calc_confidence_half_widths(x, keys, confidence=0.95):
+    '''
+    estimate how precisely the statistics in keys are pinned down by the simulated values in x.
+
+    for the mean, the half-width of the usual normal confidence interval is used. For a percentile p, the
+    distribution-free interval between the order statistics of rank n*p -/+ z*sqrt(n*p*(1-p)) is used
+    (the number of simulations below the true percentile is binomial(n, p)).
+
+    let the input x be an array of size [num_simulations x num_columns].
+    :return: a dictionary with an array of [num_columns] confidence interval half-widths for every key
+    '''
+
+    num_simulations = x.shape[0]
+    z = scipy.stats.norm.ppf(0.5 + confidence / 2)
+
+    half_widths = {}
+
+    for k in keys:
+        if k == 'mean':
+            half_widths[k] = z * x.std(axis=0, ddof=1) / np.sqrt(num_simulations)
+        else:
+            p = (50 if k == 'median' else k) / 100
+            spread = z * np.sqrt(num_simulations * p * (1 - p))
+            lower = int(np.clip(np.floor(num_simulations * p - spread), 0, num_simulations - 1))
+            upper = int(np.clip(np.ceil(num_simulations * p + spread), 0, num_simulations - 1))
+
+            partitioned = np.partition(x, [lower, upper], axis=0)
+            half_widths[k] = (partitioned[upper] - partitioned[lower]) / 2
+
+    return half_widths
+
+
+def adaptive_financial_plan(params, contributions, mean=0.08, stdev=0.14, bond_return=0.01, keys=MILESTONE_KEYS,
+                            tolerance=0.05, abs_tolerance=5000, confidence=0.95, batch_size=2048,
+                            min_simulations=4096, max_simulations=50000, simulation_budget=None, method='pseudo',
+                            seed=None, shocks=None):
+    '''
+    run the financial plan with as many random walk paths as it takes to pin down the reported statistics.
+
+    paths are simulated in batches of batch_size (a power of 2, so that every sobol batch, or every batch of the
+    shock bank, is a balanced sequence). After every batch, the confidence interval of each statistic
+    in keys is estimated for the wealth at retirement and at the final age. The simulation stops once every
+    half-width is within tolerance (relative to the estimate) or abs_tolerance (in dollars, for estimates close
+    to zero), or once the next batch would take the plan past max_simulations paths or past simulation_budget.
+
+    simulation_budget is the latency budget of the plan, counted in simulated path-years (paths x num_periods)
+    rather than in seconds: the time a plan takes (including the scenarios that are run on its paths afterwards)
+    grows with the number of path-years, and a budget in seconds would make the number of paths, and so the
+    result, depend on the load of the machine. The stopping rule only depends on the inputs, so the same inputs
+    always simulate the same paths and give the same result (which is what the plan cache and the job ids assume).
+    The budget never stops a plan before min_simulations paths.
+
+    when shocks is given (a [periods x paths] array of standard normals, eg from apps.shock_bank), the batches are
+    consecutive slices of it instead of fresh draws (method and seed are ignored), so that plans with the same
+    inputs give the same results and plans with different inputs are run on common random numbers.
+
+    :return: the output of financial_plan() for the simulated paths, the equity and bond returns that were used
+    (so that scenarios can be run on the same paths) and a dictionary that describes the convergence
+    '''
+
+    if shocks is not None:
+        assert shocks.shape[0] >= params['num_periods'], 'error: the shocks cover fewer periods than the plan'
+        max_simulations = min(max_simulations, shocks.shape[1])
+
+    allocations = calc_asset_allocations(user_age=params['user_age'],
+                                         retirement_age=params['user_retirement_age'],
+                                         final_age=params['user_mortality']['1%'],
+                                         percent_at_retirement=0.6,
+                                         glide_length=10)
+
+    bond_returns = np.full(shape=params['num_periods'], fill_value=bond_return)
+    bond_returns[0] = 0.0
+
+    milestone_columns = [params['idx_at_retirement'], params['idx_at_final_age']]
+
+    equity_return_batches = []
+    wealth_batches = []
+    milestone_batches = []
+
+    while True:
+
+        # simulate another batch of paths (each batch gets its own seed so that sobol batches are
+        # independent scrambles)
+        if shocks is None:
+            batch_seed = None if seed is None else seed + len(equity_return_batches)
+            equity_returns = random_walk_simulations(mean=mean,
+                                                     stdev=stdev,
+                                                     periods=params['num_periods'],
+                                                     num_simulations=batch_size,
+                                                     method=method,
+                                                     seed=batch_seed)
+        else:
+            batch_start = len(equity_return_batches) * batch_size
+            equity_returns = random_walk_from_shocks(mean=mean,
+                                                     stdev=stdev,
+                                                     shocks=shocks[:params['num_periods'],
+                                                                   batch_start:batch_start + batch_size])
+
+        wealths = calc_wealth_trajectory(starting_wealth=np.full(batch_size, params['user_wealth']),
+                                         equity_returns=equity_returns,
+                                         bond_returns=bond_returns,
+                                         allocations=allocations,
+                                         contributions=contributions)
+
+        equity_return_batches.append(equity_returns)
+        wealth_batches.append(wealths)
+        milestone_batches.append(wealths[:, milestone_columns])
+
+        # check how precisely the statistics at retirement and at the final age are known
+        milestones = np.concatenate(milestone_batches, axis=0)
+        num_simulations = milestones.shape[0]
+
+        estimates = wealth_quantiles(milestones, keys=keys)
+        half_widths = calc_confidence_half_widths(milestones, keys, confidence=confidence)
+
+        converged = all(np.all(half_widths[k] <= np.maximum(tolerance * np.abs(estimates[k]), abs_tolerance))
+                        for k in keys)
+
+        if num_simulations >= min_simulations and converged:
+            break
+        if num_simulations + batch_size > max_simulations:
+            break
+        if (num_simulations >= min_simulations and simulation_budget is not None
+                and (num_simulations + batch_size) * params['num_periods'] > simulation_budget):
+            break
+
+    # stitch the batches together (period by period, to keep the period-major layout of the returns and wealth)
+    equity_returns = np.concatenate([e.T for e in equity_return_batches], axis=1).T
+    wealths = np.concatenate([w.T for w in wealth_batches], axis=1).T
+
+    plan_params = dict(params)
+    plan_params['num_simulations'] = num_simulations
+
+    plan = financial_plan(plan_params, contributions, equity_returns, bond_returns, keys=keys, wealths=wealths)
+
+    convergence = {'num_simulations': num_simulations,
+                   'converged': converged,
+                   'half_widths': half_widths}
+
+    return plan, equity_returns, bond_returns, convergence
+
 
 def depleted_text(depleted_age, final_wealth, wealth_at_retirement):
     if (depleted_age == 999) & (final_wealth > (1.2 * wealth_at_retirement)):
@@ -177,24 +676,17 @@ def calc_geometric_rate_of_return(start_value, end_value, num_periods):
 
 
 def calc_contributions(user_age, retirement_age, final_age, user_save, user_spend, user_social_security_age, user_social_security_benefit):
-    ''' 
-    make an array that contains the contribution (or spend) for every period. 
     '''
+    make an array that contains the contribution (or spend) for every period.
 
-    num_periods = final_age - user_age + 1
-    age_list = list(range(user_age, final_age + 1))
-    contributions = np.array([0] * num_periods)
-
-    for i in range(num_periods):
-
-        if age_list[i] < retirement_age:
-            contributions[i] = user_save
-        else:
-            contributions[i] = -user_spend
+    :return: an integer array of size [num_periods] (the amounts are truncated to whole dollars)
+    '''
 
-        if age_list[i] >= user_social_security_age:
-            contributions[i] += user_social_security_benefit
+    ages = np.arange(user_age, final_age + 1)
 
+    # save before retirement and spend from retirement onwards, plus the social security benefit once it starts
+    contributions = np.where(ages < retirement_age, int(user_save), -int(user_spend))
+    contributions = (contributions + np.where(ages >= user_social_security_age, user_social_security_benefit, 0)).astype(int)
 
     # set first period (current user age) to zero
     contributions[0] = 0
@@ -206,50 +698,92 @@ def calc_asset_allocations(user_age, retirement_age, final_age, percent_at_retir
     '''
     for every age, calculate the allocation "p" to stocks (with the assumption that 1-p is allocated to bonds)
 
+    the allocation is 100% until glide_length years before retirement, then it is gradually reduced (by the same
+    amount every year) to percent_at_retirement, which is held from retirement onwards.
+
     :return: an array with percent allocation to stocks for every year
     '''
 
-    # init a set of parameters
-    # (num of periods that we need to simualte, a list with the ages for each period and
-    # an array that holds the allocation to stocks in each period)
-    num_periods = final_age - user_age + 1
-    age_list = list(range(user_age, final_age + 1))
-    allocations = np.array([1.0] * num_periods)
+    ages = np.arange(user_age, final_age + 1)
 
-    # iterate through all periods of the simulation
-    for i in range(num_periods):
+    # get the age at which to start 'gliding' into the retirement allocation
+    glide_start_age = retirement_age - glide_length
+    decrement = (1.0 - percent_at_retirement) / glide_length if glide_length > 0 else 0.0
 
-        # get the user's age in the current period
-        current_age = age_list[i]
+    allocations = np.where(ages < glide_start_age, 1.0, 1.0 - decrement * (ages - glide_start_age))
+    allocations = np.where(ages >= retirement_age, percent_at_retirement, allocations)
 
-        # if user is at or in retirement, then set to target allocation
-        if current_age >= retirement_age:
-            allocations[i] = percent_at_retirement
+    return allocations
 
-        # else if user is still in savings phase, calculate a trajectory
-        # where the user's allocation is graduatlly reduced from 100% to the
-        # target allocation
-        else:
 
-            # get the age at which to start 'gliding' into the retirement
-            # allocation
-            glide_start_age = retirement_age - glide_length
+# the ways random_walk_simulations() can draw its standard normal shocks
+SAMPLING_METHODS = ['pseudo', 'antithetic', 'sobol']
 
-            if current_age < glide_start_age:
-                allocations[i] = 1.0
-            else:
-                decrement = (1.0 - percent_at_retirement) / \
-                    (retirement_age - glide_start_age)
-                allocations[i] = 1.0 - decrement * \
-                    (current_age - glide_start_age)
 
-    return allocations
+def standard_normal_draws(periods, num_simulations, method='pseudo', seed=None):
+    '''
+    draw standard normal shocks for num_simulations paths of the given number of periods.
+
+    :method: how the shocks are drawn
+        'pseudo': plain pseudo-random normals
+        'antithetic': pseudo-random normals for half of the paths, and their mirror image (-z) for the
+                      other half, so that every path is paired with its opposite
+        'sobol': scrambled Sobol points (one dimension per period) mapped through the inverse normal cdf.
+                 This low-discrepancy sequence covers the tails more evenly than pseudo-random draws
+                 (requires scipy >= 1.7)
+    :seed: seed for the draws (the global numpy random state is used when seed is None and method is not sobol)
+    :return: an array of size [periods x num_simulations]
+    '''
+
+    random_state = np.random if seed is None else np.random.RandomState(seed)
+
+    if method == 'pseudo':
+        return random_state.standard_normal(size=[periods, num_simulations])
+
+    elif method == 'antithetic':
+        half = random_state.standard_normal(size=[periods, (num_simulations + 1) // 2])
+        return np.concatenate([half, -half], axis=1)[:, :num_simulations]
+
+    elif method == 'sobol':
+        from scipy.stats import qmc
+
+        # draw the next power of 2 points (where the sequence is balanced) and keep the first num_simulations
+        sampler = qmc.Sobol(d=periods, scramble=True, seed=seed)
+        points = sampler.random_base2(m=int(np.ceil(np.log2(max(num_simulations, 2)))))[:num_simulations]
+
+        # keep the points strictly inside (0, 1) so the inverse cdf stays finite
+        points = np.clip(points, 1e-12, 1 - 1e-12)
+
+        return np.ascontiguousarray(scipy.stats.norm.ppf(points).T)
+
+    else:
+        raise ValueError('unknown sampling method: {}'.format(method))
+
+
+def random_walk_from_shocks(mean, stdev, shocks, set_first_obs_as_zero=True):
+    '''
+    scale standard normal shocks of size [periods x num_simulations] into returns with the given mean and standard
+    deviation. The shocks are not modified (they can be a read-only view, eg a slice of the shock bank).
+
+    :return: a numpy array of size [num_simulations x periods] (a transposed view of a period-major array)
+    '''
+
+    random_returns = np.multiply(shocks, stdev)
+    random_returns += mean
+    random_returns = random_returns.T
+
+    if set_first_obs_as_zero:
+        random_returns[:, 0] = 0
+
+    return random_returns
 
 
-def random_walk_simulations(mean, stdev, periods, num_simulations, set_first_obs_as_zero=True):
+def random_walk_simulations(mean, stdev, periods, num_simulations, set_first_obs_as_zero=True, method='pseudo',
+                            seed=None):
     '''
     simulate market returns by sampling from a normal distribution. Create a set of
-    simulations, each composed of a series of returns.
+    simulations, each composed of a series of returns. The shocks can be pseudo-random,
+    antithetic or quasi-random (see standard_normal_draws() for the methods).
 
 
     return a numpy array of size [num_simulations x periods] that represents several sequences
@@ -258,20 +792,68 @@ def random_walk_simulations(mean, stdev, periods, num_simulations, set_first_obs
 
     # draw random numbers from a normal distribution with specified mean and standard deviation
     # the result is an [num_simulations x periods] array of simulated returns
-    random_returns = np.random.normal(
-        mean, stdev, size=[num_simulations, periods])
+    # (the draws are laid out period by period in memory and returned as a transposed view, which lets
+    # calc_wealth_trajectory() read every period contiguously)
+    shocks = standard_normal_draws(periods, num_simulations, method=method, seed=seed)
 
-    if set_first_obs_as_zero:
-        random_returns[:, 0] = 0
+    return random_walk_from_shocks(mean, stdev, shocks, set_first_obs_as_zero=set_first_obs_as_zero)
 
-    return random_returns
 
+def wealth_quantiles(x, keys=DISTRIBUTION_KEYS, axis=0):
+    '''
+    calculate any set of percentiles (plus the mean) of x along an axis with a single partition of the data.
+
+    keys can contain percentiles as numbers (eg 75 or 2.5), 'median' (same as 50) and 'mean'. Percentiles are
+    linearly interpolated between order statistics, exactly like np.percentile(), but all of the order statistics
+    that are needed are found in one np.partition() call instead of one sort per percentile.
+
+    the statistics are written into a single [num_keys x ...] array (in the order of keys), so the arrays in the
+    returned dictionary are its rows.
 
-def wealth_distributions(x):
+    :return: a dictionary with an array of statistics for every key, eg {'mean': array, 75: array, ...}
+    '''
+
+    x = np.moveaxis(np.asarray(x), axis, 0)
+    num_obs = x.shape[0]
+
+    percentiles = {k: 50 if k == 'median' else k for k in keys if k != 'mean'}
+
+    # find the positions of the order statistics around each percentile
+    # (for the pth percentile, the position is p/100 * (n - 1), interpolated between its floor and ceiling)
+    positions = {k: p / 100 * (num_obs - 1) for k, p in percentiles.items()}
+    kth = sorted({int(np.floor(v)) for v in positions.values()} | {int(np.ceil(v)) for v in positions.values()})
+
+    dtype = x.dtype if np.issubdtype(x.dtype, np.floating) else np.float64
+    stacked = np.empty(shape=(len(keys),) + x.shape[1:], dtype=dtype)
+    rows = {k: i for i, k in enumerate(keys)}
+
+    if kth:
+        partitioned = np.partition(x, kth, axis=0)
+
+        for k, position in positions.items():
+            below = partitioned[int(np.floor(position))]
+            above = partitioned[int(np.ceil(position))]
+            weight = position - np.floor(position)
+
+            # interpolate from whichever end is closer (the same scheme as np.percentile)
+            if weight < 0.5:
+                stacked[rows[k]] = below + (above - below) * weight
+            else:
+                stacked[rows[k]] = above - (above - below) * (1 - weight)
+    else:
+        partitioned = x
+
+    if 'mean' in keys:
+        stacked[rows['mean']] = np.mean(partitioned, axis=0)
+
+    return {k: stacked[i] for i, k in enumerate(keys)}
+
+
+def wealth_distributions(x, keys=DISTRIBUTION_KEYS):
     '''
     calculate the distribution statistics for a set of wealth trajectories over time. 
     for each period, calculate the mean, median, 25th, 10th, 5th and 1st percentiles of wealth across
-    the simulated wealth trajectories
+    the simulated wealth trajectories (or just the statistics listed in keys)
 
 
     let the input x be an array of size [num_simulations x num_periods].
@@ -281,24 +863,24 @@ def wealth_distributions(x):
     mean across the m simulations for the ith period. 
     '''
 
-    means = np.mean(x, axis=0)
-    medians = np.median(x, axis=0)
-    p75 = np.percentile(x, 75, axis=0)
-    p50 = np.percentile(x, 50, axis=0)
-    p25 = np.percentile(x, 25, axis=0)
-    p10 = np.percentile(x, 10, axis=0)
-    p5 = np.percentile(x, 5, axis=0)
-    p1 = np.percentile(x, 1, axis=0)
+    return wealth_quantiles(x, keys=keys, axis=0)
+
+
+def wealth_distributions_from_checkpoint(x, checkpoint_distributions, keys=DISTRIBUTION_KEYS):
+    '''
+    calculate the same statistics as wealth_distributions(), when the statistics of the first k periods are already
+    known (checkpoint_distributions, eg from the base plan of scenarios with the same savings phase). Only the
+    periods from k onwards are partitioned.
+    '''
 
-    return {'mean': means,
-            'median': medians,
-            75: p75,
-            50: p50,
-            25: p25,
-            10: p10,
-            5: p5,
-            1: p1
-            }
+    first_period = len(checkpoint_distributions[keys[0]])
+
+    suffix_distributions = wealth_distributions(x[:, first_period:], keys=keys)
+
+    stacked = np.concatenate([np.stack([checkpoint_distributions[k] for k in keys]),
+                              np.stack([suffix_distributions[k] for k in keys])], axis=1)
+
+    return {k: stacked[i] for i, k in enumerate(keys)}
 
 
 def dollar_as_text(x):
@@ -318,38 +900,8 @@ def dollar_as_text(x):
 def percent_as_text(x):
     return str(round(x*100,2)) + '%'
 
-def get_user_mortality_stats(user_age, mortality_table):
-
-    user_mortality = {}
-
-    # 1. get the expected age at death (average between male and female statistics)
-    expected_age_at_death = mortality_table.loc[user_age, 'expected_years_till_death_male']
-    expected_age_at_death += mortality_table.loc[user_age, 'expected_years_till_death_female']
-    expected_age_at_death /= 2
-    expected_age_at_death = int(expected_age_at_death) + user_age
-
-    user_mortality['expected_age_at_death'] = expected_age_at_death
-
-    # 2. calculate the cumulative survival probabilities
-    # (what age is the user expected to live to with 25%, 5%, 1% probability conditional
-    # on their current age)
-
-    # first, subset the dataset to drop ages that are less than the users expected age at death
-    # (this is going to be the 50% survivial probability)
-    this_mortality_df = mortality_table[user_age:]
-    this_mortality_df['cum_survival_prob'] = this_mortality_df['forward_survival_prob_1y'].cumprod()
-
-    age_list = this_mortality_df.index.tolist()
-    cum_survival_prob_list = this_mortality_df['cum_survival_prob'].tolist()
-
-    user_mortality['25%'] = calc_age_for_survival_prob(0.25, age_list, cum_survival_prob_list)
-    user_mortality['10%'] = calc_age_for_survival_prob(0.10, age_list, cum_survival_prob_list)
-    user_mortality['5%'] = calc_age_for_survival_prob(0.05, age_list, cum_survival_prob_list)
-    user_mortality['1%'] = calc_age_for_survival_prob(0.01, age_list, cum_survival_prob_list)
-
-    return user_mortality, age_list
-
 
+@functools.lru_cache(maxsize=1)
 def get_historical_annual_returns():
 
     df = pd.read_csv('data/lt_annual_asset_returns.csv')
@@ -370,19 +922,89 @@ def get_historical_annual_returns():
     return years, sp500, ust_3m, ust, bbb
 
 
-def build_single_continuous_sample_series(start_i, max_i, num_periods):
-    index_list = list(range(start_i, start_i + num_periods))
+def build_bootstrap_indices(num_periods, num_simulations, num_samples, method='circular', block_length=5):
+    '''
+    build a [num_simulations x num_periods] array of indices into a historical sample of size num_samples by
+    stringing together blocks of consecutive observations. All simulations are built at once with modular
+    arithmetic (no python loops over simulations or blocks).
+
+    :method: how the blocks are drawn
+        'circular': blocks of block_length observations that start anywhere in the sample and wrap around from
+                    the last observation to the first one
+        'moving': blocks of block_length observations that start anywhere a full block fits in the sample
+                  (no wrapping)
+        'stationary': blocks of random length (geometrically distributed with mean block_length) that wrap
+                      around like the circular blocks (Politis and Romano, 1994)
+    :return: an integer array of size [num_simulations x num_periods]
+    '''
 
-    def _wrap(x, ceiling):
+    if method in ('circular', 'moving'):
 
-        if x < ceiling:
-            return x
-        else:
-            return x - ceiling
+        # draw enough blocks to cover all periods, then trim any excess
+        num_blocks = -(-num_periods // block_length)
+        max_start = num_samples if method == 'circular' else num_samples - block_length + 1
+
+        assert max_start > 0, 'error: the sample is shorter than a block'
+
+        starts = np.random.randint(0, max_start, size=[num_simulations, num_blocks])
+        indices = starts[:, :, np.newaxis] + np.arange(block_length)
+        indices = indices.reshape(num_simulations, num_blocks * block_length)[:, :num_periods]
+
+        return indices % num_samples
 
-    index_list = [_wrap(i, max_i) for i in index_list]
+    elif method == 'stationary':
 
-    return index_list
+        # a new block starts in the first period and then in every period with probability 1 / block_length
+        new_block = np.random.random_sample(size=[num_simulations, num_periods]) < (1.0 / block_length)
+        new_block[:, 0] = True
+        starts = np.random.randint(0, num_samples, size=[num_simulations, num_periods])
+
+        # for every period, find the period in which its block started and count the periods since then
+        periods = np.arange(num_periods)
+        block_start_period = np.maximum.accumulate(np.where(new_block, periods, 0), axis=1)
+        periods_into_block = periods - block_start_period
+
+        indices = np.take_along_axis(starts, block_start_period, axis=1) + periods_into_block
+
+        return indices % num_samples
+
+    else:
+        raise ValueError('unknown bootstrap method: {}'.format(method))
+
+
+def build_bootstrap_sampled_returns(num_periods_per_simulation,
+                                    num_simulations,
+                                    year_list,
+                                    sp500_list,
+                                    ust_list,
+                                    method='stationary',
+                                    block_length=5,
+                                    set_first_obs_as_zero=True):
+    '''
+    build simulated returns by resampling blocks of historical returns (see build_bootstrap_indices() for the
+    available methods). The years and the returns of every series are gathered from one index array, so the
+    stock and bond returns of a simulation always come from the same historical years.
+
+    :return: three [num_simulations x num_periods_per_simulation] arrays with the sampled years, sp500 returns
+    and ust returns
+    '''
+
+    indices = build_bootstrap_indices(num_periods=num_periods_per_simulation,
+                                      num_simulations=num_simulations,
+                                      num_samples=len(year_list),
+                                      method=method,
+                                      block_length=block_length)
+
+    all_sampled_years = np.asarray(year_list)[indices]
+    all_sampled_sp500_returns = np.asarray(sp500_list, dtype=float)[indices]
+    all_sampled_ust_returns = np.asarray(ust_list, dtype=float)[indices]
+
+    if set_first_obs_as_zero:
+        all_sampled_years[:, 0] = 0
+        all_sampled_sp500_returns[:, 0] = 0
+        all_sampled_ust_returns[:, 0] = 0
+
+    return all_sampled_years, all_sampled_sp500_returns, all_sampled_ust_returns
 
 
 def build_continuous_sampled_returns(num_periods_per_simulation,
@@ -406,46 +1028,22 @@ def build_continuous_sampled_returns(num_periods_per_simulation,
     of 1928. For example, the 90th observation is 2017 and will use a return history based on [2017, 2018 ,2019 , 1928, 
     1929, 1930, ...]
 
+    (this is a circular block bootstrap with a single block that covers every period)
+
     :num_periods: number of periods to simulate
     :num simulations: number of simulations to run
 
 
     '''
-    num_of_samples = len(year_list)
-
-    # pick N random numbers (uniform) over all sample periods
-    # (for example, if we have 150 samples, we are going to pick a number between 0 and 149)
-    randoms = np.random.randint(0, num_of_samples, size=num_simulations)
-
-    all_sampled_sp500_returns = []
-    all_sampled_ust_returns = []
-    all_sampled_years = []
-
-    for i in randoms:
-        index_list = build_single_continuous_sample_series(start_i=i,
-                                                           max_i=num_of_samples,
-                                                           num_periods=num_periods_per_simulation)
-
-        sampled_years = [year_list[i] for i in index_list]
-        all_sampled_years.append(sampled_years)
-
-        sampled_ust = [ust_list[i] for i in index_list]
-        all_sampled_ust_returns.append(sampled_ust)
-
-        sampled_sp500 = [sp500_list[i] for i in index_list]
-        all_sampled_sp500_returns.append(sampled_sp500)
-
-    # convert list of lists to numpy array
-    all_sampled_years = np.array(all_sampled_years)
-    all_sampled_sp500_returns = np.array(all_sampled_sp500_returns)
-    all_sampled_ust_returns = np.array(all_sampled_ust_returns)
 
-    if set_first_obs_as_zero:
-        all_sampled_years[:, 0] = 0
-        all_sampled_sp500_returns[:, 0] = 0
-        all_sampled_ust_returns[:, 0] = 0
-
-    return all_sampled_years, all_sampled_sp500_returns, all_sampled_ust_returns
+    return build_bootstrap_sampled_returns(num_periods_per_simulation=num_periods_per_simulation,
+                                           num_simulations=num_simulations,
+                                           year_list=year_list,
+                                           sp500_list=sp500_list,
+                                           ust_list=ust_list,
+                                           method='circular',
+                                           block_length=num_periods_per_simulation,
+                                           set_first_obs_as_zero=set_first_obs_as_zero)
 
 
 def build_discontinuous_sampled_returns(num_periods_per_simulation,
@@ -464,59 +1062,15 @@ def build_discontinuous_sampled_returns(num_periods_per_simulation,
     this is similar to build_continuous_return_series() but instead we sample small periods and string them 
     together to build a longer simulated history. By sampling several small windows, we gain more diversity
     of simulated trajectories but maintain some degree of serial correlation between continuous years. 
-    '''
-
-    # calculate the number of windows we'll need to contruct (if we want a 42 year history, and the
-    # windows are of length 5, then num_sub_periods is 9 (which will give us a little extra at
-    # 45 years rather than 42 but that's ok, we'll trim the excess later)
-    num_sub_periods = int(num_periods_per_simulation / sub_sample_length)
-    num_sub_periods += 1
-
-    # pick num_sub_periods + 1 random numbers (uniform) over all sample periods
-    num_of_samples = len(year_list)
-    randoms = np.random.randint(0, num_of_samples, size=[
-                                num_simulations, num_sub_periods])
 
-    all_sampled_sp500_returns = []
-    all_sampled_ust_returns = []
-    all_sampled_years = []
-
-    for i in randoms:
-
-        # build a single simulation that consists of num_periods_per_simulation
-        index_list = []
-        for random_num in i:
-
-            # based on the random num, get the next sub_sample_length numbers
-            # (if the random num is 14 and sub_sample_length=6, then make a list
-            # of [14,15,16])
-            one_window = build_single_continuous_sample_series(start_i=random_num,
-                                                               max_i=num_of_samples,
-                                                               num_periods=sub_sample_length)
-
-            index_list = index_list + one_window
-
-        # trim any extra samples from the simulation
-        index_list = index_list[:num_periods_per_simulation]
-
-        # record this one simulation
-
-        sampled_years = [year_list[i] for i in index_list]
-        all_sampled_years.append(sampled_years)
-
-        sampled_ust = [ust_list[i] for i in index_list]
-        all_sampled_ust_returns.append(sampled_ust)
-
-        sampled_sp500 = [sp500_list[i] for i in index_list]
-        all_sampled_sp500_returns.append(sampled_sp500)
-
-    all_sampled_years = np.array(all_sampled_years)
-    all_sampled_sp500_returns = np.array(all_sampled_sp500_returns)
-    all_sampled_ust_returns = np.array(all_sampled_ust_returns)
-
-    if set_first_obs_as_zero:
-        all_sampled_years[:, 0] = 0
-        all_sampled_sp500_returns[:, 0] = 0
-        all_sampled_ust_returns[:, 0] = 0
+    (this is a circular block bootstrap with blocks of sub_sample_length years)
+    '''
 
-    return all_sampled_years, all_sampled_sp500_returns, all_sampled_ust_returns
+    return build_bootstrap_sampled_returns(num_periods_per_simulation=num_periods_per_simulation,
+                                           num_simulations=num_simulations,
+                                           year_list=year_list,
+                                           sp500_list=sp500_list,
+                                           ust_list=ust_list,
+                                           method='circular',
+                                           block_length=sub_sample_length,
+                                           set_first_obs_as_zero=set_first_obs_as_zero)
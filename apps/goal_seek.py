@@ -0,0 +1,182 @@
+'''
+goal seek: find the yearly savings, the yearly spend in retirement or the retirement age that gives a target
+probability that the money lasts.
+
+every solver keeps the market returns fixed (common random numbers) and uses the glide path of the base plan, so
+the growth factor of every path and period is fixed too. For fixed growth factors, wealth is linear in the
+contribution schedule:
+
+    wealth = wealth with no savings + yearly savings * (wealth from saving $1 a year, starting from $0)
+
+so two runs of the wealth recurrence give the wealth of every path for any savings amount. A path succeeds when its
+wealth stays positive from retirement to the final age, ie when the savings exceed a threshold that can be
+computed for every path. The savings that reach the target probability are then a percentile of these thresholds,
+with no search at all (the same holds for the spend in retirement). The retirement age changes the shape of the
+schedule rather than its scale, so it is found with a binary search over whole years.
+'''
+
+import numpy as np
+
+from apps import functions as fn
+
+
+def calc_success_probability(wealths, idx_at_retirement, idx_at_final_age):
+    '''
+    :wealths: a [num_periods x num_simulations] array of wealth (period-major, as returned by
+              fn.calc_wealth_from_growth())
+    :return: the share of paths where wealth stays positive from retirement to the final age
+    '''
+    return np.mean(np.all(wealths[idx_at_retirement:idx_at_final_age + 1] > 0, axis=0))
+
+
+def calc_growth(params, equity_returns, bond_returns):
+    '''
+    :return: the [num_periods x num_simulations] growth factors of the base plan (see fn.calc_growth_factors())
+    '''
+
+    allocations = fn.calc_asset_allocations(user_age=params['user_age'],
+                                            retirement_age=params['user_retirement_age'],
+                                            final_age=params['user_mortality']['1%'],
+                                            percent_at_retirement=0.6,
+                                            glide_length=10)
+
+    return fn.calc_growth_factors(equity_returns, bond_returns, allocations)
+
+
+def calc_plan_contributions(params, retirement_age=None, user_save=None, user_spend=None):
+    '''
+    :return: the contribution schedule of the plan, with the retirement age, savings or spend replaced by the
+    values given
+    '''
+
+    return fn.calc_contributions(user_age=params['user_age'],
+                                 retirement_age=params['user_retirement_age'] if retirement_age is None else retirement_age,
+                                 final_age=params['user_mortality']['1%'],
+                                 user_save=params['user_save'] if user_save is None else user_save,
+                                 user_spend=params['user_spend'] if user_spend is None else user_spend,
+                                 user_social_security_age=params['user_social_security_age'],
+                                 user_social_security_benefit=params['user_social_security_benefit'])
+
+
+def solve_for_savings(params, equity_returns, bond_returns, target_success_prob=0.9):
+    '''
+    find the smallest yearly savings (in whole dollars) that give at least target_success_prob probability that
+    wealth stays positive from retirement to the final age.
+
+    :return: a dictionary with the 'user_save' amount and the 'success_prob' it achieves, or None if the target
+    cannot be reached by saving more
+    '''
+
+    growth = calc_growth(params, equity_returns, bond_returns)
+    starting_wealth = np.full(shape=equity_returns.shape[0], fill_value=params['user_wealth'])
+    window = slice(params['idx_at_retirement'], params['idx_at_final_age'] + 1)
+
+    # 1. wealth with no savings, and the wealth that $1 of yearly savings adds to every path and period
+    base_contributions = calc_plan_contributions(params, user_save=0)
+    unit_contributions = calc_plan_contributions(params, user_save=1) - base_contributions
+
+    base_wealths = fn.calc_wealth_from_growth(starting_wealth, growth, base_contributions)[window]
+    unit_wealths = fn.calc_wealth_from_growth(0.0, growth, unit_contributions)[window]
+
+    # 2. the savings a path needs (base + savings * unit > 0 in every period of the window). Periods that
+    # savings do not reach either always succeed (-inf) or never succeed (+inf)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        needed = np.where(unit_wealths > 0,
+                          -base_wealths / unit_wealths,
+                          np.where(base_wealths > 0, -np.inf, np.inf))
+    thresholds = needed.max(axis=0)
+
+    # 3. the savings must exceed the thresholds of at least target_success_prob of the paths
+    k = int(np.ceil(target_success_prob * len(thresholds)))
+    if k == 0:
+        return {'user_save': 0, 'success_prob': 1.0}
+
+    threshold = np.partition(thresholds, k - 1)[k - 1]
+    if np.isinf(threshold) and threshold > 0:
+        return None
+
+    user_save = int(max(0, np.floor(threshold) + 1))
+    success_prob = np.mean(np.all(base_wealths + user_save * unit_wealths > 0, axis=0))
+
+    return {'user_save': user_save, 'success_prob': success_prob}
+
+
+def solve_for_spend(params, equity_returns, bond_returns, target_success_prob=0.9):
+    '''
+    find the largest yearly spend in retirement (in whole dollars) that gives at least target_success_prob
+    probability that wealth stays positive from retirement to the final age.
+
+    :return: a dictionary with the 'user_spend' amount and the 'success_prob' it achieves, or None if the target
+    cannot be reached even without spending
+    '''
+
+    growth = calc_growth(params, equity_returns, bond_returns)
+    starting_wealth = np.full(shape=equity_returns.shape[0], fill_value=params['user_wealth'])
+    window = slice(params['idx_at_retirement'], params['idx_at_final_age'] + 1)
+
+    # 1. wealth with no spending, and the wealth that $1 of yearly spending takes away from every path and period
+    base_contributions = calc_plan_contributions(params, user_spend=0)
+    unit_contributions = base_contributions - calc_plan_contributions(params, user_spend=1)
+
+    base_wealths = fn.calc_wealth_from_growth(starting_wealth, growth, base_contributions)[window]
+    unit_wealths = fn.calc_wealth_from_growth(0.0, growth, unit_contributions)[window]
+
+    # 2. the most a path can spend (base - spend * unit > 0 in every period of the window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        affordable = np.where(unit_wealths > 0,
+                              base_wealths / unit_wealths,
+                              np.where(base_wealths > 0, np.inf, -np.inf))
+    thresholds = affordable.min(axis=0)
+
+    # 3. the spend must stay below the thresholds of at least target_success_prob of the paths
+    k = int(np.ceil(target_success_prob * len(thresholds)))
+    if k == 0:
+        k = 1
+
+    threshold = np.partition(thresholds, len(thresholds) - k)[len(thresholds) - k]
+    if threshold <= 0:
+        return None
+
+    user_spend = int(np.ceil(threshold) - 1)
+    success_prob = np.mean(np.all(base_wealths - user_spend * unit_wealths > 0, axis=0))
+
+    return {'user_spend': user_spend, 'success_prob': success_prob}
+
+
+def solve_for_retirement_age(params, equity_returns, bond_returns, target_success_prob=0.9):
+    '''
+    find the earliest retirement age that gives at least target_success_prob probability that wealth stays
+    positive from retirement to the final age (the probability is taken to rise with the retirement age).
+
+    :return: a dictionary with the 'retirement_age' and the 'success_prob' it achieves, or None if the target
+    cannot be reached by working longer
+    '''
+
+    growth = calc_growth(params, equity_returns, bond_returns)
+    starting_wealth = np.full(shape=equity_returns.shape[0], fill_value=params['user_wealth'])
+
+    def _success_prob(retirement_age):
+        wealths = fn.calc_wealth_from_growth(starting_wealth, growth,
+                                             calc_plan_contributions(params, retirement_age=retirement_age))
+        return calc_success_probability(wealths, retirement_age - params['user_age'], params['idx_at_final_age'])
+
+    # binary search over whole years, between a year from now and the final age
+    low, high = params['user_age'] + 1, params['user_mortality']['1%']
+
+    high_success_prob = _success_prob(high)
+    if high_success_prob < target_success_prob:
+        return None
+
+    solution = {'retirement_age': high, 'success_prob': high_success_prob}
+
+    while low < high:
+        middle = (low + high) // 2
+        success_prob = _success_prob(middle)
+
+        if success_prob >= target_success_prob:
+            high = middle
+            solution = {'retirement_age': middle, 'success_prob': success_prob}
+        else:
+            low = middle + 1
+
+    return solution
@@ -5,6 +5,7 @@ import dash_html_components as html
 import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
 
+import base64
 import datetime
 import pandas as pd
 import numpy as np
@@ -14,11 +15,12 @@ from utilities import *
 import config
 from app import app
 from apps import functions as fn
-import visdcc
-
-# source data for actuarial calculations
-# https://www.ssa.gov/oact/STATS/table4c6.html#fn2
-# https://www.longevityillustrator.org
+from apps import goal_seek
+from apps import jobs
+from apps import mortality
+from apps import multi_asset
+from apps import shock_bank
+from apps.plan_cache import PlanCache
 
 
 def serve_layout():
@@ -150,788 +152,783 @@ def serve_layout():
 
 
                 # THIS IS THE CONTAINER FOR THE MAIN APP OUTPUT
-                dbc.Spinner(html.Div(id='output'), color='#2FC086', size='lg'),
+                # (the plan runs as a background job: the page polls its progress until the output is ready)
+                dcc.Store(id='plan_job'),
+                dcc.Interval(id='plan_job_interval', interval=500, disabled=True),
+                html.Div(id='plan_job_progress'),
+                html.Div(id='output'),
+
+                # container for the sensitivity heatmap (a background job of its own, submitted alongside the plan)
+                dcc.Store(id='heatmap_job'),
+                dcc.Interval(id='heatmap_job_interval', interval=500, disabled=True),
+                html.Div(id='heatmap_output'),
 
             ], className='body')
 
         ], style={'padding-left': '0%', 'padding-right': '0%'}),
-        visdcc.Run_js(id='javascript')
 
     ]
 
 
 layout = serve_layout
 
-mortality_df = pd.read_csv('data/mortality_table.csv')
-mortality_df.set_index('current_age', inplace=True)
-mortality_df['forward_survival_prob_1y'] = 1 - ((mortality_df['forward_death_prob_1y_male'] +
-                                                 mortality_df['forward_death_prob_1y_female']) / 2)
-
-
-@app.callback(dash.dependencies.Output('javascript', 'run'),
-              [dash.dependencies.Input('my_wealth_input', 'n_blur'),
-               dash.dependencies.Input('my_save_input', 'n_blur'),
-               dash.dependencies.Input('my_spend_input', 'n_blur'),
-               dash.dependencies.Input('my_wealth_input', 'value'),
-               dash.dependencies.Input('my_save_input', 'value'),
-               dash.dependencies.Input('my_spend_input', 'value'),
-               ])
-def reformat_input(wealth_change, save_change, spend_change,
-                   user_wealth, user_save, user_spend):
-
-    print(user_wealth, user_save, user_spend)
-
-    if wealth_change or save_change or spend_change:
-
-        try:
-            num1 = int(float(user_wealth.replace(',', '').replace('$', '')))
-            num1 = '${:,}'.format(num1)
-        except:
-            num1 = '$0'
-
-        try:
-            num2 = int(float(user_save.replace(',', '').replace('$', '')))
-            num2 = '${:,}'.format(num2)
-        except:
-            num2 = '$0'
-
-        try:
-            num3 = int(float(user_spend.replace(',', '').replace('$', '')))
-            num3 = '${:,}'.format(num3)
-        except:
-            num3 = '$0'
-
-        js = '''
-        var wealth = document.getElementById("my_wealth_input");
-        wealth.value='{}'
-
-        var save = document.getElementById("my_save_input");
-        save.value='{}'
-
-        var spend = document.getElementById("my_spend_input");
-        spend.value='{}'
-        '''.format(num1, num2, num3)
-
-        return js
+# every plan is simulated on the shared shock bank (built or mapped at boot) with the same seed, and the rendered
+# results of recent plans are cached
+SIMULATION_SEED = 0
+SAMPLING_METHOD = 'sobol'
+shock_bank.load_shock_bank(method=SAMPLING_METHOD, seed=SIMULATION_SEED)
+
+plan_cache = PlanCache(max_entries=256, max_bytes=64 * 1024 ** 2, ttl=3600)
+
+# plans run in background processes, at most jobs.MAX_RUNNING_JOBS at a time over all web workers
+job_queue = jobs.JobQueue()
+
+# size of the sensitivity heatmap (yearly savings levels x retirement ages) and the number of market paths (taken
+# from the shock bank) that every point of the grid is evaluated on
+HEATMAP_SAVE_LEVELS = 20
+HEATMAP_RETIREMENT_AGES = 15
+HEATMAP_SIMULATIONS = 4096
+
+
+# format the dollar amounts in the input boxes (eg 30000 -> $30,000) when they lose focus. This runs in the browser
+# (see assets/formatting.js), so typing does not send any request to the server
+app.clientside_callback(dash.dependencies.ClientsideFunction(namespace='formatting',
+                                                             function_name='format_dollar_inputs'),
+                        [dash.dependencies.Output('my_wealth_input', 'value'),
+                         dash.dependencies.Output('my_save_input', 'value'),
+                         dash.dependencies.Output('my_spend_input', 'value')],
+                        [dash.dependencies.Input('my_wealth_input', 'n_blur'),
+                         dash.dependencies.Input('my_save_input', 'n_blur'),
+                         dash.dependencies.Input('my_spend_input', 'n_blur')],
+                        [dash.dependencies.State('my_wealth_input', 'value'),
+                         dash.dependencies.State('my_save_input', 'value'),
+                         dash.dependencies.State('my_spend_input', 'value')])
+
+
+# draw the charts of wealth over time and the summary tables from the plan data, in the browser (see
+# assets/plan_charts.js). The callback fires whenever a new plan output (with its store) is put on the page
+app.clientside_callback(dash.dependencies.ClientsideFunction(namespace='plan_charts',
+                                                             function_name='render_plan'),
+                        [dash.dependencies.Output('chart', 'figure'),
+                         dash.dependencies.Output('chart75', 'figure'),
+                         dash.dependencies.Output('chart50', 'figure'),
+                         dash.dependencies.Output('chart25', 'figure'),
+                         dash.dependencies.Output('chart5', 'figure'),
+                         dash.dependencies.Output('retirement_table', 'children'),
+                         dash.dependencies.Output('depleted_table', 'children')],
+                        [dash.dependencies.Input('plan_data', 'data')])
+
+
+def parse_user_inputs(user_age, user_retirement_age, user_wealth, user_save, user_spend):
+    '''
+    parse the values of the input boxes into integers (dollar amounts can be typed as eg '$30,000' or '30000.0')
+    so that equivalent inputs map to the same plan
+    '''
+
+    return (int(user_age),
+            int(user_retirement_age),
+            int(float(user_wealth.replace(',', '').replace('$', ''))),
+            int(float(user_save.replace(',', '').replace('$', ''))),
+            int(float(user_spend.replace(',', '').replace('$', ''))))
 
 
 # calculate account trajectory
-@app.callback(dash.dependencies.Output('output', 'children'),
+@app.callback([dash.dependencies.Output('output', 'children'),
+               dash.dependencies.Output('plan_job', 'data'),
+               dash.dependencies.Output('plan_job_interval', 'disabled'),
+               dash.dependencies.Output('plan_job_progress', 'children')],
 
-              [dash.dependencies.Input('start_input', 'n_clicks')],
+              [dash.dependencies.Input('start_input', 'n_clicks'),
+               dash.dependencies.Input('plan_job_interval', 'n_intervals')],
 
-              [dash.dependencies.State('my_age_input', 'value'),
+              [dash.dependencies.State('plan_job', 'data'),
+               dash.dependencies.State('my_age_input', 'value'),
                dash.dependencies.State('retirement_age_input', 'value'),
                dash.dependencies.State('my_wealth_input', 'value'),
                dash.dependencies.State('my_save_input', 'value'),
                dash.dependencies.State('my_spend_input', 'value')
                ])
 def display_page(n_clicks,
+                 n_intervals,
+                 plan_job,
                  user_age,
                  user_retirement_age,
                  user_wealth,
                  user_save,
                  user_spend):
+    '''
+    GO submits the plan as a background job (unless it is cached) and starts polling; every tick of the interval
+    shows the progress of the job, and its output once it is done
+    '''
 
     if n_clicks is None:
-        return html.Div(),
+        return html.Div(), None, True, None
+
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+
+    if 'start_input.n_clicks' in triggered:
+
+        # repeat submissions of the same inputs (for the same model version and seed) are served from the cache
+        inputs = parse_user_inputs(user_age, user_retirement_age, user_wealth, user_save, user_spend)
+        cache_key = (fn.MODEL_VERSION, SIMULATION_SEED) + inputs
 
-    else:
+        output = plan_cache.get(cache_key)
+        if output is not None:
+            return output, None, True, None
+
+        job_id = job_queue.submit(cache_key, build_plan_output, *inputs)
+        plan_job = {'job_id': job_id, 'cache_key': list(cache_key)}
 
-        # 1. set model parameters
-        params = {'user_age': int(user_age),
-                  'user_retirement_age': int(user_retirement_age),
-                  'user_wealth': int(float(user_wealth.replace(',', '').replace('$', ''))),
-                  'user_save': int(float(user_save.replace(',', '').replace('$', ''))),
-                  'user_spend': int(float(user_spend.replace(',', '').replace('$', ''))),
-
-                  'user_social_security_age': 67,
-                  'user_social_security_benefit': 18000,
-                  'num_simulations': 10000,
-
-                  # derive extra parameters for modelling wealth trajectory
-                  'years_to_retire': int(user_retirement_age) - int(user_age),
-                  'years_to_retire_plus_one': int(user_retirement_age) - int(user_age) + 1,
-                  'years_to_retire_minus_one': int(user_retirement_age) - int(user_age) - 1,
-                  'current_year': datetime.datetime.now().year
-                  }
-
-        # expected age at death based on mortality tables
-        user_mortality, age_list = fn.get_user_mortality_stats(
-            params['user_age'], mortality_df)
-
-        params['user_mortality'] = user_mortality
-        params['age_list'] = age_list
-        params['years_to_1_pct_survival_prob'] = user_mortality[
-            '1%'] - params['user_age']
-        params['years_in_retirement'] = user_mortality[
-            '1%'] - params['user_retirement_age'] + 1
-        params['num_periods'] = user_mortality['1%'] - params['user_age'] + 1
-
-        # get the index at retirement and at the final age
-        params['idx_at_retirement'] = params[
-            'user_retirement_age'] - params['user_age']
-        params['idx_at_final_age'] = user_mortality['1%'] - params['user_age']
-
-        # 3. simulate equity market returns based on a random walk
-        equity_return_sim1 = fn.random_walk_simulations(mean=0.08,
-                                                        stdev=0.14,
-                                                        periods=params[
-                                                            'num_periods'],
-                                                        num_simulations=params['num_simulations'])
-
-        # set bond market returns
-        bond_return_sim1 = np.full_like(equity_return_sim1, fill_value=0.01)
-        bond_return_sim1[:, 0] = 0.0
-
-        # INACTIVE FOR NOW, USE RANDOM WALK RETURNS FOR SIMULATIONS
-        # (THE HISTORICAL RETURNS ARE CONSIDERED TP BE TOO HIGH TO BE USED FOR MODELING FUTURE RETURNS)
-        # # get historical annual returns to use in sampling
-        # years, sp500, ust_3m, ust, bbb = fn.get_historical_annual_returns()
-        # num_historical_samples = len(years)
-
-        # # simulate market returns based on continuous historical sampling
-        # _, equity_return_sim2, bond_return_sim2 = fn.build_continuous_sampled_returns(num_periods_per_simulation=num_periods,
-        #                                                                               num_simulations=num_simulations,
-        #                                                                               year_list=years,
-        #                                                                               sp500_list=sp500,
-        # ust_list=ust)
-
-        # # simulate market returns based on discontinuous historical sampling
-        # _, equity_return_sim3, bond_return_sim3 = fn.build_discontinuous_sampled_returns(num_periods_per_simulation=num_periods,
-        #                                                                                  sub_sample_length=5,
-        #                                                                                  num_simulations=num_simulations,
-        #                                                                                  year_list=years,
-        #                                                                                  sp500_list=sp500,
-        # ust_list=ust)
-
-        # equity_returns = np.concatenate(
-        #     [equity_return_sim1, equity_return_sim2, equity_return_sim2], axis=0)
-        # bond_returns = np.concatenate(
-        #     [bond_return_sim1, bond_return_sim2, bond_return_sim2], axis=0)
-
-        equity_returns = equity_return_sim1
-        bond_returns = bond_return_sim1
-
-        # 5. calculate wealth scenarios
-
-        # 5a. calculate asset allocation between equity and bonds in each
-        # period
-        contributions = fn.calc_contributions(user_age=params['user_age'],
-                                              retirement_age=params[
-                                                  'user_retirement_age'],
-                                              final_age=params[
-                                                  'user_mortality']['1%'],
-                                              user_save=params['user_save'],
-                                              user_spend=params['user_spend'],
-                                              user_social_security_age=params[
-                                                  'user_social_security_age'],
-                                              user_social_security_benefit=params['user_social_security_benefit'])
+    if plan_job is None:
+        return dash.no_update, None, True, None
+
+    status = job_queue.status(plan_job['job_id'])
+
+    if status is None or status['status'] == jobs.FAILED:
+        error = 'Something went wrong while running your plan, please try again'
+        return html.Div(error, style={'text-align': 'center'}), None, True, None
+
+    if status['status'] == jobs.DONE:
+        plan_cache.put(tuple(plan_job['cache_key']), status['result'])
+        return status['result'], None, True, None
+
+    progress_bar = html.Div([
+        dbc.Progress(value=100 * status['progress'], color='success', striped=True, animated=True),
+        html.Div(status['message'], style={'text-align': 'center'}),
+    ], style={'margin-left': '20%', 'margin-right': '20%'})
+
+    return html.Div(), plan_job, False, progress_bar
+
+
+def build_plan_params(user_age,
+                      user_retirement_age,
+                      user_wealth,
+                      user_save,
+                      user_spend):
+    '''
+    set the model parameters for the (parsed) user inputs, including the user's mortality statistics
+    '''
+
+    # 1. set model parameters
+    params = {'user_age': user_age,
+              'user_retirement_age': user_retirement_age,
+              'user_wealth': user_wealth,
+              'user_save': user_save,
+              'user_spend': user_spend,
+
+              'user_social_security_age': 67,
+              'user_social_security_benefit': 18000,
+
+              # number of paths for plans based on historical returns
+              'num_simulations': 10000,
+
+              # random walk plans add paths until the 95% confidence intervals of the reported statistics are
+              # within 5% (or $5,000), or until the next batch would go past max_simulations paths or the latency
+              # budget of simulation_budget path-years (paths x periods: about 16,000 paths for a 30 year old,
+              # which takes about half a second for the whole page)
+              'convergence_tolerance': 0.05,
+              'max_simulations': 50000,
+              'simulation_budget': 1200000,
+
+              # use random walk returns for the simulations ('historical' resamples the annual returns
+              # since 1928 instead, but those are considered to be too high to be used for modeling future returns;
+              # 'multi_asset' draws correlated returns for stocks and the three bond series, with the bonds held
+              # in the bond_mix of T-bills, 10 year Treasuries and BBB corporates, see apps/multi_asset.py)
+              'return_model': 'random_walk',
+              'bond_mix': [0.0, 0.5, 0.5],
+
+              # draw the random walk shocks from a scrambled sobol sequence, which pins down the tail
+              # percentiles with about half as many paths as pseudo-random draws
+              # (see benchmarks/convergence_report.py). The shocks are taken from the shared shock bank
+              # (see apps/shock_bank.py)
+              'sampling_method': SAMPLING_METHOD,
+
+              # derive extra parameters for modelling wealth trajectory
+              'years_to_retire': user_retirement_age - user_age,
+              'years_to_retire_plus_one': user_retirement_age - user_age + 1,
+              'years_to_retire_minus_one': user_retirement_age - user_age - 1,
+              'current_year': datetime.datetime.now().year,
+
+              # the simulation seed (plans are reproducible, which is what makes them cacheable)
+              'seed': SIMULATION_SEED
+              }
+
+    # expected age at death based on mortality tables
+    user_mortality, age_list = mortality.get_user_mortality_stats(params['user_age'])
+
+    params['user_mortality'] = user_mortality
+    params['age_list'] = age_list
+    params['years_to_1_pct_survival_prob'] = user_mortality[
+        '1%'] - params['user_age']
+    params['years_in_retirement'] = user_mortality[
+        '1%'] - params['user_retirement_age'] + 1
+    params['num_periods'] = user_mortality['1%'] - params['user_age'] + 1
+
+    # get the index at retirement and at the final age
+    params['idx_at_retirement'] = params[
+        'user_retirement_age'] - params['user_age']
+    params['idx_at_final_age'] = user_mortality['1%'] - params['user_age']
+
+    return params
+
+
+def encode_float32(values):
+    '''
+    :return: the values as a base64 string of little-endian float32 (decoded in assets/plan_charts.js)
+    '''
+    return base64.b64encode(np.asarray(values, dtype='<f4').tobytes()).decode('ascii')
+
+
+def table_data(df):
+    '''
+    :return: the header and the rows of a (small) dataframe, to be drawn as a table in the browser
+    '''
+    return {'columns': df.columns.tolist(), 'rows': df.values.tolist()}
+
+
+def build_plan_output(user_age,
+                      user_retirement_age,
+                      user_wealth,
+                      user_save,
+                      user_spend,
+                      progress=None):
+    '''
+    run the financial plan for the (parsed) user inputs and build the page section that shows the results.
+    progress(fraction, message) is called as the plan goes along (see apps.jobs)
+    '''
+
+    if progress is None:
+        progress = lambda fraction, message='': None
+
+    progress(0.0, 'Simulating market returns')
+
+    params = build_plan_params(user_age, user_retirement_age, user_wealth, user_save, user_spend)
+
+    # 3. calculate the contributions and spending in each year
+    contributions = fn.calc_contributions(user_age=params['user_age'],
+                                          retirement_age=params[
+                                              'user_retirement_age'],
+                                          final_age=params[
+                                              'user_mortality']['1%'],
+                                          user_save=params['user_save'],
+                                          user_spend=params['user_spend'],
+                                          user_social_security_age=params[
+                                              'user_social_security_age'],
+                                          user_social_security_benefit=params['user_social_security_benefit'])
+
+    # 4. simulate market returns and calculate wealth scenarios
+    if params['return_model'] == 'historical':
+
+        # resample blocks of historical annual returns (stationary bootstrap with an average block
+        # length of 5 years, so that some of the serial correlation between years is kept)
+        years, sp500, ust_3m, ust, bbb = fn.get_historical_annual_returns()
+        _, equity_returns, bond_returns = fn.build_bootstrap_sampled_returns(num_periods_per_simulation=params['num_periods'],
+                                                                            num_simulations=params['num_simulations'],
+                                                                            year_list=years,
+                                                                            sp500_list=sp500,
+                                                                            ust_list=ust,
+                                                                            method='stationary',
+                                                                            block_length=5)
 
         total_user_save, starting_wealth_array, allocations, contributions, wealths, trajectories, wealth_stats = fn.financial_plan(params, contributions, equity_returns,
-                                                                                                                                    bond_returns)
-
-        # 2. build a dataframe that we'll use for making charts that show wealth over time
-        # the ages range from the current user age to the age that the user has a 1% probability of reaching
-        # (for example, a 40 year old today might have a 1% chance of living to 100 so let's have the
-        # chart x-axis show values from age 39 to age 100, inclusive)
-        df = pd.DataFrame(
-            {'age': list(range(params['user_age'], params['user_mortality']['1%'] + 1))})
-        df['year'] = list(range(params['current_year'], params['current_year'] +
-                                params['years_to_1_pct_survival_prob'] + 1))
-
-        # add wealth paths to the chart data
-        df['Optimistic (75th pct)'] = trajectories[75]
-        df['Expected (Average Outcome)'] = trajectories['mean']
-        df['Possible (25th pct)'] = trajectories[25]
-        df['Pessimistic (5th pct)'] = trajectories[5]
-
-        assert df.shape[0] == params['num_periods'], 'error'
-
-        # make a table with information about wealth at the time of retirement
-        retirement_df = pd.DataFrame({
-            'Scenario': ['Optimistic (75th percentile)', 'Expected (Average Outcome)', 'Possible (25th pct)', 'Pessimistic (5th pct)'],
-            '$ at Retirement': [fn.dollar_as_text(wealth_stats[i]['wealth_at_retirement']) for i in [75, 'mean', 25, 5]],
-            'Stock Market Avg Return': [fn.percent_as_text(wealth_stats[i]['rate_of_return_at_retirement']) for i in [75, 'mean', 25, 5]],
-            'Bond Return': ['1%', '1%', '1%', '1%'],
-            '"Forever Income (4%)"': [fn.dollar_as_text(wealth_stats[i]['wealth_at_retirement'] * 0.04) for i in [75, 'mean', 25, 5]],
-
-        })
-
-        # make a table with information about when wealth may be depleted
-
-        asset_depleted_text = [fn.depleted_text(wealth_stats[i]['age_at_negative_wealth'],
-                                                wealth_stats[i][
-                                                    'wealth_at_end'],
-                                                wealth_stats[i]['wealth_at_retirement']) for i in [75, 'mean', 25, 5]]
-        depleted_df = pd.DataFrame({
-            'Scenario': ['Optimistic (75th percentile)',
-                         'Expected (Avg Outcome)',
-                         'Possible (25th pct)',
-                         'Pessimistic (5th pct)'],
-            'Stock Market Avg Return': [fn.percent_as_text(wealth_stats[i]['rate_of_return_at_end']) for i in [75, 'mean', 25, 5]],
-            'Bond Return': ['1%', '1%', '1%', '1%'],
-            'Your Assets will': asset_depleted_text,
-            'At the Age of 101, You will Have': [fn.dollar_as_text(wealth_stats[i]['wealth_at_end']) for i in [75, 'mean', 25, 5]],
-
-        })
-
-        # make a chart with wealth over time
-
-        # the bars that represent wealth during the savings phase should be green
-        # and the bars during the retirement phase are blue
-        bar_colors = ['#26BE81'] * (params['years_to_retire'])
-        bar_colors = bar_colors + ['green']
-        bar_colors = bar_colors + ['#26BE81'] * \
-            (params['years_in_retirement'] + 1)
-
-        # make chart that shows median wealth over time
-        data1 = [
-            {'x': df['age'],
-             'y': df['Expected (Average Outcome)'],
-             'type': 'bar',
-             'marker': {'color': bar_colors}},
-        ]
-
-        chart_lines = [
-
-            # veritcal line when user starts to take social security
-            {
-                'x0': params['user_social_security_age'],
-                'y0': 0,
-                'x1': params['user_social_security_age'],
-                'y1': 1,
-                'yref': 'paper',
-                'type': 'line',
-                'line': {'color': 'purple', 'width': 5, 'dash': 'dot'}
-            },
-
-
-            # vertical line at expected age at death (50% survival probability)
-            {
-                'x0': params['user_mortality']['expected_age_at_death'],
-                'y0': 0,
-                'x1': params['user_mortality']['expected_age_at_death'],
-                'y1': 1,
-                'yref': 'paper',
-                'type': 'line',
-                'line': {'color': 'orange', 'width': 5, 'dash': 'dot'}
-            },
-
-            {
-                'x0': params['user_mortality']['25%'],
-                'y0': 0,
-                'x1': params['user_mortality']['25%'],
-                'y1': 1,
-                'yref': 'paper',
-                'type': 'line',
-                'line': {'color': 'orange', 'width': 4, 'dash': 'dot'}
-            },
-
-            {
-                'x0': params['user_mortality']['5%'],
-                'y0': 0,
-                'x1': params['user_mortality']['5%'],
-                'y1': 1,
-                'yref': 'paper',
-                'type': 'line',
-                'line': {'color': 'orange', 'width': 3, 'dash': 'dot'}
-            },
-
-            {
-                'x0': params['user_mortality']['1%'],
-                'y0': 0,
-                'x1': params['user_mortality']['1%'],
-                'y1': 1,
-                'yref': 'paper',
-                'type': 'line',
-                'line': {'color': 'orange', 'width': 2, 'dash': 'dot'}
-            },
-
-        ]
-
-        chart_annotations = [
-            {'x': params['user_retirement_age'],
-             'y': -0.3,
-             'yref': 'paper',
-             'text': 'Retirement',
-             'showarrow': False,
-             'font': {'color': 'green', 'family': 'avenir', 'size': 12}},
-
-            {'x': params['user_social_security_age'],
-             'y': -0.2,
-             'yref': 'paper',
-             'text': 'Social Security',
-             'showarrow': False,
-             'font': {'color': 'purple', 'family': 'avenir', 'size': 12}},
-
-            {'x': params['user_mortality']['expected_age_at_death'],
-             'y': -0.2,
-             'yref': 'paper',
-             'text': '50%',
-             'showarrow': False,
-             'font': {'color': 'orange', 'family': 'avenir', 'size': 12}},
-
-            {'x': params['user_mortality']['10%'],
-             'y': -0.3,
-             'yref': 'paper',
-             'text': 'Probabilities of Living To These Ages',
-             'showarrow': False,
-             'font': {'color': 'orange', 'family': 'avenir', 'size': 12}},
-
-
-            {'x': params['user_mortality']['25%'],
-             'y': -0.2,
-             'yref': 'paper',
-             'text': '25%',
-             'showarrow': False,
-             'font': {'color': 'orange', 'family': 'avenir', 'size': 12}},
-
-            {'x': params['user_mortality']['5%'],
-             'y': -0.2,
-             'yref': 'paper',
-             'text': '5%',
-             'showarrow': False,
-             'font': {'color': 'orange', 'family': 'avenir', 'size': 12}},
-
-            {'x': params['user_mortality']['1%'],
-             'y': -0.2,
-             'yref': 'paper',
-             'text': '1%',
-             'showarrow': False,
-             'font': {'color': 'orange', 'family': 'avenir', 'size': 12}}
-
-        ]
-
-        layout1 = {'title': '<b>Your Expected Wealth Over Time</b>',
-                   'annotations': chart_annotations,
-                   'height': 350,
-                   'margin': {'t': 40, 'r': 10},
-                   'shapes': chart_lines,
-                   }
-
-        figure1 = {'data': data1,
-                   'layout': layout1}
-
-        # make multiple charts that shows wealth paths over time
-        data75 = [
-            {'x': df['age'],
-             'y': df['Optimistic (75th pct)'],
-             'type': 'bar',
-             'name': 'Pessimistic',
-             'marker': {'color': '#D3F2E5'}},
-        ]
-
-        data50 = [
-            {'x': df['age'],
-             'y': df['Expected (Average Outcome)'],
-             'type': 'bar',
-             'name': 'Expected',
-             'marker': {'color': '#26BE81'}},
-        ]
-
-        data25 = [
-            {'x': df['age'],
-             'y': df['Possible (25th pct)'],
-             'type': 'bar',
-             'name': 'Possible',
-             'marker': {'color': '#D3F2E5'}},
-        ]
-
-        data5 = [
-            {'x': df['age'],
-             'y': df['Pessimistic (5th pct)'],
-             'type': 'bar',
-             'name': 'Pessimistic',
-             'marker': {'color': '#D3F2E5'}},
-        ]
-
-        layout75 = {'title': '<b>Optimistic Scenario ({} Avg Stock Market Return) </b>'.format(fn.percent_as_text(wealth_stats[75]['rate_of_return_at_end'])),
-                    'titlefont': {'color': '#267B83'},
-                    'annotations': chart_annotations,
-                    'height': 300,
-                    'margin': {'t': 30, 'r': 10},
-                    'shapes': chart_lines,
-                    }
-
-        layout50 = {'title': '<b>Expected Scenario ({} Avg Stock Market Return) </b>'.format(fn.percent_as_text(wealth_stats['mean']['rate_of_return_at_end'])),
-                    'titlefont': {'color': '#26BE81'},
-                    'annotations': chart_annotations,
-                    'height': 300,
-                    'margin': {'t': 30, 'r': 10},
-                    'shapes': chart_lines,
-                    }
-
-        layout25 = {'title': '<b>Possible Scenario ({} Avg Stock Market Return) </b>'.format(fn.percent_as_text(wealth_stats[25]['rate_of_return_at_end'])),
-                    'titlefont': {'color': '#267B83'},
-                    'annotations': chart_annotations,
-                    'height': 300,
-                    'margin': {'t': 30, 'r': 10},
-                    'shapes': chart_lines,
-                    }
-
-        layout5 = {'title': '<b>Pessimistic Scenario ({} Avg Stock Market Return) </b>'.format(fn.percent_as_text(wealth_stats[5]['rate_of_return_at_end'])),
-                   'titlefont': {'color': '#267B83'},
-                   'annotations': chart_annotations,
-                   'height': 300,
-                   'margin': {'t': 30, 'r': 10},
-                   'shapes': chart_lines,
-                   }
-
-        figure75 = {'data': data75,
-                    'layout': layout75}
-
-        figure50 = {'data': data50,
-                    'layout': layout50}
-
-        figure25 = {'data': data25,
-                    'layout': layout25}
-
-        figure5 = {'data': data5,
-                   'layout': layout5}
-
-        # build scenario analysis tables
-
-        # run scenario analysis that simulate different saving, spending and time-to-retirement assumptions
-        # (this is performed by controlling the 'contribution' array. Either increase the contriution amounts
-        # during the savings phase, or extend the length of the savings phase, or decrease the spend during retirement)
-        # each final element of the 'scenario_analysis' dictionary is an array that represents additions/subtractions
-        # from assets
-
-        scenario_analysis = {'save_more': {i: {'age_at_negative_wealth': {},
-                                               'wealth_at_retirement': {},
-                                               'wealth_at_end': {},
-                                               'forever_income': {}
-                                               } for i in range(4)},
-                             'work_longer': {i: {'age_at_negative_wealth': {},
-                                                 'wealth_at_retirement': {},
-                                                 'wealth_at_end': {},
-                                                 'forever_income': {}} for i in range(4)},
-                             'spend_less': {i: {'age_at_negative_wealth': {},
-                                                'wealth_at_retirement': {},
-                                                'wealth_at_end': {},
-                                                'forever_income': {}} for i in range(4)}}
+                                                                                                                                    bond_returns,
+                                                                                                                                    keys=fn.REPORTED_KEYS)
 
-        for i in range(4):
+    elif params['return_model'] == 'multi_asset':
 
-            scenario_analysis['save_more'][i]['save_amount'] = fn.dollar_as_text(
-                params['user_save'] + (0.05 * params['user_save'] * i))
-
-            _contributions = fn.calc_contributions(user_age=params['user_age'],
-                                                   retirement_age=params[
-                                                       'user_retirement_age'],
-                                                   final_age=params[
-                                                       'user_mortality']['1%'],
-                                                   user_save=params[
-                                                       'user_save'] + (0.05 * params['user_save'] * i),
-                                                   user_spend=params[
-                                                       'user_spend'],
-                                                   user_social_security_age=params[
-                                                       'user_social_security_age'],
-                                                   user_social_security_benefit=params['user_social_security_benefit'])
-
-            _, _, _, _, _, _, _wealth_stats = fn.financial_plan(
-                params, _contributions, equity_returns, bond_returns)
+        # simulate correlated returns for stocks and the bond series, on the glide path of the base plan
+        # (the returned stock and bond returns are what the scenarios below run on)
+        multi_asset_allocations = multi_asset.glide_path_allocations(user_age=params['user_age'],
+                                                                     retirement_age=params['user_retirement_age'],
+                                                                     final_age=params['user_mortality']['1%'],
+                                                                     bond_mix=params['bond_mix'])
 
-            for pct in [75, 'mean', 25, 5]:
-                scenario_analysis['save_more'][i]['age_at_negative_wealth'][
-                    pct] = _wealth_stats[pct]['age_at_negative_wealth']
-                scenario_analysis['save_more'][i]['wealth_at_retirement'][
-                    pct] = _wealth_stats[pct]['wealth_at_retirement']
-                scenario_analysis['save_more'][i]['wealth_at_end'][
-                    pct] = _wealth_stats[pct]['wealth_at_end']
-                scenario_analysis['save_more'][i]['forever_income'][
-                    pct] = _wealth_stats[pct]['wealth_at_retirement'] * 0.04
+        plan, equity_returns, bond_returns = multi_asset.multi_asset_financial_plan(params,
+                                                                                    contributions,
+                                                                                    multi_asset_allocations,
+                                                                                    method=params['sampling_method'],
+                                                                                    seed=params['seed'],
+                                                                                    keys=fn.REPORTED_KEYS)
 
-            scenario_analysis['work_longer'][i][
-                'retire_age'] = params['user_retirement_age'] + (1 + i)
-            _contributions = fn.calc_contributions(user_age=params['user_age'],
-                                                   retirement_age=params[
-                                                       'user_retirement_age'] + (1 + i),
-                                                   final_age=params[
-                                                       'user_mortality']['1%'],
-                                                   user_save=params[
-                                                       'user_save'],
-                                                   user_spend=params[
-                                                       'user_spend'],
-                                                   user_social_security_age=params[
-                                                       'user_social_security_age'],
-                                                   user_social_security_benefit=params['user_social_security_benefit'])
-
-            new_params = params.copy()
-            new_params['idx_at_retirement'] = new_params[
-                'user_retirement_age'] + (1 + i) - params['user_age']
-            _, _, _, _, _, _, _wealth_stats = fn.financial_plan(
-                new_params, _contributions, equity_returns, bond_returns)
-            for pct in [75, 'mean', 25, 5]:
-                scenario_analysis['work_longer'][i]['age_at_negative_wealth'][
-                    pct] = _wealth_stats[pct]['age_at_negative_wealth']
-                scenario_analysis['work_longer'][i]['wealth_at_retirement'][
-                    pct] = _wealth_stats[pct]['wealth_at_retirement']
-                scenario_analysis['work_longer'][i]['wealth_at_end'][
-                    pct] = _wealth_stats[pct]['wealth_at_end']
-                scenario_analysis['work_longer'][i]['forever_income'][
-                    pct] = _wealth_stats[pct]['wealth_at_retirement'] * 0.04
+        total_user_save, starting_wealth_array, allocations, contributions, wealths, trajectories, wealth_stats = plan
+
+    else:
 
-            scenario_analysis['spend_less'][i]['spend_amount'] = fn.dollar_as_text(
-                params['user_spend'] - ((0.05 * params['user_spend']) * i))
-
-            _contributions = fn.calc_contributions(user_age=params['user_age'],
-                                                   retirement_age=params[
-                                                       'user_retirement_age'],
-                                                   final_age=params[
-                                                       'user_mortality']['1%'],
-                                                   user_save=params[
-                                                       'user_save'],
-                                                   user_spend=params[
-                                                       'user_spend'] - ((0.05 * params['user_spend']) * i),
-                                                   user_social_security_age=params[
-                                                       'user_social_security_age'],
-                                                   user_social_security_benefit=params['user_social_security_benefit'])
-
-            _, _, _, _, _, _, _wealth_stats = fn.financial_plan(
-                params, _contributions, equity_returns, bond_returns)
+        # simulate equity market returns based on a random walk (and a constant bond return), adding
+        # paths until the reported statistics at retirement and at the final age are precise enough
+        plan, equity_returns, bond_returns, convergence = fn.adaptive_financial_plan(params,
+                                                                                     contributions,
+                                                                                     mean=0.08,
+                                                                                     stdev=0.14,
+                                                                                     bond_return=0.01,
+                                                                                     keys=fn.REPORTED_KEYS,
+                                                                                     tolerance=params['convergence_tolerance'],
+                                                                                     max_simulations=params['max_simulations'],
+                                                                                     simulation_budget=params['simulation_budget'],
+                                                                                     shocks=shock_bank.load_shock_bank(
+                                                                                         method=params['sampling_method'],
+                                                                                         seed=params['seed']))
+
+        total_user_save, starting_wealth_array, allocations, contributions, wealths, trajectories, wealth_stats = plan
+        params['num_simulations'] = convergence['num_simulations']
+
+    # 2. build a dataframe that we'll use for making charts that show wealth over time
+    # the ages range from the current user age to the age that the user has a 1% probability of reaching
+    # (for example, a 40 year old today might have a 1% chance of living to 100 so let's have the
+    # chart x-axis show values from age 39 to age 100, inclusive)
+    df = pd.DataFrame(
+        {'age': list(range(params['user_age'], params['user_mortality']['1%'] + 1))})
+    df['year'] = list(range(params['current_year'], params['current_year'] +
+                            params['years_to_1_pct_survival_prob'] + 1))
+
+    # add wealth paths to the chart data
+    df['Optimistic (75th pct)'] = trajectories[75]
+    df['Expected (Average Outcome)'] = trajectories['mean']
+    df['Possible (25th pct)'] = trajectories[25]
+    df['Pessimistic (5th pct)'] = trajectories[5]
+
+    assert df.shape[0] == params['num_periods'], 'error'
+
+    # make a table with information about wealth at the time of retirement
+    retirement_df = pd.DataFrame({
+        'Scenario': ['Optimistic (75th percentile)', 'Expected (Average Outcome)', 'Possible (25th pct)', 'Pessimistic (5th pct)'],
+        '$ at Retirement': [fn.dollar_as_text(wealth_stats[i]['wealth_at_retirement']) for i in [75, 'mean', 25, 5]],
+        'Stock Market Avg Return': [fn.percent_as_text(wealth_stats[i]['rate_of_return_at_retirement']) for i in [75, 'mean', 25, 5]],
+        'Bond Return': ['1%', '1%', '1%', '1%'],
+        '"Forever Income (4%)"': [fn.dollar_as_text(wealth_stats[i]['wealth_at_retirement'] * 0.04) for i in [75, 'mean', 25, 5]],
+
+    })
+
+    # make a table with information about when wealth may be depleted
+
+    asset_depleted_text = [fn.depleted_text(wealth_stats[i]['age_at_negative_wealth'],
+                                            wealth_stats[i][
+                                                'wealth_at_end'],
+                                            wealth_stats[i]['wealth_at_retirement']) for i in [75, 'mean', 25, 5]]
+    depleted_df = pd.DataFrame({
+        'Scenario': ['Optimistic (75th percentile)',
+                     'Expected (Avg Outcome)',
+                     'Possible (25th pct)',
+                     'Pessimistic (5th pct)'],
+        'Stock Market Avg Return': [fn.percent_as_text(wealth_stats[i]['rate_of_return_at_end']) for i in [75, 'mean', 25, 5]],
+        'Bond Return': ['1%', '1%', '1%', '1%'],
+        'Your Assets will': asset_depleted_text,
+        'At the Age of 101, You will Have': [fn.dollar_as_text(wealth_stats[i]['wealth_at_end']) for i in [75, 'mean', 25, 5]],
+
+    })
+
+    # make a table with the chance that the assets run out (across all simulated paths) before each age that the
+    # user may live to
+    ruin_stats = fn.calc_ruin_statistics(wealths, params['age_list'], params['user_mortality'])
+    ruin_df = pd.DataFrame({
+        'If You Live To': [params['user_mortality'][k] for k in fn.MORTALITY_KEYS],
+        'Chance of Living This Long': ['50% (Life Expectancy)', '25%', '10%', '5%', '1%'],
+        'Chance Your Assets Run Out By Then': [fn.percent_as_text(ruin_stats['ruin_probs'][k]) for k in fn.MORTALITY_KEYS],
+
+    })
+
+    # the charts of wealth over time and the two tables above are drawn in the browser (see
+    # assets/plan_charts.js) from one compact store: every trajectory is sent once, as base64 float32, instead of
+    # once per chart, together with the ages that are marked on the charts
+    plan_data = {'first_age': params['user_age'],
+                 'years_to_retire': params['years_to_retire'],
+                 'retirement_age': params['user_retirement_age'],
+                 'social_security_age': params['user_social_security_age'],
+                 'mortality': params['user_mortality'],
+                 'trajectories': {str(k): encode_float32(trajectories[k]) for k in [75, 'mean', 25, 5]},
+                 'rates_of_return': {str(k): fn.percent_as_text(wealth_stats[k]['rate_of_return_at_end'])
+                                     for k in [75, 'mean', 25, 5]},
+                 'tables': {'retirement_table': table_data(retirement_df),
+                            'depleted_table': table_data(depleted_df)}}
+
+    # build scenario analysis tables
+
+    # run scenario analysis that simulate different saving, spending and time-to-retirement assumptions
+    # (this is performed by controlling the 'contribution' array. Either increase the contriution amounts
+    # during the savings phase, or extend the length of the savings phase, or decrease the spend during retirement)
+    # each final element of the 'scenario_analysis' dictionary is an array that represents additions/subtractions
+    # from assets
+
+    scenario_analysis = {'save_more': {i: {'age_at_negative_wealth': {},
+                                           'wealth_at_retirement': {},
+                                           'wealth_at_end': {},
+                                           'forever_income': {}
+                                           } for i in range(4)},
+                         'work_longer': {i: {'age_at_negative_wealth': {},
+                                             'wealth_at_retirement': {},
+                                             'wealth_at_end': {},
+                                             'forever_income': {}} for i in range(4)},
+                         'spend_less': {i: {'age_at_negative_wealth': {},
+                                            'wealth_at_retirement': {},
+                                            'wealth_at_end': {},
+                                            'forever_income': {}} for i in range(4)}}
+
+    # build the contribution schedule of every scenario, then evaluate all of them in one batch
+    # against the same simulated market returns
+    scenarios = {'save_more': [], 'work_longer': [], 'spend_less': []}
+
+    for i in range(4):
+
+        scenario_analysis['save_more'][i]['save_amount'] = fn.dollar_as_text(
+            params['user_save'] + (0.05 * params['user_save'] * i))
+
+        _contributions = fn.calc_contributions(user_age=params['user_age'],
+                                               retirement_age=params[
+                                                   'user_retirement_age'],
+                                               final_age=params[
+                                                   'user_mortality']['1%'],
+                                               user_save=params[
+                                                   'user_save'] + (0.05 * params['user_save'] * i),
+                                               user_spend=params[
+                                                   'user_spend'],
+                                               user_social_security_age=params[
+                                                   'user_social_security_age'],
+                                               user_social_security_benefit=params['user_social_security_benefit'])
+
+        scenarios['save_more'].append({'contributions': _contributions})
+
+        scenario_analysis['work_longer'][i][
+            'retire_age'] = params['user_retirement_age'] + (1 + i)
+        _contributions = fn.calc_contributions(user_age=params['user_age'],
+                                               retirement_age=params[
+                                                   'user_retirement_age'] + (1 + i),
+                                               final_age=params[
+                                                   'user_mortality']['1%'],
+                                               user_save=params[
+                                                   'user_save'],
+                                               user_spend=params[
+                                                   'user_spend'],
+                                               user_social_security_age=params[
+                                                   'user_social_security_age'],
+                                               user_social_security_benefit=params['user_social_security_benefit'])
+
+        scenarios['work_longer'].append({'contributions': _contributions,
+                                         'idx_at_retirement': params['user_retirement_age'] + (1 + i) - params['user_age']})
+
+        scenario_analysis['spend_less'][i]['spend_amount'] = fn.dollar_as_text(
+            params['user_spend'] - ((0.05 * params['user_spend']) * i))
+
+        _contributions = fn.calc_contributions(user_age=params['user_age'],
+                                               retirement_age=params[
+                                                   'user_retirement_age'],
+                                               final_age=params[
+                                                   'user_mortality']['1%'],
+                                               user_save=params[
+                                                   'user_save'],
+                                               user_spend=params[
+                                                   'user_spend'] - ((0.05 * params['user_spend']) * i),
+                                               user_social_security_age=params[
+                                                   'user_social_security_age'],
+                                               user_social_security_benefit=params['user_social_security_benefit'])
+
+        scenarios['spend_less'].append({'contributions': _contributions})
+
+    progress(0.5, 'Finding a plan that works')
+
+    # find the savings, retirement age and spend (each changed on its own) that give a 90% chance that the
+    # money lasts, on the same market paths as the plan
+    goal_success_prob = 0.9
+    goal_save = goal_seek.solve_for_savings(params, equity_returns, bond_returns, goal_success_prob)
+    goal_retirement_age = goal_seek.solve_for_retirement_age(params, equity_returns, bond_returns, goal_success_prob)
+    goal_spend = goal_seek.solve_for_spend(params, equity_returns, bond_returns, goal_success_prob)
+
+    goal_options = []
+    if goal_save is not None:
+        goal_options.append('save {} a year'.format(fn.dollar_as_text(goal_save['user_save'])))
+    if goal_retirement_age is not None:
+        goal_options.append('retire at {}'.format(goal_retirement_age['retirement_age']))
+    if goal_spend is not None:
+        goal_options.append('spend {} a year in retirement'.format(fn.dollar_as_text(goal_spend['user_spend'])))
+
+    goal_text = '''For a {:.0%} chance that your money lasts from retirement to age {}, you could {}'''.format(
+        goal_success_prob, params['user_mortality']['1%'], ', or '.join(goal_options)) if goal_options else ''
+
+    progress(0.7, 'Running what-if scenarios')
+
+    scenario_names = ['save_more', 'work_longer', 'spend_less']
+    # (each scenario is only simulated from the first period in which it differs from the base plan, eg the
+    # spend_less scenarios from retirement onwards)
+    all_wealth_stats = fn.financial_plan_scenarios(params,
+                                                   [s for name in scenario_names for s in scenarios[name]],
+                                                   equity_returns,
+                                                   bond_returns,
+                                                   keys=fn.REPORTED_KEYS,
+                                                   base_contributions=contributions[0],
+                                                   base_wealths=wealths)
+
+    for j, name in enumerate(scenario_names):
+        for i in range(4):
+            _wealth_stats = all_wealth_stats[4 * j + i]
             for pct in [75, 'mean', 25, 5]:
-                scenario_analysis['spend_less'][i]['age_at_negative_wealth'][
+                scenario_analysis[name][i]['age_at_negative_wealth'][
                     pct] = _wealth_stats[pct]['age_at_negative_wealth']
-                scenario_analysis['spend_less'][i]['wealth_at_retirement'][
+                scenario_analysis[name][i]['wealth_at_retirement'][
                     pct] = _wealth_stats[pct]['wealth_at_retirement']
-                scenario_analysis['spend_less'][i]['wealth_at_end'][
+                scenario_analysis[name][i]['wealth_at_end'][
                     pct] = _wealth_stats[pct]['wealth_at_end']
-                scenario_analysis['spend_less'][i]['forever_income'][
+                scenario_analysis[name][i]['forever_income'][
                     pct] = _wealth_stats[pct]['wealth_at_retirement'] * 0.04
 
-        df_save_more = pd.DataFrame({'Savings Per Year': [scenario_analysis['save_more'][i]['save_amount'] for i in range(4)],
-                                     'Wealth at Retirement': [fn.dollar_as_text(scenario_analysis['save_more'][i]['wealth_at_retirement'][5]) for i in range(4)],
-                                     'Forever Income': [fn.dollar_as_text(scenario_analysis['save_more'][i]['forever_income'][5]) for i in range(4)],
-                                     'Run out of Money at': [scenario_analysis['save_more'][i]['age_at_negative_wealth'][5] for i in range(4)],
-                                     })
+    df_save_more = pd.DataFrame({'Savings Per Year': [scenario_analysis['save_more'][i]['save_amount'] for i in range(4)],
+                                 'Wealth at Retirement': [fn.dollar_as_text(scenario_analysis['save_more'][i]['wealth_at_retirement'][5]) for i in range(4)],
+                                 'Forever Income': [fn.dollar_as_text(scenario_analysis['save_more'][i]['forever_income'][5]) for i in range(4)],
+                                 'Run out of Money at': [scenario_analysis['save_more'][i]['age_at_negative_wealth'][5] for i in range(4)],
+                                 })
 
-        df_work_longer = pd.DataFrame({'Retirement Age': [scenario_analysis['work_longer'][i]['retire_age'] for i in range(4)],
-                                       'Wealth at Retirement': [fn.dollar_as_text(scenario_analysis['work_longer'][i]['wealth_at_retirement'][5]) for i in range(4)],
-                                       'Forever Income': [fn.dollar_as_text(scenario_analysis['work_longer'][i]['forever_income'][5]) for i in range(4)],
-                                       'Run out of Money at': [scenario_analysis['work_longer'][i]['age_at_negative_wealth'][5] for i in range(4)]
-                                       })
+    df_work_longer = pd.DataFrame({'Retirement Age': [scenario_analysis['work_longer'][i]['retire_age'] for i in range(4)],
+                                   'Wealth at Retirement': [fn.dollar_as_text(scenario_analysis['work_longer'][i]['wealth_at_retirement'][5]) for i in range(4)],
+                                   'Forever Income': [fn.dollar_as_text(scenario_analysis['work_longer'][i]['forever_income'][5]) for i in range(4)],
+                                   'Run out of Money at': [scenario_analysis['work_longer'][i]['age_at_negative_wealth'][5] for i in range(4)]
+                                   })
 
-        df_spend_less = pd.DataFrame({'Spending per year': [scenario_analysis['spend_less'][i]['spend_amount'] for i in range(4)],
-                                      'Wealth at Retirement': [fn.dollar_as_text(scenario_analysis['spend_less'][i]['wealth_at_retirement'][5]) for i in range(4)],
-                                      'Forever Income': [fn.dollar_as_text(scenario_analysis['spend_less'][i]['forever_income'][5]) for i in range(4)],
-                                      'Run out of Money at': [scenario_analysis['spend_less'][i]['age_at_negative_wealth'][5] for i in range(4)]
-                                      })
+    df_spend_less = pd.DataFrame({'Spending per year': [scenario_analysis['spend_less'][i]['spend_amount'] for i in range(4)],
+                                  'Wealth at Retirement': [fn.dollar_as_text(scenario_analysis['spend_less'][i]['wealth_at_retirement'][5]) for i in range(4)],
+                                  'Forever Income': [fn.dollar_as_text(scenario_analysis['spend_less'][i]['forever_income'][5]) for i in range(4)],
+                                  'Run out of Money at': [scenario_analysis['spend_less'][i]['age_at_negative_wealth'][5] for i in range(4)]
+                                  })
 
-        outlook_header = "You're in Excellent Shape!"
-        outlook_note = "You are on track for financial security for the rest of your life"
-        expected_terminal_wealth = wealth_stats['mean']['wealth_at_end']
-        pessimistic_terminal_wealth = wealth_stats[5]['wealth_at_end']
-        if (expected_terminal_wealth > 0) & (pessimistic_terminal_wealth < 0):
-            outlook_header = "Your Finances Look Good"
-            outlook_note = "You are on a successful path to financial security but adverse market returns could derail your plans"
-        if (expected_terminal_wealth < 0) & (pessimistic_terminal_wealth < 0):
-            outlook_header = "Warning: You are Likely to Exhaust Your Savings"
-            outlook_note = "Your long-term financial plan may not be feasible"
+    progress(0.9, 'Building your results')
 
-        num1 = int(float(user_wealth.replace(',', '').replace('$', '')))
-        num1 = '${:,}'.format(num1)
+    outlook_header = "You're in Excellent Shape!"
+    outlook_note = "You are on track for financial security for the rest of your life"
+    expected_terminal_wealth = wealth_stats['mean']['wealth_at_end']
+    pessimistic_terminal_wealth = wealth_stats[5]['wealth_at_end']
+    if (expected_terminal_wealth > 0) & (pessimistic_terminal_wealth < 0):
+        outlook_header = "Your Finances Look Good"
+        outlook_note = "You are on a successful path to financial security but adverse market returns could derail your plans"
+    if (expected_terminal_wealth < 0) & (pessimistic_terminal_wealth < 0):
+        outlook_header = "Warning: You are Likely to Exhaust Your Savings"
+        outlook_note = "Your long-term financial plan may not be feasible"
 
-        num2 = int(float(user_save.replace(',', '').replace('$', '')))
-        num2 = '${:,}'.format(num2)
+    return html.Div([
 
-        num3 = int(float(user_spend.replace(',', '').replace('$', '')))
-        num3 = '${:,}'.format(num3)
+        dcc.Store(id='plan_data', data=plan_data),
 
-        js = '''
-        var wealth = document.getElementById("my_wealth_input");
-        wealth.value='{}'
+        html.Hr(),
 
-        var save = document.getElementById("my_save_input");
-        save.value='{}'
+        # first result section
+        html.Div([
+            dbc.Row(
+                [
+                    dbc.Col(
 
-        var spend = document.getElementById("my_spend_input");
-        spend.value='{}'
-        '''.format(num1, num2, num3)
+                        html.Div([
 
-        js = ''
+                            html.H1(outlook_header,
+                                    style={'text-align': 'center', 'color': '#26BE81', 'font-weight': 'bold'}),
 
-        return html.Div([
+                            html.H4(outlook_note, className='display-6 text-note',
+                                    style={'text-align': 'center', 'color': '#grey', })
 
-            html.Hr(),
+                        ]), width=5),
 
-            # first result section
-            html.Div([
-                dbc.Row(
-                    [
-                        dbc.Col(
+                    dbc.Col(
+                        dcc.Graph(id='chart'), width=7),
 
-                            html.Div([
 
-                                html.H1(outlook_header,
-                                        style={'text-align': 'center', 'color': '#26BE81', 'font-weight': 'bold'}),
+                ], align="center", no_gutters=True,
+            ),
+        ], style={'margin-left': '10%', 'margin-right': '10%'}),
 
-                                html.H4(outlook_note, className='display-6 text-note',
-                                        style={'text-align': 'center', 'color': '#grey', })
+        html.Br(),
+        html.Br(),
+        html.Br(),
+        html.Br(),
+        html.Br(),
 
-                            ]), width=5),
+        # second result section
+        html.Div([
 
-                        dbc.Col(
-                            dcc.Graph(id='chart', figure=figure1), width=7),
+            html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
 
+            dbc.Row([
+                dbc.Col(
 
-                    ], align="center", no_gutters=True,
-                ),
-            ], style={'margin-left': '10%', 'margin-right': '10%'}),
+                    html.Div([
+
+                        html.H1("In {}, at your target retirement age of {}:".format(params['current_year'] + params['years_to_retire'],
+                                                                                     params['user_retirement_age']),
+                                style={'text-align': 'center', 'color': 'white', }),
+
+                    ]), width=12),
+
+
+            ], align="center", no_gutters=True),
 
             html.Br(),
+
+            dbc.Row([
+
+                dbc.Col(
+                    html.Div([
+                        html.Img(src='money.png', style={
+                                 'height': '150px'}),
+                        html.Br(),
+                        html.Br(),
+                        html.H4('''You'll have contributed an additional {} to savings over the next {} years'''.format(total_user_save,
+                                                                                                                        params['user_retirement_age'] - params['user_age'] - 1))
+                    ]), width=6, style={'padding-left': '10%', 'padding-right': '10%'}),
+
+                dbc.Col(
+                    html.Div([
+                        html.Img(src='stock-market.png',
+                                 style={'height': '150px'}),
+                        html.Br(),
+                        html.Br(),
+                        html.H4('''And we assumed your investments glide into a 60/40 split between stocks 
+                            and bonds by the time you retire''')
+                    ]), width=6, style={'padding-left': '10%', 'padding-right': '10%'})
+            ], style={'padding-top': '50px'}),
+
             html.Br(),
             html.Br(),
             html.Br(),
             html.Br(),
 
-            # second result section
-            html.Div([
+            dbc.Row([
 
-                html.Br(),
-                html.Br(),
-                html.Br(),
-                html.Br(),
+                dbc.Col(
+                    '', width=2),
 
-                dbc.Row([
-                    dbc.Col(
+                dbc.Col(html.Img(src='spreadsheet.png',
+                                 style={'height': '150px'}), width=2),
 
-                        html.Div([
 
-                            html.H1("In {}, at your target retirement age of {}:".format(params['current_year'] + params['years_to_retire'],
-                                                                                         params['user_retirement_age']),
-                                    style={'text-align': 'center', 'color': 'white', }),
+                dbc.Col(
+                    html.Div([
 
-                        ]), width=12),
+                        html.H4("We don't actually know what the market will do, so we've mapped out a few scenarios for \
+                 how your savings might grow until retirement", style={'margin-left': '0%', 'margin-right': '15%', 'display': 'inline-block'})
+                    ]), width=8),
+            ]),
 
+            html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
 
-                ], align="center", no_gutters=True),
+            dbc.Table(id='retirement_table', style={'color': 'white', 'font-size': '1.5rem'}, borderless=True,
+                      hover=True,
+                      striped=True),
 
-                html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
 
-                dbc.Row([
+            html.H1(
+                '''The money you save will be used to generate income for you in retirement when you are not working'''),
 
-                    dbc.Col(
-                        html.Div([
-                            html.Img(src='money.png', style={
-                                     'height': '150px'}),
-                            html.Br(),
-                            html.Br(),
-                            html.H4('''You'll have contributed an additional {} to savings over the next {} years'''.format(total_user_save,
-                                                                                                                            params['user_retirement_age'] - params['user_age'] - 1))
-                        ]), width=6, style={'padding-left': '10%', 'padding-right': '10%'}),
+            html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
 
-                    dbc.Col(
-                        html.Div([
-                            html.Img(src='stock-market.png',
-                                     style={'height': '150px'}),
-                            html.Br(),
-                            html.Br(),
-                            html.H4('''And we assumed your investments glide into a 60/40 split between stocks 
-                                and bonds by the time you retire''')
-                        ]), width=6, style={'padding-left': '10%', 'padding-right': '10%'})
-                ], style={'padding-top': '50px'}),
+        ], className='green-background', style={'padding-left': '10%', 'padding-right': '10%'}),
 
-                html.Br(),
-                html.Br(),
-                html.Br(),
-                html.Br(),
+        # third result section
 
-                dbc.Row([
+        html.Div([
 
-                    dbc.Col(
-                        '', width=2),
+            html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
 
-                    dbc.Col(html.Img(src='spreadsheet.png',
-                                     style={'height': '150px'}), width=2),
+            html.H1("During retirement, your nest egg will have to last up to {} years".format(params['user_mortality']['1%'] - params['user_retirement_age']),
+                    className='display-6',
+                    style={'text-align': 'center', 'color': '#26BE81', 'margin-left': '10%', 'margin-right': '10%'}),
 
+            html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
 
-                    dbc.Col(
-                        html.Div([
+            dbc.Row([
 
-                            html.H4("We don't actually know what the market will do, so we've mapped out a few scenarios for \
-                     how your savings might grow until retirement", style={'margin-left': '0%', 'margin-right': '15%', 'display': 'inline-block'})
-                        ]), width=8),
-                ]),
+                dbc.Col(
+                    html.Div([
 
-                html.Br(),
-                html.Br(),
-                html.Br(),
-                html.Br(),
-                html.Br(),
+                        html.Img(src='profit.png', style={
+                                 'height': '150px'}),
 
-                dbc.Table.from_dataframe(retirement_df, style={'color': 'white', 'font-size': '1.5rem'}, borderless=True,
-                                         hover=True,
-                                         striped=True),
+                        html.H4('''We assume your nest egg will generate income based on a 60/40 split between
+                        stocks and bonds''', style={'color': '#267B83'})
 
-                html.Br(),
-                html.Br(),
-                html.Br(),
-                html.Br(),
+                    ]), width=4),
+                dbc.Col(
+                    html.Div([
 
-                html.H1(
-                    '''The money you save will be used to generate income for you in retirement when you are not working'''),
+                        html.Img(src='pension.png', style={
+                                 'height': '150px'}),
 
-                html.Br(),
-                html.Br(),
-                html.Br(),
-                html.Br(),
+                        html.H4('''And we assume you'll receive $1,500 each month in social security benefits starting
+                        at age 67''', style={'color': '#267B83'})
 
-            ], className='green-background', style={'padding-left': '10%', 'padding-right': '10%'}),
+                    ]), width=4),
+                dbc.Col(
+                    html.Div([
 
-            # third result section
+                        html.Img(src='invoice.png', style={
+                                 'height': '150px'}),
 
-            html.Div([
+                        html.H4('''And you'll spend {} each year on expenses'''.format(fn.dollar_as_text(params['user_spend'])), style={
+                                'color': '#267B83'})
 
-                html.Br(),
-                html.Br(),
-                html.Br(),
-                html.Br(),
+                    ]), width=4),
 
-                html.H1("During retirement, your nest egg will have to last up to {} years".format(params['user_mortality']['1%'] - params['user_retirement_age']),
-                        className='display-6',
-                        style={'text-align': 'center', 'color': '#26BE81', 'margin-left': '10%', 'margin-right': '10%'}),
+            ], no_gutters=False),
 
-                html.Br(),
-                html.Br(),
-                html.Br(),
-                html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
 
-                dbc.Row([
 
-                    dbc.Col(
-                        html.Div([
+            html.H4('''Based on your savings and your anticipated spending, your financial security is measured by how likely 
+                your wealth can last you for the rest of your life:''', style={
+                    'color': '#267B83', 'margin-left': '10%', 'margin-right': '10%'}),
 
-                            html.Img(src='profit.png', style={
-                                     'height': '150px'}),
 
-                            html.H4('''We assume your nest egg will generate income based on a 60/40 split between
-                            stocks and bonds''', style={'color': '#267B83'})
+            html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
 
-                        ]), width=4),
-                    dbc.Col(
-                        html.Div([
+            dbc.Table(id='depleted_table',
+                      style={'color': '#267B83', 'font-size': '1.5rem'}, borderless=True,
+                      hover=True,
+                      striped=True),
 
-                            html.Img(src='pension.png', style={
-                                     'height': '150px'}),
+            html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
 
-                            html.H4('''And we assume you'll receive $1,500 each month in social security benefits starting
-                            at age 67''', style={'color': '#267B83'})
+            html.H4('''Looking at every simulated market scenario, this is the chance that your assets run out
+                by each age you might live to:''', style={
+                    'color': '#267B83', 'margin-left': '10%', 'margin-right': '10%'}),
 
-                        ]), width=4),
-                    dbc.Col(
-                        html.Div([
+            html.Br(),
+            html.Br(),
 
-                            html.Img(src='invoice.png', style={
-                                     'height': '150px'}),
+            dbc.Table.from_dataframe(ruin_df,
+                                     style={'color': '#267B83', 'font-size': '1.5rem'}, borderless=True,
+                                     hover=True,
+                                     striped=True),
 
-                            html.H4('''And you'll spend {} each year on expenses'''.format(fn.dollar_as_text(params['user_spend'])), style={
-                                    'color': '#267B83'})
+            html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
 
-                        ]), width=4),
+            html.Details([
 
-                ], no_gutters=False),
+                html.Summary('View Wealth Scenario Charts'),
 
                 html.Br(),
                 html.Br(),
@@ -939,59 +936,54 @@ def display_page(n_clicks,
                 html.Br(),
 
 
-                html.H4('''Based on your savings and your anticipated spending, your financial security is measured by how likely 
-                    your wealth can last you for the rest of your life:''', style={
-                        'color': '#267B83', 'margin-left': '10%', 'margin-right': '10%'}),
-
+                dbc.Row([
 
-                html.Br(),
-                html.Br(),
-                html.Br(),
-                html.Br(),
+                    dbc.Col(
+                        html.Div(dcc.Graph(id='chart75', style={'height': 300})), width=6),
 
-                dbc.Table.from_dataframe(depleted_df,
-                                         style={'color': '#267B83', 'font-size': '1.5rem'}, borderless=True,
-                                         hover=True,
-                                         striped=True),
+                    dbc.Col(
+                        html.Div(dcc.Graph(id='chart50', style={'height': 300})), width=6)
+                ]),
 
-                html.Br(),
-                html.Br(),
-                html.Br(),
-                html.Br(),
+                dbc.Row([
 
-                html.Details([
+                    dbc.Col(
+                        html.Div(dcc.Graph(id='chart25', style={'height': 300})), width=6),
 
-                    html.Summary('View Wealth Scenario Charts'),
+                    dbc.Col(
+                        html.Div(dcc.Graph(id='chart5', style={'height': 300})), width=6)
+                ])
 
-                    html.Br(),
-                    html.Br(),
-                    html.Br(),
-                    html.Br(),
+            ]),
 
 
-                    dbc.Row([
 
-                        dbc.Col(
-                            html.Div(dcc.Graph(id='chart75', figure=figure75, style={'height': 300})), width=6),
+        ], style={'margin-left': '8%', 'margin-right': '8%'}),
 
-                        dbc.Col(
-                            html.Div(dcc.Graph(id='chart50', figure=figure50, style={'height': 300})), width=6)
-                    ]),
+        html.Br(),
+        html.Br(),
+        html.Br(),
+        html.Br(),
 
-                    dbc.Row([
 
-                        dbc.Col(
-                            html.Div(dcc.Graph(id='chart25', figure=figure25, style={'height': 300})), width=6),
+        # 4th Results Section
+        html.Div([
 
-                        dbc.Col(
-                            html.Div(dcc.Graph(id='chart5', figure=figure5, style={'height': 300})), width=6)
-                    ])
+            html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
 
-                ]),
+            html.H1("Suggestions to improve your financial outlook",
+                    className='display-6',
+                    style={'margin-left': '10%', 'margin-right': '10%'}),
 
+            html.Div('''You can't control the market, but you do have three main avenues for reducing the chance you'd 
+                run out of money during retirement, even in the pessimistic scenario''', className='white-text text-note'),
 
+            html.Br(),
 
-            ], style={'margin-left': '8%', 'margin-right': '8%'}),
+            html.H4(goal_text, className='white-text', style={'margin-left': '10%', 'margin-right': '10%'}),
 
             html.Br(),
             html.Br(),
@@ -999,145 +991,294 @@ def display_page(n_clicks,
             html.Br(),
 
 
-            # 4th Results Section
-            html.Div([
 
-                html.Br(),
-                html.Br(),
-                html.Br(),
-                html.Br(),
-
-                html.H1("Suggestions to improve your financial outlook",
-                        className='display-6',
-                        style={'margin-left': '10%', 'margin-right': '10%'}),
+            dbc.Row([
 
-                html.Div('''You can't control the market, but you do have three main avenues for reducing the chance you'd 
-                    run out of money during retirement, even in the pessimistic scenario''', className='white-text text-note'),
+                dbc.Col(
+                    html.Div([
 
-                html.Br(),
-                html.Br(),
-                html.Br(),
-                html.Br(),
+                        html.Img(src='save-money.png',
+                                 style={'height': '150px'}),
 
+                        html.Br(),
+                        html.Br(),
 
+                        html.H4(
+                            '''Save more in the years leading up to retirement''')
 
-                dbc.Row([
+                    ]), width=4),
 
-                    dbc.Col(
-                        html.Div([
 
-                            html.Img(src='save-money.png',
-                                     style={'height': '150px'}),
+                dbc.Col(
+                    html.Div([
 
-                            html.Br(),
-                            html.Br(),
+                        dbc.Table.from_dataframe(df_save_more, style={'color': 'white', 'font-size': '1.5rem'}, borderless=True,
+                                                 hover=True,
+                                                 striped=True),
 
-                            html.H4(
-                                '''Save more in the years leading up to retirement''')
 
-                        ]), width=4),
 
+                    ]), width=8),
 
-                    dbc.Col(
-                        html.Div([
+            ], no_gutters=False),
 
-                            dbc.Table.from_dataframe(df_save_more, style={'color': 'white', 'font-size': '1.5rem'}, borderless=True,
-                                                     hover=True,
-                                                     striped=True),
+            html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
 
+            dbc.Row([
 
+                dbc.Col(
+                    html.Div([
 
-                        ]), width=8),
+                        html.Img(src='briefcase.png', style={
+                                 'height': '150px'}),
 
-                ], no_gutters=False),
+                        html.Br(),
+                        html.Br(),
 
-                html.Br(),
-                html.Br(),
-                html.Br(),
-                html.Br(),
+                        html.H4('''Work longer while delaying retirement''')
 
-                dbc.Row([
+                    ]), width=4),
 
-                    dbc.Col(
-                        html.Div([
 
-                            html.Img(src='briefcase.png', style={
-                                     'height': '150px'}),
+                dbc.Col(
+                    html.Div([
 
-                            html.Br(),
-                            html.Br(),
+                        dbc.Table.from_dataframe(df_work_longer, style={'color': 'white', 'font-size': '1.5rem'}, borderless=True,
+                                                 hover=True,
+                                                 striped=True),
 
-                            html.H4('''Work longer while delaying retirement''')
 
-                        ]), width=4),
+                    ]), width=8),
 
+            ], no_gutters=False),
 
-                    dbc.Col(
-                        html.Div([
 
-                            dbc.Table.from_dataframe(df_work_longer, style={'color': 'white', 'font-size': '1.5rem'}, borderless=True,
-                                                     hover=True,
-                                                     striped=True),
+            html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
 
+            dbc.Row([
 
-                        ]), width=8),
+                dbc.Col(
+                    html.Div([
 
-                ], no_gutters=False),
+                        html.Img(src='fishing.png', style={
+                                 'height': '150px'}),
 
+                        html.Br(),
+                        html.Br(),
 
-                html.Br(),
-                html.Br(),
-                html.Br(),
-                html.Br(),
+                        html.H4('''Spend less during retirement''')
 
-                dbc.Row([
+                    ]), width=4),
 
-                    dbc.Col(
-                        html.Div([
 
-                            html.Img(src='fishing.png', style={
-                                     'height': '150px'}),
+                dbc.Col(
+                    html.Div([
 
-                            html.Br(),
-                            html.Br(),
+                        dbc.Table.from_dataframe(df_spend_less, style={'color': 'white', 'font-size': '1.5rem'}, borderless=True,
+                                                 hover=True,
+                                                 striped=True),
 
-                            html.H4('''Spend less during retirement''')
 
-                        ]), width=4),
 
+                    ]), width=8),
 
-                    dbc.Col(
-                        html.Div([
+            ], no_gutters=False),
 
-                            dbc.Table.from_dataframe(df_spend_less, style={'color': 'white', 'font-size': '1.5rem'}, borderless=True,
-                                                     hover=True,
-                                                     striped=True),
 
+            html.Br(),
+            html.Br(),
+            html.Br(),
+            html.Br(),
 
 
-                        ]), width=8),
 
-                ], no_gutters=False),
 
+        ], className='green-background', style={'padding-left': '10%', 'padding-right': '10%'}),
 
-                html.Br(),
-                html.Br(),
-                html.Br(),
-                html.Br(),
+        html.Script('hello', type="text/javascript",
+                    src="//counter.websiteout.net/js/17/6/0/0"),
+        html.A('Icons made by Freepik',
+               href='https://www.flaticon.com/authors/freepik'),
 
 
 
+    ])
 
-            ], className='green-background', style={'padding-left': '10%', 'padding-right': '10%'}),
 
-            html.Script('hello', type="text/javascript",
-                        src="//counter.websiteout.net/js/17/6/0/0"),
-            html.A('Icons made by Freepik',
-                   href='https://www.flaticon.com/authors/freepik'),
+# calculate the sensitivity of the plan to savings and retirement age
+@app.callback([dash.dependencies.Output('heatmap_output', 'children'),
+               dash.dependencies.Output('heatmap_job', 'data'),
+               dash.dependencies.Output('heatmap_job_interval', 'disabled')],
 
+              [dash.dependencies.Input('start_input', 'n_clicks'),
+               dash.dependencies.Input('heatmap_job_interval', 'n_intervals')],
 
+              [dash.dependencies.State('heatmap_job', 'data'),
+               dash.dependencies.State('my_age_input', 'value'),
+               dash.dependencies.State('retirement_age_input', 'value'),
+               dash.dependencies.State('my_wealth_input', 'value'),
+               dash.dependencies.State('my_save_input', 'value'),
+               dash.dependencies.State('my_spend_input', 'value')
+               ])
+def display_heatmap(n_clicks,
+                    n_intervals,
+                    heatmap_job,
+                    user_age,
+                    user_retirement_age,
+                    user_wealth,
+                    user_save,
+                    user_spend):
+    '''
+    GO submits the heatmap as a background job (unless it is cached), in the same job queue as the plan, and every
+    tick of the interval shows its output once it is done (see display_page())
+    '''
 
-        ])
+    if n_clicks is None:
+        return html.Div(), None, True
+
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+
+    if 'start_input.n_clicks' in triggered:
+
+        inputs = parse_user_inputs(user_age, user_retirement_age, user_wealth, user_save, user_spend)
+        cache_key = ('heatmap', fn.MODEL_VERSION, SIMULATION_SEED) + inputs
+
+        output = plan_cache.get(cache_key)
+        if output is not None:
+            return output, None, True
+
+        job_id = job_queue.submit(cache_key, build_heatmap_output, *inputs)
+        heatmap_job = {'job_id': job_id, 'cache_key': list(cache_key)}
+
+    if heatmap_job is None:
+        return dash.no_update, None, True
+
+    status = job_queue.status(heatmap_job['job_id'])
+
+    if status is None or status['status'] == jobs.FAILED:
+        error = 'Something went wrong while building the sensitivity heatmap, please try again'
+        return html.Div(error, style={'text-align': 'center'}), None, True
+
+    if status['status'] == jobs.DONE:
+        plan_cache.put(tuple(heatmap_job['cache_key']), status['result'])
+        return status['result'], None, True
+
+    waiting = html.Div(status['message'], className='text-note', style={'text-align': 'center'})
+
+    return waiting, heatmap_job, False
+
+
+def build_heatmap_output(user_age,
+                         user_retirement_age,
+                         user_wealth,
+                         user_save,
+                         user_spend,
+                         progress=None):
+    '''
+    evaluate the plan over a grid of yearly savings and retirement ages around the user's inputs and build the
+    page section with the heatmap of the probability that the money lasts. progress(fraction, message) is called
+    as the grid goes along (see apps.jobs)
+    '''
+
+    if progress is None:
+        progress = lambda fraction, message='': None
+
+    progress(0.0, 'Building the sensitivity heatmap')
+
+    params = build_plan_params(user_age, user_retirement_age, user_wealth, user_save, user_spend)
+
+    # 1. the grid: savings from $0 to twice the current savings, and retirement ages around the target
+    # (between a year from now and a year before the final age)
+    save_levels = np.linspace(0, max(2 * params['user_save'], 20000), HEATMAP_SAVE_LEVELS)
+    save_levels = np.round(save_levels, -2)
+
+    first_retirement_age = max(params['user_retirement_age'] - HEATMAP_RETIREMENT_AGES // 2, params['user_age'] + 1)
+    last_retirement_age = min(first_retirement_age + HEATMAP_RETIREMENT_AGES, params['user_mortality']['1%'])
+    retirement_ages = np.arange(first_retirement_age, last_retirement_age)
+
+    # 2. one set of market returns that is shared by every point of the grid
+    if params['return_model'] == 'historical':
+        years, sp500, ust_3m, ust, bbb = fn.get_historical_annual_returns()
+        _, equity_returns, bond_returns = fn.build_bootstrap_sampled_returns(num_periods_per_simulation=params['num_periods'],
+                                                                            num_simulations=HEATMAP_SIMULATIONS,
+                                                                            year_list=years,
+                                                                            sp500_list=sp500,
+                                                                            ust_list=ust,
+                                                                            method='stationary',
+                                                                            block_length=5)
+    elif params['return_model'] == 'multi_asset':
+        allocations = multi_asset.glide_path_allocations(user_age=params['user_age'],
+                                                         retirement_age=params['user_retirement_age'],
+                                                         final_age=params['user_mortality']['1%'],
+                                                         bond_mix=params['bond_mix'])
+        _, equity_returns, bond_returns = multi_asset.simulate_multi_asset_growth(allocations, HEATMAP_SIMULATIONS,
+                                                                                  method=params['sampling_method'],
+                                                                                  seed=params['seed'])
+        equity_returns, bond_returns = equity_returns.T, bond_returns.T
+    else:
+        shocks = shock_bank.load_shock_bank(method=params['sampling_method'], seed=params['seed'])
+        equity_returns = fn.random_walk_from_shocks(mean=0.08,
+                                                    stdev=0.14,
+                                                    shocks=shocks[:params['num_periods'], :HEATMAP_SIMULATIONS])
+        bond_returns = np.full(shape=params['num_periods'], fill_value=0.01)
+        bond_returns[0] = 0.0
+
+    # 3. evaluate the whole grid
+    progress(0.2, 'Evaluating {} savings levels x {} retirement ages'.format(len(save_levels), len(retirement_ages)))
+    grid = fn.sensitivity_grid(params, equity_returns, bond_returns, save_levels, retirement_ages)
+
+    # 4. heatmap of the success probability (the 5th percentile of final wealth is shown on hover)
+    save_labels = [fn.dollar_as_text(x) for x in save_levels]
+
+    figure = {'data': [{'type': 'heatmap',
+                        'x': retirement_ages,
+                        'y': save_labels,
+                        'z': np.round(grid['success_probs'] * 100, 1),
+                        'customdata': [[fn.dollar_as_text(x) for x in row] for row in grid['terminal_wealth_p5']],
+                        'hovertemplate': 'Retire at %{x}, save %{y} a year<br>'
+                                         'Chance your money lasts: %{z}%<br>'
+                                         'Pessimistic (5th pct) wealth at age ' + str(params['user_mortality']['1%']) +
+                                         ': %{customdata}<extra></extra>',
+                        'colorscale': 'RdYlGn',
+                        'zmin': 0,
+                        'zmax': 100,
+                        'colorbar': {'title': '% Chance'}}],
+              'layout': {'xaxis': {'title': 'Retirement Age', 'dtick': 1},
+                         'yaxis': {'title': 'Savings Per Year', 'type': 'category'},
+                         'margin': {'l': 100, 'r': 40, 't': 20, 'b': 60},
+                         'plot_bgcolor': config.colors['plot_background'],
+                         'paper_bgcolor': config.colors['paper_background']}}
+
+    return html.Div([
+
+        html.Br(),
+        html.Br(),
+        html.Br(),
+        html.Br(),
+
+        html.H1("How the chance that your money lasts depends on when you retire and how much you save",
+                className='display-6',
+                style={'margin-left': '10%', 'margin-right': '10%'}),
+
+        html.Br(),
+
+        html.Div('''Each square shows the chance that your savings last from retirement to age {}, across {:,}
+                    market scenarios. Hover over a square to see your wealth at that age in a pessimistic market
+                    (5th percentile).'''.format(params['user_mortality']['1%'], HEATMAP_SIMULATIONS),
+                 className='text-note',
+                 style={'margin-left': '10%', 'margin-right': '10%'}),
+
+        html.Br(),
+
+        dcc.Graph(id='sensitivity_heatmap', figure=figure, style={'height': 600}),
+
+    ], style={'margin-left': '8%', 'margin-right': '8%'})
 
 
 @app.callback(dash.dependencies.Output("collapse", "is_open"),
@@ -0,0 +1,237 @@
+'''
+background execution of long running jobs (eg the financial plan), so that they do not tie up the web workers.
+
+a job is submitted from a callback and runs in a small process pool owned by the web worker. Jobs are tracked in a
+SQLite table that every gunicorn worker (and every pool process) shares, which holds the status, progress and the
+(pickled) result of every job, so that the page can poll any web worker for the progress of a job and pick up the
+result once it is done. No broker or extra service is needed.
+
+the number of jobs that run at the same time is capped by the table, across all web workers and pools: a job waits
+in the pool process until fewer than max_running jobs hold a slot. The cap therefore does not grow with the number
+of web workers. A job that has not reported progress for stale_after seconds (eg because its process died) no
+longer holds a slot. A queued job touches its row while it waits for a slot, so a queued job whose row has not been
+touched for stale_after seconds (eg because its web worker or pool died before it started) is dropped too, and can
+be submitted again.
+
+the id of a job is derived from its key, so a job that is submitted again while it is queued, running or done
+(eg after repeated clicks on GO) is not run twice.
+'''
+
+import concurrent.futures
+import contextlib
+import hashlib
+import multiprocessing
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+
+# statuses of a job
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# number of jobs that run at the same time (over all web workers) and the number of pool processes per web worker
+MAX_RUNNING_JOBS = int(os.environ.get('max_running_jobs', 2))
+POOL_SIZE = int(os.environ.get('job_pool_size', 2))
+
+# seconds after which a running (or queued) job without progress is taken for dead, and after which jobs are deleted
+STALE_AFTER = 120
+JOB_TTL = 3600
+
+# seconds between two attempts of a queued job to get a slot
+SLOT_POLL_INTERVAL = 0.1
+
+
+def job_db_path(directory=None):
+    '''
+    :return: the path of the job table (in the temp directory, or in the directory set by the job_db_dir
+    environment variable)
+    '''
+
+    if directory is None:
+        directory = os.environ.get('job_db_dir', tempfile.gettempdir())
+
+    return os.path.join(directory, 'plan_jobs.sqlite')
+
+
+def connect(path):
+    '''
+    :return: a connection to the job table (created if it does not exist yet)
+    '''
+
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                              job_id TEXT PRIMARY KEY,
+                              status TEXT NOT NULL,
+                              progress REAL NOT NULL,
+                              message TEXT NOT NULL,
+                              created REAL NOT NULL,
+                              updated REAL NOT NULL,
+                              result BLOB,
+                              error TEXT)''')
+
+    return connection
+
+
+def make_job_id(key):
+    '''
+    :return: the id of the job with the given key (any value with a stable repr, eg a tuple of the plan inputs)
+    '''
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def update_job(path, job_id, **columns):
+    '''
+    set the given columns of a job (and the time of its last update)
+    '''
+
+    columns['updated'] = time.time()
+    assignments = ', '.join('{} = ?'.format(c) for c in columns)
+
+    with contextlib.closing(connect(path)) as connection:
+        connection.execute('UPDATE jobs SET {} WHERE job_id = ?'.format(assignments),
+                           list(columns.values()) + [job_id])
+
+
+def claim_slot(path, job_id, max_running):
+    '''
+    mark the job as running if fewer than max_running (non-stale) jobs are running, and otherwise touch the queued
+    job (so that it is not taken for dead while it waits).
+
+    :return: True if the job got a slot
+    '''
+
+    connection = connect(path)
+
+    try:
+        # the count and the update happen in one write transaction, so two processes cannot take the last slot
+        connection.execute('BEGIN IMMEDIATE')
+        now = time.time()
+
+        running = connection.execute('SELECT COUNT(*) FROM jobs WHERE status = ? AND updated > ?',
+                                     (RUNNING, now - STALE_AFTER)).fetchone()[0]
+
+        claimed = running < max_running
+        if claimed:
+            connection.execute('UPDATE jobs SET status = ?, updated = ? WHERE job_id = ?', (RUNNING, now, job_id))
+        else:
+            connection.execute('UPDATE jobs SET updated = ? WHERE job_id = ?', (now, job_id))
+
+        connection.execute('COMMIT')
+
+    except BaseException:
+        # (if BEGIN IMMEDIATE itself failed there is no transaction to roll back, and the original error is kept)
+        if connection.in_transaction:
+            connection.execute('ROLLBACK')
+        raise
+
+    finally:
+        connection.close()
+
+    return claimed
+
+
+def run_job(path, job_id, max_running, func, args):
+    '''
+    run func(*args, progress=...) in a pool process once the job gets a slot, and store its result (or error) in
+    the job table. progress(fraction, message) reports how far along the job is.
+    '''
+
+    # (every attempt that does not get a slot touches the job, see claim_slot())
+    while not claim_slot(path, job_id, max_running):
+        time.sleep(SLOT_POLL_INTERVAL)
+
+    def progress(fraction, message=''):
+        update_job(path, job_id, progress=fraction, message=message)
+
+    try:
+        result = func(*args, progress=progress)
+        update_job(path, job_id, status=DONE, progress=1.0, message='', result=pickle.dumps(result))
+
+    except Exception as e:
+        update_job(path, job_id, status=FAILED, error='{}: {}'.format(type(e).__name__, e))
+
+
+class JobQueue:
+    '''
+    submits jobs to a process pool (created on first use, so that it is created after gunicorn forks the web
+    worker) and reads their status from the shared job table.
+    '''
+
+    def __init__(self, path=None, pool_size=POOL_SIZE, max_running=MAX_RUNNING_JOBS):
+
+        self.path = job_db_path() if path is None else path
+        self.pool_size = pool_size
+        self.max_running = max_running
+
+        self._pool = None
+        self._lock = threading.Lock()
+
+        connect(self.path).close()
+
+    def _get_pool(self):
+
+        with self._lock:
+            if self._pool is None:
+                # pool processes are spawned rather than forked from the (multi-threaded) web worker
+                self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.pool_size,
+                                                                    mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def submit(self, key, func, *args):
+        '''
+        queue func(*args, progress=...) unless a job with the same key is already queued, running or done.
+        func and args must be picklable (eg a module level function).
+
+        :return: the id of the job
+        '''
+
+        job_id = make_job_id(key)
+        now = time.time()
+
+        with contextlib.closing(connect(self.path)) as connection:
+            # forget old jobs, and jobs that failed or whose process died while they were queued or running (so
+            # that they can be submitted again)
+            connection.execute('DELETE FROM jobs WHERE created < ? OR status = ? OR (status IN (?, ?) AND updated < ?)',
+                               (now - JOB_TTL, FAILED, QUEUED, RUNNING, now - STALE_AFTER))
+
+            inserted = connection.execute('INSERT OR IGNORE INTO jobs (job_id, status, progress, message, created, '
+                                          'updated) VALUES (?, ?, 0, ?, ?, ?)',
+                                          (job_id, QUEUED, 'waiting for a free slot', now, now)).rowcount
+
+        if inserted:
+            try:
+                self._get_pool().submit(run_job, self.path, job_id, self.max_running, func, args)
+            except Exception as e:
+                # eg a pool process died: start a new pool for the next job
+                with self._lock:
+                    self._pool = None
+                update_job(self.path, job_id, status=FAILED, error='{}: {}'.format(type(e).__name__, e))
+
+        return job_id
+
+    def status(self, job_id):
+        '''
+        :return: a dictionary with the status, progress (0 to 1), message and error of the job (and its result
+        once it is done), or None if there is no such job
+        '''
+
+        with contextlib.closing(connect(self.path)) as connection:
+            row = connection.execute('SELECT status, progress, message, error, result FROM jobs WHERE job_id = ?',
+                                     (job_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        status, progress, message, error, result = row
+
+        return {'status': status,
+                'progress': progress,
+                'message': message,
+                'error': error,
+                'result': pickle.loads(result) if status == DONE else None}
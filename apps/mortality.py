@@ -0,0 +1,103 @@
+'''
+precomputed mortality statistics for every starting age.
+
+the mortality table only covers about 120 ages, so the conditional survival curves and the statistics of every
+possible starting age are computed once when the module is imported. A lookup for a user is then a matter of
+indexing into these arrays.
+
+source data for actuarial calculations
+https://www.ssa.gov/oact/STATS/table4c6.html#fn2
+https://www.longevityillustrator.org
+'''
+
+import numpy as np
+import pandas as pd
+
+# survival probabilities (conditional on the current age) that are reported for every user
+SURVIVAL_PROBS = [0.25, 0.10, 0.05, 0.01]
+
+# age that is reported when the survival probability is never reached within the table
+AGE_NOT_REACHED = 999
+
+
+def load_mortality_table(path='data/mortality_table.csv'):
+    '''
+    :return: the mortality table indexed by current age, with the 1 year forward survival probability
+    (average between male and female statistics)
+    '''
+
+    mortality_table = pd.read_csv(path)
+    mortality_table.set_index('current_age', inplace=True)
+    mortality_table['forward_survival_prob_1y'] = 1 - ((mortality_table['forward_death_prob_1y_male'] +
+                                                        mortality_table['forward_death_prob_1y_female']) / 2)
+
+    return mortality_table
+
+
+def calc_cum_survival_probs(forward_survival_probs):
+    '''
+    :return: a [num_ages x num_ages] array where row a holds the probability of surviving to the end of each age
+    conditional on being alive at age a (the entries before age a are 1)
+    '''
+
+    num_ages = len(forward_survival_probs)
+    cum_survival_probs = np.ones(shape=[num_ages, num_ages])
+
+    for a in range(num_ages):
+        cum_survival_probs[a, a:] = np.cumprod(forward_survival_probs[a:])
+
+    return cum_survival_probs
+
+
+def calc_ages_for_survival_prob(target_survival_prob, starting_ages=None):
+    '''
+    find the first age at which the cumulative survival probability drops to target_survival_prob or below.
+
+    every row of CUM_SURVIVAL_PROBS is non-increasing, so the age is found with a binary search on the negated row.
+
+    :return: an array with the age for every starting age (or for the given starting ages), AGE_NOT_REACHED when
+    the survival probability is never reached within the table
+    '''
+
+    if starting_ages is None:
+        starting_ages = AGES
+
+    idx = np.array([np.searchsorted(-CUM_SURVIVAL_PROBS[AGE_INDEX[a]], -target_survival_prob, side='left')
+                    for a in np.atleast_1d(starting_ages)])
+
+    reached = idx < len(AGES)
+
+    return np.where(reached, AGES[np.minimum(idx, len(AGES) - 1)], AGE_NOT_REACHED)
+
+
+def get_user_mortality_stats(user_age):
+    '''
+    :return: a dictionary with the expected age at death and the ages the user is expected to live to with 25%, 10%,
+    5% and 1% probability (conditional on their current age), and the list of ages from user_age to the end of
+    the mortality table
+    '''
+
+    i = AGE_INDEX[user_age]
+
+    user_mortality = {'expected_age_at_death': int(EXPECTED_AGE_AT_DEATH[i])}
+
+    for prob in SURVIVAL_PROBS:
+        user_mortality['{:.0%}'.format(prob)] = int(SURVIVAL_AGES[prob][i])
+
+    return user_mortality, AGES[i:].tolist()
+
+
+# 1. load the table and derive the statistics for every starting age
+MORTALITY_TABLE = load_mortality_table()
+
+AGES = MORTALITY_TABLE.index.to_numpy()
+AGE_INDEX = {age: i for i, age in enumerate(AGES.tolist())}
+
+# 2. expected age at death (average between male and female statistics)
+EXPECTED_AGE_AT_DEATH = (((MORTALITY_TABLE['expected_years_till_death_male'] +
+                           MORTALITY_TABLE['expected_years_till_death_female']) / 2).to_numpy().astype(int) + AGES)
+
+# 3. conditional survival curves and the ages at which the reported survival probabilities are reached
+CUM_SURVIVAL_PROBS = calc_cum_survival_probs(MORTALITY_TABLE['forward_survival_prob_1y'].to_numpy())
+
+SURVIVAL_AGES = {prob: calc_ages_for_survival_prob(prob) for prob in SURVIVAL_PROBS}
@@ -0,0 +1,226 @@
+'''
+correlated multi-asset simulation of market returns.
+
+the base plan blends a random walk for stocks with a constant bond return. This module models all four series of
+data/lt_annual_asset_returns.csv (the real returns of the S&P 500, 3 month T-bills, 10 year Treasuries and BBB
+corporate bonds) jointly: their means and covariance matrix are estimated from the file, and correlated returns
+are drawn as mean + L z, where L is the Cholesky factor of the covariance matrix and z are independent standard
+normal shocks (see fn.standard_normal_draws() for the sampling methods).
+
+a portfolio is described by an allocation schedule of size [num_periods x num_assets] (see
+calc_multi_asset_allocations()) instead of the scalar stock allocation of the base plan. The [num_periods x
+num_assets x num_simulations] return cube is only ever built chunk_size simulations at a time and reduced to the
+growth factor of the portfolio straight away, so the memory use does not grow with the number of assets.
+
+the page runs on this engine when the return_model of apps.home.build_plan_params() is 'multi_asset': the base
+plan keeps its glide path, with the bond part held in the three bond series (see glide_path_allocations()), and is
+run by multi_asset_financial_plan(). The scenarios, goal seek and heatmap blend stock and bond returns, so the
+engine also returns the returns of the bonds in the schedule (see calc_bond_mix()), which give the same growth as
+the full schedule when they are blended with its stock share.
+'''
+
+import functools
+
+import numpy as np
+
+from apps import functions as fn
+
+# the asset classes, in the order of the columns of the return cube
+ASSET_NAMES = ['sp500', 'ust_3m', 'ust', 'bbb']
+
+
+@functools.lru_cache(maxsize=1)
+def get_asset_return_moments():
+    '''
+    estimate the annual means and the covariance matrix (ddof=1) of the real returns of every asset class.
+
+    :return: an array of means of size [num_assets], the [num_assets x num_assets] covariance matrix and its
+    (lower triangular) Cholesky factor
+    '''
+
+    years, sp500, ust_3m, ust, bbb = fn.get_historical_annual_returns()
+    returns = np.column_stack([sp500, ust_3m, ust, bbb])
+
+    means = returns.mean(axis=0)
+    covariance = np.cov(returns, rowvar=False)
+
+    return means, covariance, np.linalg.cholesky(covariance)
+
+
+def correlated_return_draws(means, cholesky, periods, num_simulations, set_first_obs_as_zero=True, method='pseudo',
+                            seed=None):
+    '''
+    draw correlated returns for every asset, period and simulation in one batched call.
+
+    :return: an array of size [periods x num_assets x num_simulations]
+    '''
+
+    num_assets = len(means)
+
+    # independent shocks for every (period, asset) pair, correlated across assets with one matrix product
+    shocks = fn.standard_normal_draws(periods * num_assets, num_simulations, method=method, seed=seed)
+    shocks = shocks.reshape(periods, num_assets, num_simulations)
+
+    returns = np.matmul(cholesky, shocks)
+    returns += np.asarray(means)[:, np.newaxis]
+
+    if set_first_obs_as_zero:
+        returns[0] = 0
+
+    return returns
+
+
+def calc_multi_asset_allocations(user_age, retirement_age, final_age, allocation_at_retirement,
+                                 initial_allocation=(1.0, 0.0, 0.0, 0.0), glide_length=10):
+    '''
+    for every age, calculate the allocation to every asset class. The allocation is initial_allocation until
+    glide_length years before retirement, then it moves (by the same amount every year) to
+    allocation_at_retirement, which is held from retirement onwards. This is the same glide path as
+    fn.calc_asset_allocations(), with weights over all asset classes in place of the stock allocation.
+
+    :return: an array of size [num_periods x num_assets]
+    '''
+
+    initial_allocation = np.asarray(initial_allocation, dtype=float)
+    allocation_at_retirement = np.asarray(allocation_at_retirement, dtype=float)
+
+    assert np.isclose(initial_allocation.sum(), 1.0) and np.isclose(allocation_at_retirement.sum(), 1.0), \
+        'error: allocations do not add up to 1'
+
+    ages = np.arange(user_age, final_age + 1)
+    glide_start_age = retirement_age - glide_length
+
+    # share of the way from the initial allocation to the allocation at retirement
+    if glide_length > 0:
+        progress = np.clip((ages - glide_start_age) / glide_length, 0.0, 1.0)
+    else:
+        progress = (ages >= retirement_age).astype(float)
+
+    return np.outer(1.0 - progress, initial_allocation) + np.outer(progress, allocation_at_retirement)
+
+
+def glide_path_allocations(user_age, retirement_age, final_age, bond_mix, percent_at_retirement=0.6,
+                           glide_length=10):
+    '''
+    the glide path of fn.calc_asset_allocations() as an allocation schedule over all asset classes: the share of
+    stocks is the same, and the rest is held in the bond series with the weights of bond_mix.
+
+    :bond_mix: the weights of the bond series (ASSET_NAMES[1:]), which add up to 1
+    :return: an array of size [num_periods x num_assets]
+    '''
+
+    bond_mix = np.asarray(bond_mix, dtype=float)
+    assert np.isclose(bond_mix.sum(), 1.0), 'error: bond mix does not add up to 1'
+
+    allocation_at_retirement = np.concatenate([[percent_at_retirement], (1.0 - percent_at_retirement) * bond_mix])
+
+    return calc_multi_asset_allocations(user_age, retirement_age, final_age, allocation_at_retirement,
+                                        glide_length=glide_length)
+
+
+def calc_bond_mix(allocations):
+    '''
+    for every period, the weights of the bond series within the non-stock part of an allocation schedule. Periods
+    that hold only stocks take the mix of the next period that holds bonds (or equal weights if none does), which
+    does not change their growth.
+
+    :return: an array of size [num_periods x (num_assets - 1)]
+    '''
+
+    bonds = allocations[:, 1:]
+    bond_share = bonds.sum(axis=1)
+    holds_bonds = bond_share > 1e-12
+
+    if not holds_bonds.any():
+        return np.full(shape=bonds.shape, fill_value=1.0 / bonds.shape[1])
+
+    # 1. the mix of every period that holds bonds
+    bond_mix = np.zeros(shape=bonds.shape)
+    bond_mix[holds_bonds] = bonds[holds_bonds] / bond_share[holds_bonds, np.newaxis]
+
+    # 2. carry the mix back to the all-stock periods (and forward to any all-stock periods after the last one)
+    idx = np.flatnonzero(holds_bonds)
+    next_idx = np.minimum(np.searchsorted(idx, np.arange(len(bonds))), len(idx) - 1)
+
+    return bond_mix[idx[next_idx]]
+
+
+def simulate_multi_asset_growth(allocations, num_simulations, means=None, cholesky=None, chunk_size=10000,
+                                method='pseudo', seed=None):
+    '''
+    simulate the growth factor of a multi-asset portfolio, chunk_size simulations at a time.
+
+    :allocations: a [num_periods x num_assets] allocation schedule
+    :means, cholesky: the moments of the asset returns (estimated from the returns file when not given)
+    :seed: seed of the first chunk (chunk i is drawn with seed + i)
+    :return: the [num_periods x num_simulations] growth factors of the portfolio (period-major, like
+    fn.calc_growth_factors()), the [num_periods x num_simulations] returns of the first asset (stocks) and the
+    [num_periods x num_simulations] returns of the bonds in the schedule (see calc_bond_mix())
+    '''
+
+    if means is None or cholesky is None:
+        means, _, cholesky = get_asset_return_moments()
+
+    num_periods, num_assets = allocations.shape
+    assert num_assets == len(means), 'error: allocations and means do not have the same number of assets'
+
+    bond_mix = calc_bond_mix(allocations)
+
+    growth = np.empty(shape=[num_periods, num_simulations])
+    equity_returns = np.empty(shape=[num_periods, num_simulations])
+    bond_returns = np.empty(shape=[num_periods, num_simulations])
+
+    for i, start in enumerate(range(0, num_simulations, chunk_size)):
+        stop = min(start + chunk_size, num_simulations)
+
+        returns = correlated_return_draws(means, cholesky, num_periods, stop - start, method=method,
+                                          seed=None if seed is None else seed + i)
+
+        # portfolio return in every period = allocation-weighted sum of the asset returns
+        np.add(1.0, np.einsum('pa,pan->pn', allocations, returns), out=growth[:, start:stop])
+        equity_returns[:, start:stop] = returns[:, 0]
+        np.einsum('pa,pan->pn', bond_mix, returns[:, 1:], out=bond_returns[:, start:stop])
+
+    return growth, equity_returns, bond_returns
+
+
+def multi_asset_financial_plan(params, contributions, allocations, means=None, cholesky=None, chunk_size=10000,
+                               method='pseudo', seed=None, keys=fn.MILESTONE_KEYS):
+    '''
+    run the financial plan for a multi-asset portfolio with the allocation schedule given (eg from
+    glide_path_allocations()).
+
+    :return: the same tuple as fn.financial_plan() (the allocations are the stock share of the schedule and the
+    market returns in wealth_stats are the stock returns), and the [num_simulations x num_periods] stock and bond
+    returns of the paths, which give the same growth when they are blended with the stock share (so the scenarios
+    can run on them, like the returns of fn.adaptive_financial_plan())
+    '''
+
+    growth, equity_returns, bond_returns = simulate_multi_asset_growth(allocations, params['num_simulations'],
+                                                                       means=means, cholesky=cholesky,
+                                                                       chunk_size=chunk_size, method=method,
+                                                                       seed=seed)
+
+    starting_wealth_array = np.full(shape=params['num_simulations'], fill_value=params['user_wealth'])
+    wealths = fn.calc_wealth_from_growth(starting_wealth_array, growth, contributions).T
+
+    trajectories = fn.wealth_distributions(wealths, keys=keys)
+    rates_of_return = fn.calc_market_return_distributions(equity_returns.T, keys=keys)
+
+    wealth_stats = fn.calc_wealth_milestones(trajectories,
+                                             rates_of_return,
+                                             params['age_list'],
+                                             params['idx_at_retirement'],
+                                             params['idx_at_final_age'],
+                                             params['years_to_retire_minus_one'],
+                                             keys=keys)
+
+    total_user_save = fn.dollar_as_text(contributions[:params['user_retirement_age'] - params['user_age']].sum())
+
+    # the stock share and the contributions as read-only [num_simulations x num_periods] views, like
+    # fn.financial_plan()
+    shape = wealths.shape
+    plan = (total_user_save, starting_wealth_array, np.broadcast_to(allocations[:, 0], shape),
+            np.broadcast_to(contributions, shape), wealths, trajectories, wealth_stats)
+
+    return plan, equity_returns.T, bond_returns.T
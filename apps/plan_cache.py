@@ -0,0 +1,97 @@
+'''
+an in-memory cache for the results of the financial plan.
+
+the plan is a pure function of the (parsed) user inputs, the model version and the simulation seed, so a repeat
+submission of the same inputs can be served from the cache instead of rerunning the simulation. Every gunicorn
+worker keeps its own cache.
+'''
+
+import collections
+import pickle
+import threading
+import time
+
+
+class PlanCache:
+    '''
+    a least-recently-used cache that is bounded by the number of entries and by their total size in bytes
+    (the size of the pickled value), and whose entries expire ttl seconds after they were stored.
+    '''
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 ** 2, ttl=3600):
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        # key -> (value, size in bytes, time stored), ordered from least to most recently used
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        '''
+        :return: the cached value for key, or None if there is no (unexpired) entry
+        '''
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and time.monotonic() - entry[2] > self.ttl:
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[0]
+
+    def put(self, key, value):
+        '''
+        store value under key, then evict the least recently used entries until the cache is within its bounds
+        (a value that is larger than max_bytes on its own is not stored)
+        '''
+
+        size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = (value, size, time.monotonic())
+            self.total_bytes += size
+
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        '''
+        :return: a dictionary with the hit/miss counters and the current size of the cache
+        '''
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'entries': len(self._entries),
+                    'bytes': self.total_bytes}
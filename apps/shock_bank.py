@@ -0,0 +1,110 @@
+'''
+a bank of standard normal shocks that is shared by every plan (and every gunicorn worker).
+
+the bank is generated once from a fixed seed and saved as an .npy file in the temp directory (or in the directory
+set by the shock_bank_dir environment variable). Every worker maps the same file read-only, so the operating system
+keeps a single copy of the shocks in memory no matter how many workers there are. Plans take consecutive slices of
+the bank and scale them to the requested mean and standard deviation (see fn.adaptive_financial_plan()), which
+
+- removes the cost of drawing random numbers from every request
+- makes the results of a plan reproducible (the same inputs always give the same answer)
+- runs every plan and every what-if scenario on common random numbers, so the differences between them are
+  driven by the inputs rather than by sampling noise
+
+the bank is laid out as [periods x paths] and built in batches of SHOCK_BANK_BATCH_SIZE paths, where batch i is
+drawn with seed + i. With the sobol method every batch is an independently scrambled Sobol sequence, and the first
+n periods of the bank are an n dimensional Sobol sequence, so a plan with fewer periods than the bank keeps the
+balance properties of the sequence.
+'''
+
+import functools
+import os
+import tempfile
+
+import numpy as np
+
+from apps import functions as fn
+
+# version of the way the bank is drawn (bump whenever it changes, so that workers do not map a stale bank file)
+SHOCK_BANK_VERSION = 2
+
+# one row per age in the mortality table (the longest plan starts at age 0)
+SHOCK_BANK_PERIODS = 120
+
+# the bank holds enough paths for the largest adaptive plan, in batches of the adaptive batch size. A batch is a
+# whole power of 2 points of its sobol sequence (a cut sequence loses the base 2 balance that makes it beat
+# pseudo-random draws)
+SHOCK_BANK_BATCH_SIZE = 2048
+SHOCK_BANK_NUM_BATCHES = 25
+
+
+def build_shock_bank(method='sobol', seed=0, periods=SHOCK_BANK_PERIODS, batch_size=SHOCK_BANK_BATCH_SIZE,
+                     num_batches=SHOCK_BANK_NUM_BATCHES, out=None):
+    '''
+    draw the shocks of the bank, batch by batch (see fn.standard_normal_draws() for the methods).
+
+    :out: an array of size [periods x batch_size * num_batches] to write the shocks into (eg a memory mapped file)
+    :return: the array of shocks
+    '''
+
+    if out is None:
+        out = np.empty(shape=[periods, batch_size * num_batches])
+
+    for i in range(num_batches):
+        out[:, i * batch_size:(i + 1) * batch_size] = fn.standard_normal_draws(periods, batch_size, method=method,
+                                                                               seed=seed + i)
+
+    return out
+
+
+def shock_bank_path(method='sobol', seed=0, directory=None):
+    '''
+    :return: the path of the file that holds the bank (the name identifies everything that determines its content)
+    '''
+
+    if directory is None:
+        directory = os.environ.get('shock_bank_dir', tempfile.gettempdir())
+
+    file_name = 'shock_bank_{}_seed{}_{}x{}_v{}.npy'.format(method, seed, SHOCK_BANK_PERIODS,
+                                                            SHOCK_BANK_BATCH_SIZE * SHOCK_BANK_NUM_BATCHES,
+                                                            SHOCK_BANK_VERSION)
+
+    return os.path.join(directory, file_name)
+
+
+@functools.lru_cache(maxsize=4)
+def load_shock_bank(method='sobol', seed=0, directory=None):
+    '''
+    map the bank into memory (read-only), building the file first if it does not exist yet.
+
+    the file is written under a temporary name and then renamed, so other workers never map a partly written bank
+    (if two workers build it at the same time, both write the same shocks and the last rename wins). If the
+    directory is not writable, the bank is kept in the memory of this process instead.
+
+    :return: a read-only array of size [SHOCK_BANK_PERIODS x paths]
+    '''
+
+    path = shock_bank_path(method, seed, directory)
+    shape = (SHOCK_BANK_PERIODS, SHOCK_BANK_BATCH_SIZE * SHOCK_BANK_NUM_BATCHES)
+
+    if not os.path.exists(path):
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+
+        try:
+            shocks = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.float64, shape=shape)
+            build_shock_bank(method, seed, out=shocks)
+            shocks.flush()
+            del shocks
+
+            os.replace(temp_path, path)
+
+        except OSError:
+            shocks = build_shock_bank(method, seed)
+            shocks.flags.writeable = False
+            return shocks
+
+    shocks = np.load(path, mmap_mode='r')
+
+    assert shocks.shape == shape, 'error: the shock bank in {} does not have shape {}'.format(path, shape)
+
+    return shocks
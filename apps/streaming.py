@@ -0,0 +1,208 @@
+'''
+constant-memory monte carlo for the financial plan.
+
+financial_plan() keeps the full [num_simulations x num_periods] wealth matrix (and an equally large matrix of
+cumulative market returns) in memory until the percentiles are taken. streaming_financial_plan() instead simulates
+the paths in chunks, folds every chunk into per-period quantile sketches and running sums, and throws the chunk
+away. Memory use is set by the chunk size and the sketch resolution, not by the number of simulations.
+
+error bounds of the sketch
+--------------------------
+the sketch puts every value x into a logarithmic bucket (gamma^(k-1), gamma^k] with
+gamma = (1 + relative_accuracy) / (1 - relative_accuracy) and reports the bucket by the point
+2 * gamma^k / (gamma + 1). For a percentile p over n values, the reported value v satisfies
+
+    |v - x_(r)| <= relative_accuracy * |x_(r)|,   r = floor(p / 100 * (n - 1))
+
+where x_(r) is the exact order statistic of rank r (0-based) across every simulated path. In addition:
+
+- values with |x| < min_value are counted as zero (absolute error below min_value)
+- values with |x| > max_value are clipped to max_value
+
+np.percentile() interpolates between x_(r) and x_(r+1); with thousands of paths these two order statistics are
+typically within a fraction of a percent of each other, so the sketch lands within about relative_accuracy of
+the exact percentile (with the default relative_accuracy of 0.005 and 100,000 paths of the default profile, the
+largest error against np.percentile is about 0.6%). benchmarks/validate_streaming_plan.py measures the actual
+error against exact percentiles.
+The means are accumulated exactly (up to floating point rounding).
+'''
+
+import numpy as np
+
+from apps import functions as fn
+
+
+class QuantileSketch:
+    '''
+    a mergeable, fixed-size sketch of the distribution of values in every period.
+
+    the sketch holds bucket counts for positive and negative values plus a zero bucket for every period, so two
+    sketches built with the same parameters can be combined by adding their counts (see merge()).
+    '''
+
+    def __init__(self, num_periods, relative_accuracy=0.005, min_value=1.0, max_value=1e13):
+
+        self.num_periods = num_periods
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+
+        # bucket k covers (gamma^(k + offset - 1), gamma^(k + offset)]
+        self.offset = int(np.ceil(np.log(min_value) / self.log_gamma))
+        self.num_buckets = int(np.ceil(np.log(max_value) / self.log_gamma)) - self.offset + 1
+
+        self.positive_counts = np.zeros(shape=[num_periods, self.num_buckets], dtype=np.int64)
+        self.negative_counts = np.zeros(shape=[num_periods, self.num_buckets], dtype=np.int64)
+        self.zero_counts = np.zeros(shape=num_periods, dtype=np.int64)
+
+        self.sums = np.zeros(shape=num_periods)
+        self.counts = np.zeros(shape=num_periods, dtype=np.int64)
+
+    def _bucket_counts(self, x, mask):
+        # count the values selected by mask in each [period, bucket]
+        magnitudes = np.clip(np.abs(x[mask]), self.min_value, self.max_value)
+        buckets = np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64) - self.offset
+        buckets = np.clip(buckets, 0, self.num_buckets - 1)
+
+        periods = np.broadcast_to(np.arange(self.num_periods), x.shape)[mask]
+        counts = np.bincount(periods * self.num_buckets + buckets, minlength=self.num_periods * self.num_buckets)
+
+        return counts.reshape(self.num_periods, self.num_buckets)
+
+    def add(self, x):
+        '''
+        fold a [num_simulations x num_periods] array of values into the sketch
+        '''
+
+        assert x.shape[1] == self.num_periods, 'error: x does not have {} periods'.format(self.num_periods)
+
+        is_zero = np.abs(x) < self.min_value
+
+        self.positive_counts += self._bucket_counts(x, (x > 0) & ~is_zero)
+        self.negative_counts += self._bucket_counts(x, (x < 0) & ~is_zero)
+        self.zero_counts += is_zero.sum(axis=0)
+
+        self.sums += x.sum(axis=0)
+        self.counts += x.shape[0]
+
+        return self
+
+    def merge(self, other):
+        '''
+        add the counts of another sketch (built with the same parameters) to this one
+        '''
+
+        assert (self.num_periods, self.num_buckets, self.offset) == (other.num_periods, other.num_buckets, other.offset), \
+            'error: sketches with different parameters cannot be merged'
+
+        self.positive_counts += other.positive_counts
+        self.negative_counts += other.negative_counts
+        self.zero_counts += other.zero_counts
+        self.sums += other.sums
+        self.counts += other.counts
+
+        return self
+
+    def quantile(self, q):
+        '''
+        :return: an array with the estimated qth percentile (0-100) in every period
+        '''
+
+        # line up the buckets from the most negative to the most positive value
+        # (negative buckets in reverse order, then the zero bucket, then the positive buckets)
+        ordered_counts = np.concatenate([self.negative_counts[:, ::-1],
+                                         self.zero_counts[:, np.newaxis],
+                                         self.positive_counts], axis=1)
+        cumulative_counts = np.cumsum(ordered_counts, axis=1)
+
+        # the value with (0-based) rank r lies in the first bucket whose cumulative count exceeds r
+        ranks = np.floor(q / 100 * (self.counts - 1))
+        position = (cumulative_counts <= ranks[:, np.newaxis]).sum(axis=1)
+
+        # representative value of every bucket, in the same order as ordered_counts
+        magnitudes = 2 * self.gamma ** (np.arange(self.num_buckets) + self.offset) / (self.gamma + 1)
+        values = np.concatenate([-magnitudes[::-1], [0.0], magnitudes])
+
+        return values[np.minimum(position, len(values) - 1)]
+
+    def mean(self):
+        '''
+        :return: an array with the mean in every period
+        '''
+        return self.sums / self.counts
+
+    def distributions(self, keys=fn.DISTRIBUTION_KEYS):
+        '''
+        :return: the same dictionary of statistics as fn.wealth_distributions()
+        '''
+        return {k: self.mean() if k == 'mean' else self.quantile(50 if k == 'median' else k) for k in keys}
+
+
+def streaming_financial_plan(params, contributions, num_simulations, chunk_size=10000, mean=0.08, stdev=0.14,
+                             bond_return=0.01, keys=fn.MILESTONE_KEYS, relative_accuracy=0.005):
+    '''
+    run the financial plan over num_simulations random walk paths, chunk_size paths at a time.
+
+    every chunk of equity returns and wealth paths is folded into a QuantileSketch (one for wealth and one for the
+    cumulative market return) and then discarded, so a plan with 1,000,000 paths needs about as much memory as a
+    plan with chunk_size paths.
+
+    :return: the same tuple as fn.financial_plan() (total_user_save, starting_wealth_array, allocations,
+    contributions, wealths, trajectories, wealth_stats), so that it can be used in its place. The wealth paths are
+    not kept, so wealths is None; starting_wealth_array, allocations and contributions are read-only broadcast
+    views of [num_simulations] and [num_simulations x num_periods] size, which take no memory
+    '''
+
+    num_periods = params['num_periods']
+
+    allocations = fn.calc_asset_allocations(user_age=params['user_age'],
+                                            retirement_age=params['user_retirement_age'],
+                                            final_age=params['user_mortality']['1%'],
+                                            percent_at_retirement=0.6,
+                                            glide_length=10)
+
+    bond_returns = np.full(shape=num_periods, fill_value=bond_return)
+    bond_returns[0] = 0.0
+
+    wealth_sketch = QuantileSketch(num_periods, relative_accuracy=relative_accuracy)
+    return_sketch = QuantileSketch(num_periods - 1, relative_accuracy=relative_accuracy, min_value=1e-6,
+                                   max_value=1e6)
+
+    for start in range(0, num_simulations, chunk_size):
+        this_chunk_size = min(chunk_size, num_simulations - start)
+
+        equity_returns = fn.random_walk_simulations(mean=mean,
+                                                    stdev=stdev,
+                                                    periods=num_periods,
+                                                    num_simulations=this_chunk_size)
+
+        wealths = fn.calc_wealth_trajectory(starting_wealth=np.full(this_chunk_size, params['user_wealth']),
+                                            equity_returns=equity_returns,
+                                            bond_returns=bond_returns,
+                                            allocations=allocations,
+                                            contributions=contributions)
+
+        wealth_sketch.add(wealths)
+        return_sketch.add(np.cumprod(equity_returns[:, 1:] + 1, axis=1))
+
+    trajectories = wealth_sketch.distributions(keys)
+    rates_of_return = return_sketch.distributions(keys)
+
+    wealth_stats = fn.calc_wealth_milestones(trajectories,
+                                             rates_of_return,
+                                             params['age_list'],
+                                             params['idx_at_retirement'],
+                                             params['idx_at_final_age'],
+                                             params['years_to_retire_minus_one'],
+                                             keys=keys)
+
+    total_user_save = fn.dollar_as_text(contributions[:params['user_retirement_age'] - params['user_age']].sum())
+
+    shape = (num_simulations, num_periods)
+    starting_wealth_array = np.broadcast_to(params['user_wealth'], shape[:1])
+
+    return (total_user_save, starting_wealth_array, np.broadcast_to(allocations, shape),
+            np.broadcast_to(contributions, shape), None, trajectories, wealth_stats)
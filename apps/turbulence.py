@@ -0,0 +1,229 @@
+'''
+financial turbulence (Kritzman and Li, 2010): the Mahalanobis distance of the returns of a date from the mean and
+the covariance matrix of the returns over the trailing window (the window does not include the date itself)
+
+    turbulence = (x - mean)' covariance^-1 (x - mean)
+
+the inverse of the covariance matrix is not recomputed every date. RollingInverseCovariance keeps the mean of the
+window and the inverse of its scatter matrix (the sum of the outer products of the deviations from the mean) and
+updates them with the Sherman-Morrison formula whenever a date enters or leaves the window:
+
+    (S + c u u')^-1 = S^-1 - c (S^-1 u) (S^-1 u)' / (1 + c u' S^-1 u)
+
+so a date costs O(N^2) instead of the O(N^3) of an inversion. Downdates can lose precision when the scatter matrix is
+close to singular, so the inverse is recomputed from the window every refresh_every dates (or straight away when
+an update looks unstable).
+
+turbulence() computes the turbulence of a single date from scratch and is the reference for the rolling version
+(see benchmarks/validate_turbulence.py).
+'''
+
+import numpy as np
+import pandas as pd
+
+# two years of daily returns
+WINDOW = 504
+
+# dates between two recomputations of the inverse from the window
+REFRESH_EVERY = 252
+
+# smallest denominator (1 + c u' S^-1 u) of a Sherman-Morrison update that is trusted
+MIN_DENOMINATOR = 1e-8
+
+
+def turbulence(x, window_returns):
+    '''
+    :x: the returns of a date (an array of size [num_assets])
+    :window_returns: the [num_obs x num_assets] returns of the trailing window
+    :return: the turbulence of x relative to the window
+    '''
+
+    deviation = x - window_returns.mean(axis=0)
+
+    return deviation @ np.linalg.solve(np.cov(window_returns, rowvar=False), deviation)
+
+
+class RollingInverseCovariance:
+    '''
+    the mean and the inverse of the scatter matrix of the last window observations of a vector of returns, updated
+    in O(num_assets^2) per observation (see the module docstring).
+
+    the window is kept in a ring buffer, so that the observation that leaves the window can be taken out (and so
+    that the inverse can be recomputed from scratch). The state is a dictionary of arrays (see get_state()), so that
+    it can be saved and the updates picked up later.
+    '''
+
+    def __init__(self, num_assets, window=WINDOW, refresh_every=REFRESH_EVERY):
+
+        self.num_assets = num_assets
+        self.window = window
+        self.refresh_every = refresh_every
+
+        self.buffer = np.zeros(shape=[window, num_assets])
+        self.count = 0
+
+        self.mean = np.zeros(num_assets)
+        self.inverse_scatter = None
+
+    @property
+    def num_obs(self):
+        return min(self.count, self.window)
+
+    @property
+    def is_full(self):
+        return self.count >= self.window
+
+    def window_values(self):
+        '''
+        :return: the observations in the window, oldest first
+        '''
+
+        if not self.is_full:
+            return self.buffer[:self.count]
+
+        position = self.count % self.window
+
+        return np.concatenate([self.buffer[position:], self.buffer[:position]])
+
+    def refresh(self):
+        '''
+        recompute the mean and the inverse of the scatter matrix from the observations in the window (the inverse
+        is only defined once there are more observations than assets)
+        '''
+
+        x = self.window_values()
+        self.mean = x.mean(axis=0)
+
+        if len(x) > self.num_assets:
+            deviations = x - self.mean
+            self.inverse_scatter = np.linalg.inv(deviations.T @ deviations)
+        else:
+            self.inverse_scatter = None
+
+    def _rank_one_update(self, u, c):
+        '''
+        replace the inverse of S by the inverse of S + c u u'
+
+        :return: False if the update is numerically unstable (the inverse is then left as it was)
+        '''
+
+        v = self.inverse_scatter @ u
+        denominator = 1.0 + c * (u @ v)
+
+        if denominator <= MIN_DENOMINATOR:
+            return False
+
+        self.inverse_scatter -= (c / denominator) * np.outer(v, v)
+
+        return True
+
+    def update(self, x):
+        '''
+        add the observation x (an array of size [num_assets]) to the window, dropping the oldest observation once
+        the window is full
+        '''
+
+        x = np.asarray(x, dtype=float)
+        position = self.count % self.window
+        stable = self.inverse_scatter is not None
+
+        # 1. drop the observation that leaves the window: with n observations and mean m, the scatter matrix
+        # loses n / (n - 1) (x_old - m)(x_old - m)'
+        if self.is_full:
+            x_old = self.buffer[position]
+            n = self.window
+            deviation = x_old - self.mean
+
+            if stable:
+                stable = self._rank_one_update(deviation, -n / (n - 1))
+            self.mean -= deviation / (n - 1)
+
+        # 2. add the new observation: with n observations and mean m, the scatter matrix gains
+        # n / (n + 1) (x - m)(x - m)'
+        n = self.num_obs - 1 if self.is_full else self.num_obs
+        deviation = x - self.mean
+
+        if stable:
+            stable = self._rank_one_update(deviation, n / (n + 1))
+        self.mean += deviation / (n + 1)
+
+        self.buffer[position] = x
+        self.count += 1
+
+        # 3. recompute the inverse from scratch periodically, when an update was unstable, and once the window
+        # first holds enough observations
+        if not stable or (self.refresh_every and self.count % self.refresh_every == 0):
+            self.refresh()
+
+    def turbulence(self, x):
+        '''
+        :return: the turbulence of the observation x relative to the window (the inverse covariance matrix is
+        (n - 1) times the inverse of the scatter matrix)
+        '''
+
+        deviation = np.asarray(x, dtype=float) - self.mean
+
+        return (self.num_obs - 1) * (deviation @ self.inverse_scatter @ deviation)
+
+    def get_state(self):
+        '''
+        :return: the state as a dictionary of arrays (eg to save with np.savez())
+        '''
+
+        return {'window': self.window, 'refresh_every': self.refresh_every, 'buffer': self.buffer,
+                'count': self.count, 'mean': self.mean,
+                'inverse_scatter': np.full([self.num_assets] * 2, np.nan) if self.inverse_scatter is None
+                else self.inverse_scatter}
+
+    @classmethod
+    def from_state(cls, state):
+        '''
+        :return: the RollingInverseCovariance with the state returned by get_state() (or loaded with np.load())
+        '''
+
+        moments = cls(num_assets=state['buffer'].shape[1], window=int(state['window']),
+                      refresh_every=int(state['refresh_every']))
+
+        moments.buffer = np.array(state['buffer'])
+        moments.count = int(state['count'])
+        moments.mean = np.array(state['mean'])
+
+        inverse_scatter = np.array(state['inverse_scatter'])
+        moments.inverse_scatter = None if np.isnan(inverse_scatter).any() else inverse_scatter
+
+        return moments
+
+
+def update_turbulence(moments, returns):
+    '''
+    compute the turbulence of every date (once the window before it is full), then add the date to the window.
+
+    :moments: a RollingInverseCovariance (updated in place)
+    :returns: a dataframe of returns with dates in the index and one column per asset
+    :return: a dataframe with the date and the turbulence, for the dates with a full window before them
+    '''
+
+    dates = []
+    values = []
+
+    for date, x in zip(returns.index, returns.to_numpy(dtype=float)):
+
+        if moments.is_full:
+            dates.append(date)
+            values.append(moments.turbulence(x))
+
+        moments.update(x)
+
+    return pd.DataFrame({'date': dates, 'turbulence': np.array(values, dtype=float)})
+
+
+def rolling_turbulence(returns, window=WINDOW, refresh_every=REFRESH_EVERY):
+    '''
+    compute the full turbulence history of a dataframe of returns (dates in the index, one column per asset).
+
+    :return: a dataframe with the date and the turbulence, for every date with a full window before it
+    '''
+
+    moments = RollingInverseCovariance(num_assets=returns.shape[1], window=window, refresh_every=refresh_every)
+
+    return update_turbulence(moments, returns)
@@ -0,0 +1,31 @@
+/*
+formatting of the dollar amounts in the input boxes, in the browser (see the clientside callback in apps/home.py),
+so that typing in the boxes does not send any request to the server.
+*/
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    formatting: {
+
+        // format an amount typed as eg '30000', '30,000.50' or '$30000' as '$30,000' ('$0' if it is not a number)
+        format_dollars: function(value) {
+            var number = parseFloat(String(value).replace(/[$,]/g, ''));
+
+            if (!isFinite(number)) {
+                return '$0';
+            }
+
+            return '$' + Math.trunc(number).toLocaleString('en-US');
+        },
+
+        // reformat the wealth, savings and spend boxes once any of them loses focus
+        format_dollar_inputs: function(wealth_blur, save_blur, spend_blur, user_wealth, user_save, user_spend) {
+            if (!(wealth_blur || save_blur || spend_blur)) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+
+            var format_dollars = window.dash_clientside.formatting.format_dollars;
+
+            return [format_dollars(user_wealth), format_dollars(user_save), format_dollars(user_spend)];
+        }
+    }
+});
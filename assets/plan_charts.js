@@ -0,0 +1,129 @@
+/*
+charts of wealth over time and the summary tables of the plan, drawn in the browser from the plan_data store that
+build_plan_output() (apps/home.py) puts on the page (see the clientside callback in apps/home.py).
+*/
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    plan_charts: {
+
+        // decode a base64 string of little-endian float32 (see encode_float32() in apps/home.py)
+        decode_float32: function(text) {
+            var binary = atob(text);
+            var bytes = new Uint8Array(binary.length);
+
+            for (var i = 0; i < binary.length; i++) {
+                bytes[i] = binary.charCodeAt(i);
+            }
+
+            return Array.from(new Float32Array(bytes.buffer));
+        },
+
+        // vertical lines at the age social security starts and at the ages the user lives to with 50%, 25%, 5% and
+        // 1% probability
+        chart_lines: function(plan_data) {
+            var mortality = plan_data.mortality;
+
+            var line = function(age, color, width) {
+                return {'x0': age, 'y0': 0, 'x1': age, 'y1': 1, 'yref': 'paper', 'type': 'line',
+                        'line': {'color': color, 'width': width, 'dash': 'dot'}};
+            };
+
+            return [line(plan_data.social_security_age, 'purple', 5),
+                    line(mortality['expected_age_at_death'], 'orange', 5),
+                    line(mortality['25%'], 'orange', 4),
+                    line(mortality['5%'], 'orange', 3),
+                    line(mortality['1%'], 'orange', 2)];
+        },
+
+        chart_annotations: function(plan_data) {
+            var mortality = plan_data.mortality;
+
+            var annotation = function(age, y, text, color) {
+                return {'x': age, 'y': y, 'yref': 'paper', 'text': text, 'showarrow': false,
+                        'font': {'color': color, 'family': 'avenir', 'size': 12}};
+            };
+
+            return [annotation(plan_data.retirement_age, -0.3, 'Retirement', 'green'),
+                    annotation(plan_data.social_security_age, -0.2, 'Social Security', 'purple'),
+                    annotation(mortality['expected_age_at_death'], -0.2, '50%', 'orange'),
+                    annotation(mortality['10%'], -0.3, 'Probabilities of Living To These Ages', 'orange'),
+                    annotation(mortality['25%'], -0.2, '25%', 'orange'),
+                    annotation(mortality['5%'], -0.2, '5%', 'orange'),
+                    annotation(mortality['1%'], -0.2, '1%', 'orange')];
+        },
+
+        // the table header and rows (as dash html components, like dbc.Table.from_dataframe())
+        table_children: function(table) {
+            var component = function(type, children) {
+                return {'type': type, 'namespace': 'dash_html_components', 'props': {'children': children}};
+            };
+
+            var header = component('Thead', [component('Tr', table.columns.map(function(column) {
+                return component('Th', column);
+            }))]);
+
+            var body = component('Tbody', table.rows.map(function(row) {
+                return component('Tr', row.map(function(cell) {
+                    return component('Td', cell);
+                }));
+            }));
+
+            return [header, body];
+        },
+
+        render_plan: function(plan_data) {
+            if (!plan_data) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+
+            var charts = window.dash_clientside.plan_charts;
+            var trajectories = {};
+
+            for (var key in plan_data.trajectories) {
+                trajectories[key] = charts.decode_float32(plan_data.trajectories[key]);
+            }
+
+            var num_periods = trajectories['mean'].length;
+            var ages = [];
+            for (var i = 0; i < num_periods; i++) {
+                ages.push(plan_data.first_age + i);
+            }
+
+            var shapes = charts.chart_lines(plan_data);
+            var annotations = charts.chart_annotations(plan_data);
+
+            // the bar at retirement stands out from the bars of the savings and retirement phases
+            var bar_colors = ages.map(function(age, i) {
+                return i === plan_data.years_to_retire ? 'green' : '#26BE81';
+            });
+
+            var figure1 = {'data': [{'x': ages, 'y': trajectories['mean'], 'type': 'bar',
+                                     'marker': {'color': bar_colors}}],
+                           'layout': {'title': '<b>Your Expected Wealth Over Time</b>',
+                                      'annotations': annotations,
+                                      'height': 350,
+                                      'margin': {'t': 40, 'r': 10},
+                                      'shapes': shapes}};
+
+            var scenario_figure = function(key, name, label, bar_color, title_color) {
+                return {'data': [{'x': ages, 'y': trajectories[key], 'type': 'bar', 'name': name,
+                                  'marker': {'color': bar_color}}],
+                        'layout': {'title': '<b>' + label + ' Scenario (' + plan_data.rates_of_return[key] +
+                                            ' Avg Stock Market Return) </b>',
+                                   'titlefont': {'color': title_color},
+                                   'annotations': annotations,
+                                   'height': 300,
+                                   'margin': {'t': 30, 'r': 10},
+                                   'shapes': shapes}};
+            };
+
+            return [figure1,
+                    scenario_figure('75', 'Pessimistic', 'Optimistic', '#D3F2E5', '#267B83'),
+                    scenario_figure('mean', 'Expected', 'Expected', '#26BE81', '#26BE81'),
+                    scenario_figure('25', 'Possible', 'Possible', '#D3F2E5', '#267B83'),
+                    scenario_figure('5', 'Pessimistic', 'Pessimistic', '#D3F2E5', '#267B83'),
+                    charts.table_children(plan_data.tables['retirement_table']),
+                    charts.table_children(plan_data.tables['depleted_table'])];
+        }
+    }
+});
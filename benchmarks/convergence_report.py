@@ -0,0 +1,83 @@
+'''
+compare how quickly the sampling methods of random_walk_simulations() pin down the reported percentiles.
+
+for every method and path count, the default plan is rerun with independent seeds and the standard error of the
+5th percentile (and the other reported percentiles) of wealth at retirement and at the final age is measured
+across the reruns. The last table shows how many paths each method needs to match the precision that plain
+pseudo-random sampling reaches with 10,000 paths (standard errors fall roughly as 1 / sqrt(paths) for the
+pseudo-random and antithetic methods, and faster for sobol). Antithetic pairs mostly help statistics of the
+center of the distribution (like the mean); tail percentiles gain little from them.
+
+run from the repository root:
+
+    python benchmarks/convergence_report.py
+'''
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps import functions as fn
+
+
+def simulate_percentiles(num_simulations, method, seed, percentiles=(75, 25, 5), idx_at_retirement=30, idx_at_final_age=71):
+    # wealth percentiles at retirement and at the final age for the default 30/60/$30,000/$9,000/$60,000 plan
+    allocations = fn.calc_asset_allocations(30, 60, 101, percent_at_retirement=0.6, glide_length=10)
+    contributions = fn.calc_contributions(30, 60, 101, user_save=9000, user_spend=60000,
+                                          user_social_security_age=67, user_social_security_benefit=18000)
+    bond_returns = np.full(72, 0.01)
+    bond_returns[0] = 0.0
+
+    equity_returns = fn.random_walk_simulations(mean=0.08, stdev=0.14, periods=72, num_simulations=num_simulations,
+                                                method=method, seed=seed)
+    wealths = fn.calc_wealth_trajectory(np.full(num_simulations, 30000), equity_returns, bond_returns,
+                                        allocations, contributions)
+
+    milestones = wealths[:, [idx_at_retirement, idx_at_final_age]]
+    return np.percentile(milestones, percentiles, axis=0)
+
+
+def main(path_counts=(1000, 2000, 5000, 10000), num_replications=40, percentiles=(75, 25, 5)):
+
+    standard_errors = {}
+
+    print('standard error across {} reruns, in $K (at retirement / at the final age)'.format(num_replications))
+    header = '{:>8}'.format('paths') + ''.join('{:>28}'.format('{} p{}'.format(m, p))
+                                              for m in fn.SAMPLING_METHODS for p in (5,))
+    print(header)
+
+    for num_simulations in path_counts:
+        row = '{:>8,}'.format(num_simulations)
+
+        for method in fn.SAMPLING_METHODS:
+            results = np.array([simulate_percentiles(num_simulations, method, seed=seed, percentiles=percentiles)
+                                for seed in range(num_replications)])
+
+            # [percentile x (retirement, final age)] standard errors
+            standard_errors[(method, num_simulations)] = results.std(axis=0, ddof=1)
+
+            p5 = standard_errors[(method, num_simulations)][percentiles.index(5)]
+            row += '{:>28}'.format('{:.1f} / {:.1f}'.format(p5[0] / 1000, p5[1] / 1000))
+
+        print(row)
+
+    # paths needed to match the precision of pseudo-random sampling with the largest path count. Each method's
+    # standard error is summarised as se * sqrt(paths) (a constant under the 1 / sqrt(paths) rule, and a
+    # conservative figure for sobol, whose error falls faster)
+    largest = path_counts[-1]
+    scaled_error = {method: np.median([standard_errors[(method, n)][percentiles.index(5), 1] * np.sqrt(n)
+                                       for n in path_counts])
+                    for method in fn.SAMPLING_METHODS}
+
+    print()
+    print('paths needed to match pseudo-random precision at {:,} paths (5th percentile, at the final age)'.format(largest))
+    for method in fn.SAMPLING_METHODS:
+        needed = largest * (scaled_error[method] / scaled_error['pseudo']) ** 2
+        print('{:>12}: ~{:,.0f} paths ({:.0%})'.format(method, needed, needed / largest))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+'''
+check the rolling absorption ratio engine against the AR of every window computed from scratch, and time the full
+history of synthetic daily returns (the industry returns are not part of the repository). The returns are drawn
+from a one factor model whose factor loading drifts over time, so that the AR moves.
+
+run from the repository root:
+
+    python benchmarks/validate_absorption_ratio.py
+'''
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps import absorption_ratio
+
+
+def synthetic_returns(num_days, num_assets=49, seed=0):
+    '''
+    :return: a dataframe of daily returns (business days in the index, one column per industry)
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    loading = 0.6 + 0.3 * np.sin(np.linspace(0, 6 * np.pi, num_days))
+    factor = rng.standard_normal(num_days) * 0.01
+    idiosyncratic = rng.standard_normal(size=[num_days, num_assets]) * 0.01
+    betas = rng.uniform(0.5, 1.5, size=num_assets)
+
+    returns = loading[:, np.newaxis] * factor[:, np.newaxis] * betas + idiosyncratic + 0.0003
+
+    dates = pd.bdate_range('1970-01-01', periods=num_days)
+
+    return pd.DataFrame(returns, index=dates, columns=['industry_{}'.format(i) for i in range(num_assets)])
+
+
+def check_against_windows(num_days=1500, num_checks=50):
+
+    returns = synthetic_returns(num_days)
+    ar = absorption_ratio.rolling_absorption_ratio(returns)
+
+    window = absorption_ratio.WINDOW
+    num_components = absorption_ratio.default_num_components(returns.shape[1])
+    columns = absorption_ratio.ar_columns(num_components)
+
+    max_error = 0.0
+    for i in np.linspace(0, len(ar) - 1, num_checks).astype(int):
+        x = returns.to_numpy()[i:i + window]
+        cum_explained, unweighted = absorption_ratio.absorption_ratio(x)
+        expected = np.concatenate([cum_explained[-1:], cum_explained[:-1], [unweighted]])
+        max_error = max(max_error, np.abs(ar.iloc[i][columns].to_numpy(dtype=float) - expected).max())
+
+    print('rolling AR against {} windows from scratch: max abs error {:.2e}'.format(num_checks, max_error))
+
+
+def time_history(num_days=12000):
+
+    returns = synthetic_returns(num_days)
+
+    start = time.perf_counter()
+    ar = absorption_ratio.rolling_absorption_ratio(returns)
+    elapsed = time.perf_counter() - start
+
+    print('{:,} days x {} industries: {:.2f}s ({:,} AR dates)'.format(num_days, returns.shape[1], elapsed, len(ar)))
+    print(ar[['date', 'ar', 'unweighted AR']].iloc[::2000].to_string(index=False))
+
+
+def compare_eigen_methods(num_days=900):
+
+    print('\ntop-k against full decomposition ({:,} days)'.format(num_days))
+    print('{:>8} {:>11} {:>10} {:>10} {:>14} {:>8}'.format('assets', 'components', 'full s', 'top_k s', 'max abs diff',
+                                                           'default'))
+
+    for num_assets, num_components in [(49, None), (250, 10), (500, 10)]:
+        returns = synthetic_returns(num_days, num_assets=num_assets)
+
+        timings = {}
+        results = {}
+        for eigen_method in absorption_ratio.EIGEN_METHODS:
+            start = time.perf_counter()
+            results[eigen_method] = absorption_ratio.rolling_absorption_ratio(returns, num_components=num_components,
+                                                                              eigen_method=eigen_method)
+            timings[eigen_method] = time.perf_counter() - start
+
+        columns = ['ar', 'unweighted AR']
+        difference = np.abs(results['full'][columns].to_numpy() - results['top_k'][columns].to_numpy()).max()
+
+        print('{:>8} {:>11} {:>10.2f} {:>10.2f} {:>14.2e} {:>8}'.format(
+            num_assets, num_components or absorption_ratio.default_num_components(num_assets), timings['full'],
+            timings['top_k'], difference, absorption_ratio.default_eigen_method(num_assets)))
+
+
+def main():
+    check_against_windows()
+    time_history()
+    compare_eigen_methods()
+
+
+if __name__ == '__main__':
+    main()
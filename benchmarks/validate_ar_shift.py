@@ -0,0 +1,101 @@
+'''
+check the streaming AR shift against the pandas rolling windows on the AR history of data/ar_shift.csv, check that
+a state saved and loaded halfway gives the same rows, and time the append of a date.
+
+run from the repository root:
+
+    python benchmarks/validate_ar_shift.py
+'''
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps import ar_shift
+
+
+def max_differences(expected, actual):
+
+    columns = ar_shift.ar_shift_columns()[2:-1]
+    for column in columns:
+        a, b = expected[column].to_numpy(dtype=float), actual[column].to_numpy(dtype=float)
+        assert (np.isnan(a) == np.isnan(b)).all(), 'error: nan mismatch in {}'.format(column)
+        print('  {:>10}: max abs diff {:.2e}'.format(column, np.nanmax(np.abs(a - b))))
+
+    print('  {:>10}: {} of {} dates differ'.format('action', (expected['action'] != actual['action']).sum(),
+                                                  len(expected)))
+
+
+def check_against_pandas(data_path='data/ar_shift.csv'):
+
+    history = pd.read_csv(data_path)[['date', 'ar']]
+
+    start = time.perf_counter()
+    batch = ar_shift.calc_ar_shift(history)
+    batch_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    streaming = ar_shift.update_ar_shift(ar_shift.ARShiftState(), history)
+    streaming_elapsed = time.perf_counter() - start
+
+    print('pandas batch ({:.3f}s) against streaming ({:.3f}s), {:,} dates'.format(batch_elapsed, streaming_elapsed,
+                                                                                 len(history)))
+    max_differences(batch, streaming)
+
+    print('pandas batch against {}'.format(data_path))
+    max_differences(pd.read_csv(data_path), batch)
+
+    # stop halfway, save the state, and pick it up again
+    half = len(history) // 2
+    ar_state = ar_shift.ARShiftState()
+    first = ar_shift.update_ar_shift(ar_state, history.iloc[:half])
+
+    path = os.path.join(tempfile.mkdtemp(), 'ar_shift_state.npz')
+    ar_shift.save_state(ar_state.get_state(), path)
+    ar_state = ar_shift.ARShiftState.from_state(ar_shift.load_state(path))
+    second = ar_shift.update_ar_shift(ar_state, history.iloc[half:])
+
+    resumed = pd.concat([first, second], ignore_index=True)
+    print('saved and reloaded halfway: identical to one pass = {}'.format(resumed.equals(streaming)))
+
+    # rebuild the state from the AR column of the first half (as daily_update --init-ar-shift does)
+    ar_state = ar_shift.ARShiftState.from_history(history['ar'].iloc[:half])
+    second = ar_shift.update_ar_shift(ar_state, history.iloc[half:])
+
+    resumed = pd.concat([first, second], ignore_index=True)
+    print('rebuilt from the history halfway: identical to one pass = {}'.format(resumed.equals(streaming)))
+
+
+def time_append(num_appends=10000):
+
+    history = pd.read_csv('data/ar_shift.csv')[['date', 'ar']]
+    ar_state = ar_shift.ARShiftState()
+    ar_shift.update_ar_shift(ar_state, history)
+
+    values = history['ar'].to_numpy()[:num_appends]
+    start = time.perf_counter()
+    for ar in values:
+        ar_state.update(ar)
+    per_date = (time.perf_counter() - start) / len(values)
+
+    start = time.perf_counter()
+    ar_shift.calc_ar_shift(history)
+    recompute = time.perf_counter() - start
+
+    print('append a date: {:.1f}us (recompute the history with pandas: {:.1f}ms)'.format(per_date * 1e6,
+                                                                                         recompute * 1e3))
+
+
+def main():
+    check_against_pandas()
+    time_append()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+'''
+check the daily update pipeline on synthetic industry returns (see validate_absorption_ratio.py): build the states
+from all but the last days of the history, drop the last days in the drop directory, run the update, and compare the
+data files with the ones built from the full history. Also checks that an update that stops halfway through the
+swap of the files is finished by the next run, that processing the same days twice appends nothing, and times the
+update against the full rebuild.
+
+run from the repository root:
+
+    python benchmarks/validate_daily_update.py
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps import daily_update
+from validate_absorption_ratio import synthetic_returns
+
+
+def make_data_dir(returns, sp500_levels):
+    '''
+    :return: a temporary data directory with the S&P 500 levels and the states built from the returns
+    '''
+
+    data_dir = tempfile.mkdtemp()
+    sp500_levels.to_csv(os.path.join(data_dir, daily_update.SP500_FILE), index=False)
+
+    start = time.perf_counter()
+    daily_update.initialize(returns, data_dir=data_dir)
+
+    return data_dir, time.perf_counter() - start
+
+
+def compare_files(expected_dir, actual_dir):
+
+    for file_name in [daily_update.AR_FILE, daily_update.TURBULENCE_FILE, daily_update.AR_SHIFT_FILE,
+                      daily_update.SP500_FILE]:
+        expected = pd.read_csv(os.path.join(expected_dir, file_name))
+        actual = pd.read_csv(os.path.join(actual_dir, file_name))
+
+        assert expected.columns.equals(actual.columns) and len(expected) == len(actual), \
+            'error: {} has a different shape'.format(file_name)
+        assert (expected.iloc[:, 0] == actual.iloc[:, 0]).all() and (expected['date'] == actual['date']).all(), \
+            'error: {} has different dates'.format(file_name)
+
+        values = expected.columns[expected.dtypes == float]
+        difference = np.nanmax(np.abs(expected[values].to_numpy() - actual[values].to_numpy()))
+        print('  {:>45}: {:,} rows, max abs diff {:.2e}'.format(file_name, len(actual), difference))
+
+
+def make_drop_dir(data_dir, returns, sp500, num_new_days):
+    '''
+    drop the last num_new_days days of the history in the drop directory of data_dir, split over two drop files
+    (with one day in both)
+    '''
+
+    drop_dir = os.path.join(data_dir, 'drop')
+    os.makedirs(drop_dir)
+    returns.iloc[-num_new_days:-2].to_csv(os.path.join(drop_dir, 'industry_returns_1.csv'), index=False)
+    returns.iloc[-3:].to_csv(os.path.join(drop_dir, 'industry_returns_2.csv'), index=False)
+    sp500.iloc[-num_new_days:].to_csv(os.path.join(drop_dir, 'sp500_levels_1.csv'), index=False)
+
+    return drop_dir
+
+
+def crashed_update(data_dir, num_replaced):
+    '''
+    run an update that stops (as a crash would) once it has replaced num_replaced files (the first replace is the
+    one of the manifest)
+    '''
+
+    replace = os.replace
+    calls = []
+
+    def crashing_replace(src, dst):
+        if len(calls) == num_replaced + 1:
+            raise KeyboardInterrupt('crash')
+        calls.append(dst)
+        replace(src, dst)
+
+    os.replace = crashing_replace
+    try:
+        daily_update.update(data_dir=data_dir)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.replace = replace
+
+
+def main(num_days=12000, num_new_days=5):
+
+    returns = synthetic_returns(num_days).rename_axis('date').reset_index()
+
+    sp500 = pd.DataFrame({'date': daily_update.format_dates(returns['date']),
+                          '^GSPC': 100 * np.exp(np.cumsum(returns['industry_0'].to_numpy())),
+                          'VBTIX': np.nan})
+    sp500.loc[num_days // 2:, 'VBTIX'] = 10.0
+
+    expected_dir, rebuild_elapsed = make_data_dir(returns, sp500)
+    data_dir, _ = make_data_dir(returns.iloc[:-num_new_days], sp500.iloc[:-num_new_days])
+    drop_dir = make_drop_dir(data_dir, returns, sp500, num_new_days)
+
+    start = time.perf_counter()
+    appended = daily_update.update(data_dir=data_dir)
+    update_elapsed = time.perf_counter() - start
+
+    print('{} new days: update {:.3f}s, full rebuild {:.2f}s, rows appended {}'.format(num_new_days, update_elapsed,
+                                                                                       rebuild_elapsed, appended))
+    compare_files(expected_dir, data_dir)
+
+    # the same drop files again: nothing to append
+    for file_name in os.listdir(os.path.join(drop_dir, 'processed')):
+        shutil.copy(os.path.join(drop_dir, 'processed', file_name), drop_dir)
+
+    print('the same days again: rows appended {}'.format(daily_update.update(data_dir=data_dir)))
+
+    # an update that stops after it has replaced 3 of its 7 files, and the next run
+    data_dir, _ = make_data_dir(returns.iloc[:-num_new_days], sp500.iloc[:-num_new_days])
+    make_drop_dir(data_dir, returns, sp500, num_new_days)
+
+    crashed_update(data_dir, num_replaced=3)
+    assert os.path.exists(os.path.join(data_dir, daily_update.MANIFEST_FILE)), 'error: the update did not stop'
+    print('stopped halfway through the swap, then run again: rows appended {}'.format(
+        daily_update.update(data_dir=data_dir)))
+    compare_files(expected_dir, data_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+'''
+check the multi-asset engine: the moments of the simulated returns against the moments estimated from the returns
+file, and the peak memory of the simulation for growing numbers of paths (with a fixed chunk size, only the
+[num_periods x num_simulations] outputs should grow, not the return cube).
+
+run from the repository root:
+
+    python benchmarks/validate_multi_asset.py
+'''
+
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps import functions as fn
+from apps import multi_asset
+
+
+def check_moments(num_simulations=20000, periods=72):
+
+    means, covariance, cholesky = multi_asset.get_asset_return_moments()
+    returns = multi_asset.correlated_return_draws(means, cholesky, periods, num_simulations,
+                                                  set_first_obs_as_zero=False, seed=0)
+
+    # pool every period and simulation: [observations x num_assets]
+    pooled = returns.transpose(0, 2, 1).reshape(-1, len(means))
+
+    print('asset moments ({:,} draws per asset)'.format(pooled.shape[0]))
+    print('{:>8} {:>10} {:>10} {:>10} {:>10}'.format('asset', 'mean', 'simulated', 'stdev', 'simulated'))
+    for i, name in enumerate(multi_asset.ASSET_NAMES):
+        print('{:>8} {:>10.4f} {:>10.4f} {:>10.4f} {:>10.4f}'.format(name, means[i], pooled[:, i].mean(),
+                                                                     np.sqrt(covariance[i, i]), pooled[:, i].std()))
+
+    estimated = np.corrcoef(np.column_stack(fn.get_historical_annual_returns()[1:]), rowvar=False)
+    simulated = np.corrcoef(pooled, rowvar=False)
+    print('max abs correlation error: {:.4f}'.format(np.abs(estimated - simulated).max()))
+
+
+def check_memory(chunk_size=10000):
+
+    allocations = multi_asset.calc_multi_asset_allocations(30, 60, 101, allocation_at_retirement=[0.6, 0.1, 0.2, 0.1])
+    num_periods = allocations.shape[0]
+
+    print('\npeak memory with chunk_size={:,} ({} periods, {} assets)'.format(chunk_size, num_periods,
+                                                                          allocations.shape[1]))
+    print('{:>12} {:>12} {:>16} {:>10}'.format('paths', 'peak MB', 'outputs MB', 'seconds'))
+
+    for num_simulations in [10000, 50000, 200000]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        growth, equity_returns, bond_returns = multi_asset.simulate_multi_asset_growth(allocations, num_simulations,
+                                                                                       chunk_size=chunk_size, seed=0)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        outputs = growth.nbytes + equity_returns.nbytes + bond_returns.nbytes
+        print('{:>12,} {:>12.1f} {:>16.1f} {:>10.2f}'.format(num_simulations, peak / 1e6, outputs / 1e6, elapsed))
+
+        del growth, equity_returns, bond_returns
+
+
+def check_stock_bond_blend(num_simulations=5000):
+
+    # the stock and bond returns of the engine, blended with the stock share of the glide path the way the
+    # scenarios blend them, give the growth of the full schedule
+    allocations = multi_asset.glide_path_allocations(30, 60, 101, bond_mix=[0.0, 0.5, 0.5])
+    growth, equity_returns, bond_returns = multi_asset.simulate_multi_asset_growth(allocations, num_simulations,
+                                                                                   seed=0)
+    blended = fn.calc_growth_factors(equity_returns.T, bond_returns.T, allocations[:, 0])
+
+    stock_share = fn.calc_asset_allocations(30, 60, 101, percent_at_retirement=0.6, glide_length=10)
+
+    print('\nmax abs error of the stock/bond blend: {:.2e}'.format(np.abs(blended - growth).max()))
+    print('max abs error of the stock share vs the base glide path: {:.2e}'.format(
+        np.abs(allocations[:, 0] - stock_share).max()))
+
+
+def main():
+    check_moments()
+    check_memory()
+    check_stock_bond_blend()
+
+
+if __name__ == '__main__':
+    main()
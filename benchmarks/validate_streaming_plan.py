@@ -0,0 +1,118 @@
+'''
+measure the error of the streaming (sketch based) financial plan against exact percentiles, check that it returns
+the same tuple as fn.financial_plan(), and measure its peak memory use for a 1,000,000 path plan.
+
+run from the repository root:
+
+    python benchmarks/validate_streaming_plan.py
+'''
+
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps import functions as fn
+from apps import streaming
+
+
+def default_plan(num_simulations):
+    # the default 30/60/$30,000/$9,000/$60,000 profile, with 101 as the final age
+    params = {'user_age': 30, 'user_retirement_age': 60, 'user_wealth': 30000, 'num_simulations': num_simulations,
+              'user_mortality': {'1%': 101}, 'age_list': list(range(30, 102)), 'num_periods': 72,
+              'idx_at_retirement': 30, 'idx_at_final_age': 71, 'years_to_retire_minus_one': 29}
+    contributions = fn.calc_contributions(30, 60, 101, user_save=9000, user_spend=60000,
+                                          user_social_security_age=67, user_social_security_benefit=18000)
+    return params, contributions
+
+
+def check_error_bounds(num_simulations=100000, chunk_size=10000, relative_accuracy=0.005):
+
+    params, contributions = default_plan(num_simulations)
+    allocations = fn.calc_asset_allocations(30, 60, 101, percent_at_retirement=0.6, glide_length=10)
+
+    # simulate all paths in memory once, and feed the same paths to the sketch chunk by chunk
+    equity_returns = fn.random_walk_simulations(mean=0.08, stdev=0.14, periods=72, num_simulations=num_simulations)
+    bond_returns = np.full(72, 0.01)
+    bond_returns[0] = 0.0
+    wealths = fn.calc_wealth_trajectory(np.full(num_simulations, 30000), equity_returns, bond_returns,
+                                        allocations, contributions)
+
+    sketch = streaming.QuantileSketch(72, relative_accuracy=relative_accuracy)
+    for start in range(0, num_simulations, chunk_size):
+        sketch.add(wealths[start:start + chunk_size])
+
+    exact = fn.wealth_distributions(wealths, keys=fn.MILESTONE_KEYS)
+    sorted_wealths = np.sort(wealths, axis=0)
+
+    print('{:,} paths, relative accuracy {}'.format(num_simulations, relative_accuracy))
+    print('{:>6} {:>26} {:>26}'.format('key', 'max rel error vs x_(r)', 'max rel error vs percentile'))
+
+    for key in fn.MILESTONE_KEYS:
+        estimate = sketch.mean() if key == 'mean' else sketch.quantile(key)
+
+        # only compare where wealth is well above the zero bucket
+        significant = np.abs(exact[key]) > 100 * sketch.min_value
+        percentile_error = np.abs(estimate - exact[key])[significant] / np.abs(exact[key])[significant]
+
+        if key == 'mean':
+            order_statistic_error = percentile_error
+        else:
+            rank = int(np.floor(key / 100 * (num_simulations - 1)))
+            order_statistic = sorted_wealths[rank]
+            order_statistic_error = (np.abs(estimate - order_statistic)[significant] /
+                                     np.abs(order_statistic)[significant])
+            assert order_statistic_error.max() <= relative_accuracy * (1 + 1e-9), \
+                'error: the {}th percentile is outside the documented bound'.format(key)
+
+        print('{:>6} {:>26.5f} {:>26.5f}'.format(str(key), order_statistic_error.max(), percentile_error.max()))
+
+
+def check_drop_in(num_simulations=20000):
+    '''
+    check that the streaming plan returns the same tuple as fn.financial_plan() (without the wealth paths)
+    '''
+
+    params, contributions = default_plan(num_simulations)
+    equity_returns = fn.random_walk_simulations(mean=0.08, stdev=0.14, periods=72, num_simulations=num_simulations)
+    bond_returns = np.full(72, 0.01)
+    bond_returns[0] = 0.0
+
+    exact = fn.financial_plan(params, contributions, equity_returns, bond_returns)
+    plan = streaming.streaming_financial_plan(params, contributions, num_simulations)
+
+    assert len(plan) == len(exact) and plan[4] is None, 'error: the streaming plan returns a different tuple'
+    for i in (1, 2, 3):
+        assert plan[i].shape == exact[i].shape, 'error: item {} of the plan has a different shape'.format(i)
+    assert plan[0] == exact[0] and plan[6].keys() == exact[6].keys(), 'error: the plans report different stats'
+
+    print('drop-in for financial_plan: 50th percentile of wealth at the final age {:,.0f} '
+          '(exact, on other paths: {:,.0f})'.format(plan[5][50][-1], exact[5][50][-1]))
+
+
+def measure_memory(num_simulations=1000000, chunk_size=10000):
+
+    params, contributions = default_plan(num_simulations)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    plan = streaming.streaming_financial_plan(params, contributions, num_simulations, chunk_size=chunk_size)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    full_matrices = 2 * num_simulations * 72 * 8
+
+    print('{:,} paths in chunks of {:,}: {:.1f} s, peak traced memory {:.0f} MB '
+          '(the full wealth and return matrices alone would need {:.0f} MB)'.format(
+              num_simulations, chunk_size, elapsed, peak / 1024 ** 2, full_matrices / 1024 ** 2))
+
+
+if __name__ == '__main__':
+    check_error_bounds()
+    check_drop_in()
+    measure_memory()
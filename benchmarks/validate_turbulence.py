@@ -0,0 +1,67 @@
+'''
+check the rolling turbulence engine against the turbulence of every date computed from scratch, and time the full
+history of synthetic daily returns (see validate_absorption_ratio.py; the industry returns are not part of the
+repository).
+
+run from the repository root:
+
+    python benchmarks/validate_turbulence.py
+'''
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps import turbulence
+from validate_absorption_ratio import synthetic_returns
+
+
+def check_against_windows(num_days=3000, num_checks=50):
+
+    returns = synthetic_returns(num_days)
+    rolling = turbulence.rolling_turbulence(returns)
+
+    window = turbulence.WINDOW
+    values = returns.to_numpy()
+
+    max_error = 0.0
+    for i in np.linspace(0, len(rolling) - 1, num_checks).astype(int):
+        expected = turbulence.turbulence(values[window + i], values[i:window + i])
+        max_error = max(max_error, abs(rolling['turbulence'].iloc[i] - expected) / expected)
+
+    print('rolling turbulence against {} windows from scratch: max relative error {:.2e}'.format(num_checks,
+                                                                                                 max_error))
+
+
+def time_history(num_days=12000):
+
+    for num_assets in [49, 100]:
+        returns = synthetic_returns(num_days, num_assets=num_assets)
+
+        start = time.perf_counter()
+        rolling = turbulence.rolling_turbulence(returns)
+        elapsed = time.perf_counter() - start
+
+        # the same history, inverting the covariance matrix of every window (timed on a sample of dates)
+        sample = np.arange(0, len(rolling), 50)
+        values = returns.to_numpy()
+        start = time.perf_counter()
+        for i in sample:
+            turbulence.turbulence(values[turbulence.WINDOW + i], values[i:turbulence.WINDOW + i])
+        from_scratch = (time.perf_counter() - start) / len(sample) * len(rolling)
+
+        print('{:,} days x {} assets: {:.2f}s rolling, about {:.1f}s from scratch (mean turbulence {:.1f})'.format(
+            num_days, num_assets, elapsed, from_scratch, rolling['turbulence'].mean()))
+
+
+def main():
+    check_against_windows()
+    time_history()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+'''
+check the single-pass quantile reducer (apps.functions.wealth_quantiles) against the original
+np.median / np.percentile implementation of wealth_distributions and compare their run times.
+
+run from the repository root:
+
+    python benchmarks/validate_wealth_quantiles.py
+'''
+
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps import functions as fn
+
+
+def legacy_wealth_distributions(x):
+    # the original implementation, kept here as the reference
+    return {'mean': np.mean(x, axis=0),
+            'median': np.median(x, axis=0),
+            75: np.percentile(x, 75, axis=0),
+            50: np.percentile(x, 50, axis=0),
+            25: np.percentile(x, 25, axis=0),
+            10: np.percentile(x, 10, axis=0),
+            5: np.percentile(x, 5, axis=0),
+            1: np.percentile(x, 1, axis=0)}
+
+
+def time_call(func, repeat=5, number=5):
+    # best-of-n average time per call, in milliseconds
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number * 1000
+
+
+def main(num_simulations=10000, num_periods=72):
+
+    equity_returns = fn.random_walk_simulations(mean=0.08, stdev=0.14, periods=num_periods,
+                                                num_simulations=num_simulations)
+    allocations = fn.calc_asset_allocations(30, 60, 30 + num_periods - 1, percent_at_retirement=0.6, glide_length=10)
+    contributions = fn.calc_contributions(30, 60, 30 + num_periods - 1, user_save=9000, user_spend=60000,
+                                          user_social_security_age=67, user_social_security_benefit=18000)
+    wealths = fn.calc_wealth_trajectory(np.full(num_simulations, 30000), equity_returns, 0.01,
+                                        allocations, contributions)
+
+    samples = {'wealths': wealths,
+               'small sample (n=7)': wealths[:7],
+               'even sample (n=10)': wealths[:10],
+               'single simulation': wealths[:1]}
+
+    # 1. every statistic has to match the original implementation
+    for name, x in samples.items():
+        expected = legacy_wealth_distributions(x)
+        actual = fn.wealth_distributions(x)
+        for key in fn.DISTRIBUTION_KEYS:
+            assert np.allclose(actual[key], expected[key], rtol=1e-12, atol=1e-6), \
+                'error: {} does not match for {}'.format(key, name)
+
+    # 2. requesting a subset of keys returns exactly those keys
+    subset = fn.wealth_quantiles(wealths, keys=fn.REPORTED_KEYS)
+    assert list(subset.keys()) == fn.REPORTED_KEYS
+
+    print('wealth_quantiles matches np.median / np.percentile on all samples')
+
+    # 3. timings
+    print('{:,} simulations x {} periods'.format(num_simulations, num_periods))
+    cases = {'legacy wealth_distributions': lambda: legacy_wealth_distributions(wealths),
+             'wealth_distributions (all keys)': lambda: fn.wealth_distributions(wealths),
+             'wealth_quantiles (75/mean/25/5)': lambda: fn.wealth_quantiles(wealths, keys=fn.REPORTED_KEYS)}
+
+    baseline = None
+    for name, func in cases.items():
+        ms = time_call(func)
+        baseline = baseline or ms
+        print('{:<34} {:8.2f} ms   {:5.1f}x'.format(name, ms, baseline / ms))
+
+
+if __name__ == '__main__':
+    main()